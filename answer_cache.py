@@ -0,0 +1,151 @@
+# answer_cache.py
+import os
+import re
+import copy
+import logging
+import numpy as np
+
+from ttl_cache import TTLCache
+from embeddings import embeddings_enabled, embed_text
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+ANSWER_CACHE_SIZE = int(os.getenv('ANSWER_CACHE_SIZE', '1000'))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600'))
+# Cosine similarity between query embeddings above which two questions share an answer
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv('ANSWER_CACHE_SIMILARITY_THRESHOLD', '0.95'))
+
+_WHITESPACE = re.compile(r"\s+")
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query(query):
+    """Case, whitespace and trailing punctuation do not change the question."""
+    return _WHITESPACE.sub(" ", query).strip().rstrip("?!. ").lower()
+
+
+class AnswerCache:
+    """
+    First-turn answers keyed on (settings update_id, normalized query).
+
+    Exact matches are a dict lookup. Near-duplicates are found by cosine
+    similarity of query embeddings; the embedding matrix is rebuilt lazily,
+    only after the set of entries has changed. All entries are dropped when
+    the settings update_id changes.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, similarity_threshold):
+        self._cache = TTLCache(max_entries, ttl_seconds)
+        self.similarity_threshold = similarity_threshold
+        self._update_id = None
+        self._matrix = None
+        self._matrix_keys = []
+        self._dirty = False
+        self._stats = {'exact_hits': 0, 'semantic_hits': 0, 'misses': 0, 'invalidations': 0}
+
+    def _check_version(self, update_id):
+        if update_id != self._update_id:
+            if self._update_id is not None and len(self._cache):
+                self._stats['invalidations'] += 1
+            self._cache.clear()
+            self._matrix = None
+            self._matrix_keys = []
+            self._dirty = False
+            self._update_id = update_id
+
+    def get_exact(self, update_id, normalized):
+        self._check_version(update_id)
+        entry = self._cache.get(normalized)
+        if entry is not None:
+            self._stats['exact_hits'] += 1
+            return entry['result']
+        return None
+
+    def get_similar(self, update_id, embedding):
+        self._check_version(update_id)
+        if self._dirty:
+            live = [(key, entry['embedding']) for key, entry in self._cache.items() if entry['embedding'] is not None]
+            self._matrix_keys = [key for key, _ in live]
+            self._matrix = np.vstack([vector for _, vector in live]) if live else None
+            self._dirty = False
+        if self._matrix is None:
+            return None
+
+        similarities = self._matrix @ embedding
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.similarity_threshold:
+            return None
+        entry = self._cache.get(self._matrix_keys[best])
+        if entry is None:
+            # Expired since the matrix was built
+            self._dirty = True
+            return None
+        self._stats['semantic_hits'] += 1
+        return entry['result']
+
+    def record_miss(self):
+        self._stats['misses'] += 1
+
+    def set(self, update_id, normalized, result, embedding):
+        self._check_version(update_id)
+        self._cache.set(normalized, {'result': result, 'embedding': embedding})
+        self._dirty = True
+
+    def stats(self):
+        hits = self._stats['exact_hits'] + self._stats['semantic_hits']
+        lookups = hits + self._stats['misses']
+        return {
+            **self._stats,
+            'hit_rate': (hits / lookups) if lookups else None,
+            'entries': len(self._cache),
+            'max_entries': self._cache.max_entries,
+            'evictions': self._cache.evictions,
+            'ttl_seconds': self._cache.ttl_seconds,
+            'similarity_threshold': self.similarity_threshold,
+            'semantic_matching': embeddings_enabled(),
+            'update_id': self._update_id,
+        }
+
+
+answer_cache = AnswerCache(ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL_SECONDS, ANSWER_CACHE_SIMILARITY_THRESHOLD)
+
+
+async def lookup_answer(config, user_query):
+    """
+    Returns (result, match, state). `result` is a copy of the cached answer or
+    None; `match` is "exact" or "semantic". `state` is passed back to
+    store_answer on a miss so the query embedding is not computed twice.
+    """
+    state = miss_state(user_query)
+    normalized = state['normalized']
+
+    result = answer_cache.get_exact(config['update_id'], normalized)
+    if result is not None:
+        return copy.deepcopy(result), "exact", state
+
+    if embeddings_enabled():
+        try:
+            state['embedding'] = await embed_text(config['openai_client'], normalized)
+        except Exception as e:
+            # The cache is optional: without an embedding it is an exact-match miss
+            logger.warning("Semantic answer-cache lookup skipped, query embedding failed: %s", e)
+        if state['embedding'] is not None:
+            result = answer_cache.get_similar(config['update_id'], state['embedding'])
+            if result is not None:
+                return copy.deepcopy(result), "semantic", state
+
+    answer_cache.record_miss()
+    return None, None, state
+
+
+def miss_state(user_query):
+    """Lookup state for a query that was not (or could not be) looked up semantically."""
+    return {'normalized': normalize_query(user_query), 'embedding': None}
+
+
+def store_answer(config, state, result):
+    answer_cache.set(config['update_id'], state['normalized'], copy.deepcopy(result), state['embedding'])
+
+
+def get_answer_cache_stats():
+    return {'enabled': ANSWER_CACHE_ENABLED, **answer_cache.stats()}
@@ -0,0 +1,85 @@
+# answer_postprocess.py
+"""
+Hot path of /ask around the completion: turning search records into prompt
+chunks before it, and turning the model reply into the remapped answer and
+citation list after it. Every step is a single pass over its input;
+benchmarks/bench_postprocess.py measures them against the previous version.
+"""
+import re
+
+# A bracketed citation group such as [3] or [1, 4]
+CITATION_PATTERN = re.compile(r"\[(.*?)\]")
+
+
+def build_chunks(records, start_index):
+    """Search records -> chunk objects with sequential ids from `start_index`."""
+    return [
+        {
+            "id": chunk_id,
+            "title": record["title"],
+            "chunk": record["chunk"],
+            "parent_id": record["parent_id"],
+            "score": record["score"],
+        }
+        for chunk_id, record in enumerate(records, start_index)
+    ]
+
+
+def dedupe_chunks(chunks):
+    """Drop chunks whose text was already seen, keeping the first occurrence."""
+    seen = set()
+    unique = []
+    for chunk in chunks:
+        text = chunk["chunk"]
+        if text not in seen:
+            seen.add(text)
+            unique.append(chunk)
+    return unique
+
+
+def remap_citations(reply):
+    """
+    Renumber citation ids in order of first appearance (first cited source
+    becomes [1], ...) in one regex pass: an id's new number only depends on
+    the ids before it, so the mapping is built while substituting.
+
+    Groups are rewritten sorted and de-duplicated; non-numeric parts are
+    dropped (so "[x]" becomes "[]"), as the prompt contract has always done.
+
+    Returns (remapped_reply, id_mapping) where id_mapping preserves
+    first-appearance order.
+    """
+    mapping = {}
+
+    def repl(match):
+        new_ids = set()
+        for part in match.group(1).split(","):
+            part = part.strip()
+            if part.isdecimal():
+                old_id = int(part)
+                new_id = mapping.get(old_id)
+                if new_id is None:
+                    new_id = mapping[old_id] = len(mapping) + 1
+                new_ids.add(new_id)
+        return f"[{', '.join(map(str, sorted(new_ids)))}]"
+
+    return CITATION_PATTERN.sub(repl, reply), mapping
+
+
+def build_citations(chunks, id_mapping):
+    """Cited chunks, renumbered, in citation order. Ids with no chunk are skipped."""
+    chunks_by_id = {}
+    for chunk in chunks:
+        chunks_by_id.setdefault(chunk["id"], chunk)
+    citations = []
+    for old_id, new_id in id_mapping.items():
+        chunk = chunks_by_id.get(old_id)
+        if chunk is not None:
+            citations.append({**chunk, "id": new_id})
+    return citations
+
+
+def postprocess_answer(reply, chunks):
+    """Model reply -> (ai_response with remapped ids, citations)."""
+    ai_response, id_mapping = remap_citations(reply)
+    return ai_response, build_citations(chunks, id_mapping)
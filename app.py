@@ -1,20 +1,75 @@
 # app.py
-from quart import Quart, request, jsonify
-from saml import saml_login, saml_callback, extract_token
+from quart import Quart, request, jsonify, make_response, g
+from log_config import configure_logging, request_id_var, get_logging_stats
+configure_logging()  # Before the other imports so their loggers go through the queue
+from saml import saml_login, saml_callback, extract_token, get_saml_stats
+from db_pool import init_db_pool, close_db_pool, get_pool_stats
+from ingestion import start_ingestion, close_ingestion, get_ingestion_stats
 import os
+import json
+import uuid
+import logging
+import asyncio
+import time
+from token_utils import init_tokenizer
+from upstream_limiter import UpstreamBusy, get_upstream_stats
+from deadlines import DeadlineExceeded
+from metrics import HTTP_REQUEST_SECONDS, metrics_payload, mark_worker_exited
 
 # Import the refactored function
-from search_query import ask_query  # Renamed to avoid conflict with route name
+from search_query import ask_query, ask_query_stream, get_single_flight_stats, get_search_latency_stats  # Renamed to avoid conflict with route name
 
-# --- In-memory store for conversation history (TEMPORARY - NOT for production) ---
-# This will not persist across restarts or multiple Flask processes/instances.
-user_conversations = {}  # Define the single source of truth here
+# --- Store for conversation history ---
+# CONVERSATION_STORE_BACKEND=memory keeps it in this process (single worker only);
+# =postgres shares it across workers and instances. See conversation_store.py.
+from conversation_store import create_conversation_store
+user_conversations = create_conversation_store()  # Define the single source of truth here
+
+logger = logging.getLogger(__name__)
 
 # Initialize Quart app
 app = Quart(__name__)
 app.config["SAML_PATH"] = os.path.join(os.path.dirname(os.path.abspath(__file__)), "saml")
 app.config["SECRET_KEY"] = os.getenv('JWT_SECRET_KEY')  # Replace with hardcoded key or securely read it, as you prefer.
 
+# ---- DB pool / conversation store lifecycle ----
+@app.before_serving
+async def startup():
+    try:
+        await init_db_pool()
+    except Exception as e:
+        # The pool is created lazily on first use if the database is not reachable yet
+        logger.error("Could not create DB pool at startup: %s", e)
+    await user_conversations.start()
+    await start_ingestion()
+    await asyncio.to_thread(init_tokenizer)
+
+@app.after_serving
+async def shutdown():
+    await user_conversations.close()  # Flush buffered turns while the pool is still open
+    await close_ingestion()  # Flush queued /log and /feedback rows
+    await close_db_pool()
+    mark_worker_exited()
+
+# ---- Request id / metrics ----
+@app.before_request
+async def start_request():
+    g.request_start = time.perf_counter()
+    # Reuse the caller's id (front door, load balancer) so logs can be correlated
+    g.request_id = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    request_id_var.set(g.request_id)
+
+@app.after_request
+async def observe_request(response):
+    start = g.get("request_start")
+    if start is not None:
+        # Label by route pattern, not raw path, to keep cardinality bounded
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        HTTP_REQUEST_SECONDS.labels(route, request.method, str(response.status_code)).observe(time.perf_counter() - start)
+    if g.get("request_id"):
+        response.headers["X-Request-ID"] = g.request_id
+    return response
+
 # ---- Basic route ----
 @app.route('/')
 async def hello():
@@ -46,10 +101,55 @@ async def call_ask():
         # Call the refactored function, passing the shared conversation store
         result = await ask_query(user_query, user_id, user_conversations)
         return jsonify(result)
+    except UpstreamBusy as e:
+        # Throttled / saturated upstream: tell the client when to retry instead of a 500
+        logger.warning("Upstream busy for /ask: %s", e, extra={"user_id": user_id})
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(max(1, round(e.retry_after)))}
+    except DeadlineExceeded as e:
+        logger.warning("/ask ran out of time: %s", e, extra={"user_id": user_id, "stage": e.stage})
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
-        print(f"Error processing request for user {user_id}: {e}")
+        logger.exception("Error processing /ask request", extra={"user_id": user_id})
         return jsonify({"error": str(e)}), 500
 
+# ---- Streaming ask route (Server-Sent Events) ----
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/ask/stream', methods=['POST'])
+async def call_ask_stream():
+    data = await request.get_json()
+    user_id = data.get("user_id", "default_user")
+    user_query = data.get("query")
+    if not user_query:
+        return jsonify({"error": "Missing 'query' in request body"}), 400
+
+    request_id = request_id_var.get()
+
+    async def event_stream():
+        # The body is sent outside the handler's context: carry the request id over
+        request_id_var.set(request_id)
+        try:
+            async for event, payload in ask_query_stream(user_query, user_id, user_conversations):
+                yield format_sse(event, payload)
+        except UpstreamBusy as e:
+            logger.warning("Upstream busy for /ask/stream: %s", e, extra={"user_id": user_id})
+            yield format_sse("error", {"error": str(e), "retry_after": e.retry_after})
+        except DeadlineExceeded as e:
+            logger.warning("/ask/stream ran out of time: %s", e, extra={"user_id": user_id, "stage": e.stage})
+            yield format_sse("error", {"error": str(e), "timeout": True})
+        except Exception as e:
+            logger.exception("Error streaming /ask/stream request", extra={"user_id": user_id})
+            yield format_sse("error", {"error": str(e)})
+
+    response = await make_response(event_stream(), 200, {
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # Stop proxies from buffering the stream
+    })
+    response.timeout = None  # Generation can outlast Quart's default response timeout
+    return response
+
 # ---- All other sync routes ----
 from user_login_log import log_user
 @app.route('/log/user', methods=['POST'])
@@ -83,7 +183,7 @@ async def call_update_settings():
 
 
 
-from report import azai_report
+from report import azai_report, azai_report_page, export_azai_report, DEFAULT_PAGE_SIZE
 @app.route('/azai_report', methods=['POST'])
 async def call_azai_report():
     try:
@@ -100,6 +200,23 @@ async def call_azai_report():
         if not start_date or not end_date:
             return jsonify({"error": "start_date and end_date are required"}), 400
         
+        # Cursor pagination: only the requested page is read from the database
+        if 'page_size' in data or 'cursor' in data:
+            try:
+                page_size = int(data.get('page_size') or DEFAULT_PAGE_SIZE)
+                result = await azai_report_page(
+                    start_date=start_date,
+                    end_date=end_date,
+                    user_name=user_name,
+                    feedback_type=feedback_type,
+                    page_size=page_size,
+                    cursor=data.get('cursor'),
+                    include_count=bool(data.get('include_count', False))
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify(result)
+        
         # Call the function with extracted parameters
         result = await azai_report(
             start_date=start_date,
@@ -113,6 +230,36 @@ async def call_azai_report():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     
+
+@app.route('/azai_report/export', methods=['POST'])
+async def call_azai_report_export():
+    # Same filters as /azai_report plus "format": "csv" (default) or "ndjson"
+    data = await request.get_json()
+    start_date = data.get('start_date')
+    end_date = data.get('end_date')
+    if not start_date or not end_date:
+        return jsonify({"error": "start_date and end_date are required"}), 400
+
+    export_format = (data.get('format') or 'csv').lower()
+    try:
+        chunks = export_azai_report(
+            start_date=start_date,
+            end_date=end_date,
+            user_name=data.get('user_name'),
+            feedback_type=data.get('feedback_type'),
+            export_format=export_format
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    content_type = "text/csv; charset=utf-8" if export_format == 'csv' else "application/x-ndjson"
+    response = await make_response(chunks, 200, {
+        "Content-Type": content_type,
+        "Content-Disposition": f'attachment; filename="azai_report_{start_date}_{end_date}.{export_format}"'
+    })
+    response.timeout = None  # Large ranges can take longer than the default response timeout
+    return response
+    
     
 from distinct_values import get_distinct_values
 @app.route('/distinct_values', methods=['GET'])
@@ -143,6 +290,48 @@ async def delete_reports_access_route():
 
 
 
+from follow_ups import get_follow_ups, get_follow_ups_stats
+@app.route('/follow_ups', methods=['POST'])
+async def call_get_follow_ups():
+    return await get_follow_ups()
+
+
+from load_settings_and_clients_from_db import get_settings_cache_stats
+from answer_cache import get_answer_cache_stats
+from embeddings import get_embedding_cache_stats
+from search_cache import get_search_cache_stats
+from hot_chunks import get_hot_chunk_stats
+from near_dedup import get_near_dedup_stats
+from report_users import get_report_users_stats
+@app.route('/stats', methods=['GET'])
+async def call_stats():
+    return jsonify({
+        "settings_cache": get_settings_cache_stats(),
+        "db_pool": get_pool_stats(),
+        "follow_ups": get_follow_ups_stats(),
+        "answer_cache": get_answer_cache_stats(),
+        "embeddings": get_embedding_cache_stats(),
+        "search_cache": get_search_cache_stats(),
+        "hot_chunks": get_hot_chunk_stats(),
+        "near_dedup": get_near_dedup_stats(),
+        "single_flight": get_single_flight_stats(),
+        "upstream": get_upstream_stats(),
+        "search_latency": get_search_latency_stats(),
+        "conversations": user_conversations.stats(),
+        "ingestion": get_ingestion_stats(),
+        "report_users": get_report_users_stats(),
+        "saml": get_saml_stats(),
+        "logging": get_logging_stats()
+    })
+
+
+# ---- Prometheus metrics ----
+@app.route('/metrics', methods=['GET'])
+async def call_metrics():
+    body, content_type = metrics_payload()
+    return body, 200, {"Content-Type": content_type}
+
+
 # ---- Optional sync test route ----
 @app.route("/ping", methods=["GET"])
 def ping():
@@ -0,0 +1,97 @@
+# benchmarks/bench_near_dedup.py
+"""
+Micro-benchmark for the near-duplicate chunk filter (near_dedup.py).
+
+Builds 2 x number_of_chunks synthetic chunks, some of them shifted copies of
+others (overlapping chunker windows) under a different parent_id, checks the
+copies are the ones removed, and prints per-call timings with cold and warm
+signature caches. Fails if a cold call (every chunk new) exceeds --budget-ms.
+
+Usage (from the repository root):
+    python benchmarks/bench_near_dedup.py [--number-of-chunks 10] [--words 200] [--budget-ms 1.0]
+"""
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import near_dedup  # noqa: E402
+from near_dedup import filter_near_duplicates  # noqa: E402
+
+_VOCABULARY = (
+    "policy employee manager approval travel expense receipt claim leave annual sick "
+    "parental holiday overtime payroll benefit pension insurance contract notice "
+    "probation review grievance training laptop security password remote office"
+).split()
+
+
+def make_chunks(count, duplicates, words, rng):
+    chunks = []
+    for i in range(count - duplicates):
+        text = " ".join(rng.choice(_VOCABULARY) for _ in range(words))
+        chunks.append({
+            "id": i + 1,
+            "title": f"Document {i}",
+            "chunk": text,
+            "parent_id": f"https://example.blob.core.windows.net/docs/doc{i % 7}.pdf",
+            "score": 1 + rng.random() * 3,
+        })
+    for j in range(duplicates):
+        # The next chunker window over the same passage, indexed under another name
+        original = chunks[j]
+        shift = words // 40
+        text = " ".join(original["chunk"].split()[shift:] + [rng.choice(_VOCABULARY) for _ in range(shift)])
+        chunks.append({
+            "id": count - duplicates + j + 1,
+            "title": original["title"],
+            "chunk": text,
+            "parent_id": original["parent_id"].replace(".pdf", "_v2.pdf"),
+            "score": original["score"] / 2,
+        })
+    return chunks
+
+
+def bench(label, fn, repeat, number):
+    best = min(timeit.repeat(fn, repeat=repeat, number=number)) / number
+    print(f"  {label:<10} {best * 1e6:10.1f} us/call")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--number-of-chunks", type=int, default=10, help="the number_of_chunks setting")
+    parser.add_argument("--duplicates", type=int, default=4)
+    parser.add_argument("--words", type=int, default=200, help="words per chunk")
+    parser.add_argument("--threshold", type=float, default=near_dedup.DEFAULT_NEAR_DUP_THRESHOLD)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--budget-ms", type=float, default=1.0, help="maximum cold time per call")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    count = 2 * args.number_of_chunks
+    chunks = make_chunks(count, args.duplicates, args.words, rng)
+
+    kept, report = filter_near_duplicates(chunks, args.threshold)
+    removed = {chunk["id"] for chunk in chunks} - {chunk["id"] for chunk in kept}
+    expected = {chunk["id"] for chunk in chunks[count - args.duplicates:]}
+    assert removed == expected, f"removed {sorted(removed)}, expected {sorted(expected)}"
+
+    print(f"{count} chunks of {args.words} words, {args.duplicates} near-duplicates: {report}")
+
+    def cold():
+        near_dedup._signatures.clear()
+        filter_near_duplicates(chunks, args.threshold)
+
+    print("filter_near_duplicates")
+    cold_seconds = bench("cold", cold, args.repeat, max(1, args.number // 10))
+    bench("warm", lambda: filter_near_duplicates(chunks, args.threshold), args.repeat, args.number)
+    assert cold_seconds * 1e3 < args.budget_ms, f"cold call took {cold_seconds * 1e3:.2f} ms, budget {args.budget_ms} ms"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# benchmarks/bench_postprocess.py
+"""
+Micro-benchmark for the /ask post-processing path (answer_postprocess.py).
+
+Runs the single-pass implementation against a copy of the previous
+implementation on synthetic replies and chunk sets, checks both produce the
+same output, and prints per-call timings.
+
+Usage (from the repository root):
+    python benchmarks/bench_postprocess.py [--chunks 40] [--citations 400] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from answer_postprocess import build_chunks, dedupe_chunks, postprocess_answer  # noqa: E402
+
+
+# ==================== Previous implementation (reference) ====================
+
+def legacy_chunks(records, start_index):
+    chunks = []
+    sources = []
+    i = 0
+    for record in records:
+        chunk_id = start_index + i
+        chunks.append({
+            "id": chunk_id,
+            "title": record["title"],
+            "chunk": record["chunk"],
+            "parent_id": record["parent_id"],
+            "score": record["score"],
+        })
+        sources.append(
+            f"Source ID: [{chunk_id}]\nContent: {record['chunk']}\nDocument: {record['parent_id']}"
+        )
+        i += 1
+    seen_chunks = set()
+    all_chunks = []
+    for chunk in chunks:
+        if chunk["chunk"] not in seen_chunks:
+            seen_chunks.add(chunk["chunk"])
+            all_chunks.append(chunk)
+    return all_chunks
+
+
+def legacy_postprocess(full_reply, all_chunks):
+    flat_ids = []
+    for match in re.findall(r"\[(.*?)\]", full_reply):
+        for p in match.split(","):
+            if p.strip().isdigit():
+                flat_ids.append(int(p.strip()))
+
+    unique_original_ids = []
+    for cid in flat_ids:
+        if cid not in unique_original_ids:
+            unique_original_ids.append(cid)
+
+    id_mapping = {old_id: new_id + 1 for new_id, old_id in enumerate(unique_original_ids)}
+
+    def repl(match):
+        nums = [int(p.strip()) for p in match.group(1).split(",") if p.strip().isdigit()]
+        return f"[{', '.join(map(str, sorted(set(id_mapping.get(n, n) for n in nums))))}]"
+
+    ai_response = re.sub(r"\[(.*?)\]", repl, full_reply)
+
+    citations = []
+    for old_id in unique_original_ids:
+        for chunk in all_chunks:
+            if chunk["id"] == old_id:
+                citations.append({**chunk, "id": id_mapping[old_id]})
+                break
+    return ai_response, citations
+
+
+# ==================== Synthetic data ====================
+
+def make_records(count, rng):
+    records = []
+    for i in range(count):
+        # ~10% duplicated chunk text, as happens between the two searches
+        text_id = rng.randrange(i) if i and rng.random() < 0.1 else i
+        records.append({
+            "title": f"Document {i}",
+            "chunk": f"Chunk body {text_id} " + "lorem ipsum " * 80,
+            "parent_id": f"https://example.blob.core.windows.net/docs/doc{i % 7}.pdf",
+            "score": rng.random() * 4,
+        })
+    return records
+
+
+def make_reply(chunk_ids, citations, rng):
+    parts = []
+    for _ in range(citations):
+        parts.append("Some generated sentence about the policy in question " * 2)
+        group = rng.sample(chunk_ids, k=min(len(chunk_ids), rng.choice((1, 1, 2, 3))))
+        parts.append(f"[{', '.join(map(str, group))}]. ")
+    # Ids not present in the chunk set and a non-numeric bracket
+    parts.append(f"See also [{max(chunk_ids) + 50}] and [n/a].")
+    return "".join(parts)
+
+
+def bench(label, fn, repeat, number):
+    best = min(timeit.repeat(fn, repeat=repeat, number=number)) / number
+    print(f"  {label:<10} {best * 1e6:10.1f} us/call")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--citations", type=int, default=400)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--number", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    records = make_records(args.chunks, rng)
+    chunks = dedupe_chunks(build_chunks(records, 1))
+    reply = make_reply([c["id"] for c in chunks], args.citations, rng)
+
+    assert chunks == legacy_chunks(records, 1), "chunk building differs"
+    assert postprocess_answer(reply, chunks) == legacy_postprocess(reply, chunks), "post-processing differs"
+
+    print(f"{len(chunks)} chunks, reply of {len(reply)} chars with {args.citations} citation groups")
+    for title, new, old in (
+        ("chunk building + dedup", lambda: dedupe_chunks(build_chunks(records, 1)), lambda: legacy_chunks(records, 1)),
+        ("citation post-processing", lambda: postprocess_answer(reply, chunks), lambda: legacy_postprocess(reply, chunks)),
+    ):
+        print(title)
+        old_time = bench("previous", old, args.repeat, args.number)
+        new_time = bench("current", new, args.repeat, args.number)
+        print(f"  speedup    {old_time / new_time:10.2f}x")
+
+
+if __name__ == "__main__":
+    main()
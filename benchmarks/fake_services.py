@@ -0,0 +1,219 @@
+# benchmarks/fake_services.py
+"""
+Local stand-ins for Azure AI Search and Azure OpenAI, for load testing.
+
+One aiohttp server answers:
+  - POST /indexes('<index>')/docs/search.post.search
+        the request AsyncSearchClient.search sends (hybrid + semantic)
+  - POST /openai/deployments/<deployment>/chat/completions
+        AsyncAzureOpenAI chat completions, streamed (SSE) or not
+  - POST /openai/deployments/<deployment>/embeddings
+        deterministic unit vectors derived from the input text
+
+Latency is configurable so the backend sees realistic upstream timings: a
+fixed search latency, a time-to-first-token, and a token rate for the
+completion body. --throttle-ratio answers that share of completions with
+429 + Retry-After, like a deployment over its TPM quota.
+
+Usage:
+    python benchmarks/fake_services.py --port 8900 --search-latency-ms 80 \\
+        --ttft-ms 400 --tokens-per-second 80 --reply-tokens 200
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+import numpy as np
+from aiohttp import web
+
+# Words the fake model "generates"; one word is treated as one token
+_WORDS = (
+    "policy employees must request approval before travel and submit receipts "
+    "within thirty days the manager reviews each claim according to the handbook"
+).split()
+
+
+def _jittered(ms, jitter):
+    """Seconds to sleep for `ms` +/- `jitter` (fraction)."""
+    return max(0.0, ms * (1 + random.uniform(-jitter, jitter))) / 1000
+
+
+def _make_documents(count):
+    documents = []
+    for i in range(count):
+        body = " ".join(_WORDS[(i + j) % len(_WORDS)] for j in range(120))
+        documents.append({
+            "title": f"Policy document {i}",
+            "chunk": f"Section {i}. {body}",
+            "parent_id": f"https://example.blob.core.windows.net/policies/policy_{i % 25}.pdf",
+        })
+    return documents
+
+
+def _pick_documents(documents, query, top):
+    # Same query -> same documents, different queries -> overlapping sets
+    seed = int.from_bytes(hashlib.sha256(query.encode("utf-8")).digest()[:8], "big")
+    start = seed % len(documents)
+    return [documents[(start + i) % len(documents)] for i in range(top)]
+
+
+def _reply_text(prompt, reply_tokens):
+    # Cite a few of the source ids that appear in the prompt, like the real model
+    ids = [part.split("]", 1)[0] for part in prompt.split("Source ID: [")[1:]]
+    words = [random.choice(_WORDS) for _ in range(reply_tokens)]
+    for position, source_id in zip(range(12, reply_tokens, 25), ids[:6]):
+        words[position] += f" [{source_id}]."
+    return " ".join(words)
+
+
+def _completion_chunk(completion_id, model, content=None, finish_reason=None):
+    delta = {} if content is None else {"role": "assistant", "content": content}
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+# ==================== Handlers ====================
+
+async def search(request):
+    options = request.app["options"]
+    body = await request.json()
+    await asyncio.sleep(_jittered(options.search_latency_ms, options.jitter))
+
+    top = int(body.get("top") or 50)
+    select = body.get("select")
+    fields = select.split(",") if select else None
+    results = []
+    for rank, document in enumerate(_pick_documents(request.app["documents"], body.get("search", ""), top)):
+        result = {k: v for k, v in document.items() if fields is None or k in fields}
+        result["@search.score"] = 1.0 / (rank + 1)
+        result["@search.rerankerScore"] = 4.0 - rank * (3.0 / max(top, 1))
+        results.append(result)
+    request.app["counters"]["search"] += 1
+    return web.json_response({"value": results})
+
+
+async def chat_completions(request):
+    options = request.app["options"]
+    body = await request.json()
+    model = request.match_info["deployment"]
+    prompt = "\n".join(m.get("content") or "" for m in body.get("messages", []))
+    reply = _reply_text(prompt, options.reply_tokens)
+    tokens = reply.split(" ")
+    completion_id = f"chatcmpl-{random.getrandbits(48):x}"
+    token_delay = 1.0 / options.tokens_per_second if options.tokens_per_second > 0 else 0.0
+    request.app["counters"]["chat"] += 1
+
+    if random.random() < options.throttle_ratio:
+        request.app["counters"]["throttled"] += 1
+        return web.json_response(
+            {"error": {"code": "429", "message": "Rate limit is exceeded. Try again later."}},
+            status=429, headers={"Retry-After": str(options.retry_after_seconds)})
+
+    await asyncio.sleep(_jittered(options.ttft_ms, options.jitter))
+
+    if not body.get("stream"):
+        await asyncio.sleep(token_delay * len(tokens))
+        return web.json_response({
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": reply},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(prompt) // 4,
+                "completion_tokens": len(tokens),
+                "total_tokens": len(prompt) // 4 + len(tokens),
+            },
+        })
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for i, token in enumerate(tokens):
+        chunk = _completion_chunk(completion_id, model, token if i == 0 else " " + token)
+        await response.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        if token_delay:
+            await asyncio.sleep(token_delay)
+    await response.write(f"data: {json.dumps(_completion_chunk(completion_id, model, finish_reason='stop'))}\n\n".encode("utf-8"))
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+async def embeddings(request):
+    options = request.app["options"]
+    body = await request.json()
+    inputs = body.get("input")
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    await asyncio.sleep(_jittered(options.embedding_latency_ms, options.jitter))
+
+    data = []
+    for i, text in enumerate(inputs):
+        seed = int.from_bytes(hashlib.sha256(str(text).lower().encode("utf-8")).digest()[:8], "big")
+        vector = np.random.default_rng(seed).standard_normal(options.embedding_dimensions).astype(np.float32)
+        vector /= np.linalg.norm(vector)
+        data.append({"object": "embedding", "index": i, "embedding": vector.tolist()})
+    request.app["counters"]["embeddings"] += 1
+    return web.json_response({
+        "object": "list",
+        "data": data,
+        "model": request.match_info["deployment"],
+        "usage": {"prompt_tokens": 0, "total_tokens": 0},
+    })
+
+
+async def dispatch_search(request):
+    # AsyncSearchClient uses OData-style paths: /indexes('<name>')/docs/search.post.search
+    if request.method == "POST" and request.path.endswith("/docs/search.post.search"):
+        return await search(request)
+    raise web.HTTPNotFound(text=f"fake_services: unsupported path {request.path}")
+
+
+async def stats(request):
+    return web.json_response(request.app["counters"])
+
+
+def build_app(options):
+    app = web.Application(client_max_size=64 * 1024 * 1024)
+    app["options"] = options
+    app["documents"] = _make_documents(options.documents)
+    app["counters"] = {"search": 0, "chat": 0, "embeddings": 0, "throttled": 0}
+    app.router.add_post("/openai/deployments/{deployment}/chat/completions", chat_completions)
+    app.router.add_post("/openai/deployments/{deployment}/embeddings", embeddings)
+    app.router.add_get("/_stats", stats)
+    app.router.add_route("*", "/{tail:.*}", dispatch_search)
+    return app
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local Azure Search / Azure OpenAI stand-ins")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--documents", type=int, default=500, help="size of the fake index")
+    parser.add_argument("--search-latency-ms", type=float, default=80)
+    parser.add_argument("--ttft-ms", type=float, default=400, help="time to first completion token")
+    parser.add_argument("--tokens-per-second", type=float, default=80, help="0 = whole reply at once")
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    parser.add_argument("--embedding-latency-ms", type=float, default=30)
+    parser.add_argument("--embedding-dimensions", type=int, default=256)
+    parser.add_argument("--throttle-ratio", type=float, default=0.0, help="share of completions answered with 429")
+    parser.add_argument("--retry-after-seconds", type=int, default=1)
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- fraction applied to latencies")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    web.run_app(build_app(options), host=options.host, port=options.port, access_log=None)
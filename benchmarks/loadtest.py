@@ -0,0 +1,377 @@
+# benchmarks/loadtest.py
+"""
+End-to-end load test of the Quart app against local stand-ins.
+
+Starts benchmarks/fake_services.py (Azure AI Search + Azure OpenAI) and the
+app under uvicorn, optionally prepares a throwaway Postgres database, then
+drives concurrent virtual users through the front-end flow:
+
+    /saml/token/extract -> /log/user -> repeat(/ask -> /log -> maybe /feedback)
+
+and reports requests, errors, RPS and p50/p95/p99 latency per endpoint.
+
+Postgres comes from the usual DB_HOST / DB_PORT / DB_NAME / DB_USER /
+DB_PASSWORD variables (see db_pool.py). With --setup-db the harness creates
+the tables (loadtest_schema.sql + migrations/*.sql) and inserts a settings
+row pointing the app at the stand-ins, so only use it on a scratch database.
+
+Usage (from the repository root):
+    DB_HOST=localhost DB_NAME=loadtest DB_USER=postgres DB_PASSWORD=... \\
+        python benchmarks/loadtest.py --setup-db --users 50 --duration 60
+
+    # Against an already running app / stand-ins
+    python benchmarks/loadtest.py --app-url http://127.0.0.1:8000 --fakes-url http://127.0.0.1:8900
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+
+import aiohttp
+import jwt  # PyJWT
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+LOADTEST_INDEX_NAME = "loadtest-index"
+LOADTEST_DEPLOYMENT = "loadtest-gpt"
+LOADTEST_PROMPT = """You are a helpful assistant answering questions about company policy.
+Cite sources with their ids in square brackets, e.g. [1] or [2, 3].
+
+Conversation so far:
+{conversation_history}
+
+Sources:
+{sources}
+
+Question: {query}"""
+
+_TOPICS = ["travel", "expenses", "leave", "remote work", "overtime", "training",
+           "equipment", "security", "onboarding", "benefits"]
+_FORMS = ["What is the policy on {}?", "How do I request {}?", "Who approves {}?",
+          "Is there a limit for {}?", "Where can I find the rules for {}?"]
+QUERIES = [form.format(topic) for topic in _TOPICS for form in _FORMS]
+
+ENDPOINTS = ["/saml/token/extract", "/log/user", "/ask", "/log", "/feedback"]
+
+
+# ==================== Results ====================
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.status_counts = {}
+
+    def record(self, status, seconds):
+        self.status_counts[status] = self.status_counts.get(status, 0) + 1
+        if isinstance(status, int) and 200 <= status < 300:
+            self.latencies.append(seconds)
+        else:
+            self.errors += 1
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def summarize(stats, elapsed):
+    summary = {}
+    for endpoint, endpoint_stats in stats.items():
+        latencies = sorted(endpoint_stats.latencies)
+        requests = len(latencies) + endpoint_stats.errors
+        summary[endpoint] = {
+            "requests": requests,
+            "errors": endpoint_stats.errors,
+            "rps": requests / elapsed if elapsed else 0.0,
+            "p50_ms": _ms(_percentile(latencies, 0.50)),
+            "p95_ms": _ms(_percentile(latencies, 0.95)),
+            "p99_ms": _ms(_percentile(latencies, 0.99)),
+            "max_ms": _ms(latencies[-1] if latencies else None),
+            "status_counts": {str(k): v for k, v in endpoint_stats.status_counts.items()},
+        }
+    return summary
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def print_summary(summary, elapsed, users):
+    print(f"\n{users} users, {elapsed:.1f}s")
+    print(f"{'endpoint':<22}{'requests':>9}{'errors':>8}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for endpoint in ENDPOINTS:
+        row = summary.get(endpoint)
+        if not row or not row["requests"]:
+            continue
+        cells = [row[k] if row[k] is not None else "-" for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+        print(f"{endpoint:<22}{row['requests']:>9}{row['errors']:>8}{row['rps']:>9.2f}"
+              + "".join(f"{c:>10}" for c in cells))
+    for endpoint in ENDPOINTS:
+        row = summary.get(endpoint)
+        if row and row["errors"]:
+            print(f"  {endpoint} status counts: {row['status_counts']}")
+
+
+# ==================== Virtual users ====================
+
+async def _call(session, stats, endpoint, method, url, **kwargs):
+    """One timed request. Returns (status, parsed JSON body or None)."""
+    start = time.perf_counter()
+    try:
+        async with session.request(method, url, **kwargs) as response:
+            body = await response.read()
+            status = response.status
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        stats[endpoint].record(type(e).__name__, time.perf_counter() - start)
+        return None, None
+    stats[endpoint].record(status, time.perf_counter() - start)
+    try:
+        return status, json.loads(body)
+    except ValueError:
+        return status, None
+
+
+def make_user_token(secret, user_number):
+    user_data = {
+        "name": f"Load Test User {user_number}",
+        "group": "user",
+        "job_title": "Load tester",
+        "email": f"loadtest{user_number}@example.com",
+    }
+    payload = {
+        "user_data": user_data,
+        "exp": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1),
+    }
+    return jwt.encode(payload, secret, algorithm="HS256")
+
+
+async def virtual_user(user_number, args, session, stats, deadline):
+    base = args.app_url
+    rng = random.Random(args.seed * 100003 + user_number)
+    queries = QUERIES[:args.distinct_queries]
+
+    status, body = await _call(session, stats, "/saml/token/extract", "POST",
+                               f"{base}/saml/token/extract",
+                               params={"token": make_user_token(args.jwt_secret, user_number)})
+    if status != 200:
+        return
+    user_name = body["user_data"]["name"]
+
+    status, body = await _call(session, stats, "/log/user", "POST", f"{base}/log/user",
+                               json={"user_name": user_name})
+    login_session_id = str(body["login_session_id"]) if status == 200 else str(uuid.uuid4())
+
+    user_id = f"loadtest-{user_number}"
+    chat_session_id = str(uuid.uuid4())
+    while time.monotonic() < deadline:
+        query = rng.choice(queries)
+        status, answer = await _call(session, stats, "/ask", "POST", f"{base}/ask",
+                                     json={"user_id": user_id, "query": query})
+        if status == 200 and answer:
+            interaction = {
+                "chat_session_id": chat_session_id,
+                "user_id": user_id,
+                "user_name": user_name,
+                "query": query,
+                "ai_response": answer.get("ai_response", ""),
+                "citations": json.dumps(answer.get("citations", [])),
+                "login_session_id": login_session_id,
+            }
+            await _call(session, stats, "/log", "POST", f"{base}/log",
+                        json={**interaction, "job_title": "Load tester"})
+            if rng.random() < args.feedback_ratio:
+                await _call(session, stats, "/feedback", "POST", f"{base}/feedback",
+                            json={**interaction,
+                                  "feedback_type": rng.choice(["positive", "negative"]),
+                                  "feedback": "load test feedback"})
+        if args.think_time_ms:
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * args.think_time_ms / 1000)
+
+
+async def run_load(args):
+    stats = {endpoint: EndpointStats() for endpoint in ENDPOINTS}
+    timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        start = time.monotonic()
+        deadline = start + args.ramp_up + args.duration
+        tasks = []
+        for user_number in range(args.users):
+            tasks.append(asyncio.create_task(virtual_user(user_number, args, session, stats, deadline)))
+            if args.ramp_up:
+                await asyncio.sleep(args.ramp_up / args.users)
+        await asyncio.gather(*tasks)
+        elapsed = time.monotonic() - start
+
+        app_stats = None
+        try:
+            async with session.get(f"{args.app_url}/stats") as response:
+                if response.status == 200:
+                    app_stats = await response.json()
+        except aiohttp.ClientError:
+            pass
+    return stats, elapsed, app_stats
+
+
+# ==================== Environment setup ====================
+
+async def setup_database(args):
+    """Create the schema on a scratch database and point the settings at the stand-ins."""
+    import asyncpg
+    from db_pool import DB_CONFIG
+
+    conn = await asyncpg.connect(**DB_CONFIG)
+    try:
+        with open(os.path.join(BENCHMARKS_DIR, "loadtest_schema.sql")) as f:
+            await conn.execute(f.read())
+        migrations_dir = os.path.join(REPO_ROOT, "migrations")
+        for name in sorted(os.listdir(migrations_dir)):
+            if name.endswith(".sql"):
+                with open(os.path.join(migrations_dir, name)) as f:
+                    await conn.execute(f.read())
+        await conn.execute("""
+            INSERT INTO azaisearch_ocm_settings2
+            (azure_search_endpoint, azure_search_index_name, current_prompt,
+             openai_model_deployment_name, openai_endpoint, openai_api_version,
+             openai_model_temperature, semantic_configuration_name, openai_api_key,
+             user_name, number_of_chunks)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11)
+        """, args.fakes_url, LOADTEST_INDEX_NAME, LOADTEST_PROMPT,
+            LOADTEST_DEPLOYMENT, args.fakes_url, "2024-10-21",
+            0.2, "default", "loadtest-key",
+            "loadtest", args.number_of_chunks)
+    finally:
+        await conn.close()
+    print(f"✅ Load-test schema ready, settings point at {args.fakes_url}")
+
+
+def _spawn(command, env=None):
+    return subprocess.Popen(command, cwd=REPO_ROOT, env=env)
+
+
+async def _wait_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"{url} exited with code {process.returncode}")
+            try:
+                async with session.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} not ready after {timeout}s")
+
+
+def start_fake_services(args):
+    port = args.fakes_url.rsplit(":", 1)[-1].rstrip("/")
+    return _spawn([
+        sys.executable, os.path.join(BENCHMARKS_DIR, "fake_services.py"),
+        "--port", port,
+        "--search-latency-ms", str(args.search_latency_ms),
+        "--ttft-ms", str(args.ttft_ms),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--reply-tokens", str(args.reply_tokens),
+        "--throttle-ratio", str(args.throttle_ratio),
+    ])
+
+
+def start_app(args):
+    port = args.app_url.rsplit(":", 1)[-1].rstrip("/")
+    env = {
+        **os.environ,
+        "JWT_SECRET_KEY": args.jwt_secret,
+        # The stand-in accepts any key; avoids DefaultAzureCredential lookups
+        "AZURE_SEARCH_API_KEY": os.environ.get("AZURE_SEARCH_API_KEY", "loadtest-key"),
+    }
+    return _spawn([
+        sys.executable, "-m", "uvicorn", "app:app",
+        "--host", "127.0.0.1", "--port", port,
+        "--workers", str(args.workers), "--no-access-log", "--log-level", "warning",
+    ], env=env)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load test /ask, /log and /feedback against local stand-ins")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of steady load after ramp-up")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds over which users start")
+    parser.add_argument("--think-time-ms", type=float, default=500, help="mean pause between a user's questions")
+    parser.add_argument("--feedback-ratio", type=float, default=0.3, help="share of answers that get /feedback")
+    parser.add_argument("--distinct-queries", type=int, default=len(QUERIES),
+                        help="size of the question pool (smaller = more cache hits)")
+    parser.add_argument("--request-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--app-url", help="use a running app instead of starting one")
+    parser.add_argument("--app-port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the started app")
+    parser.add_argument("--fakes-url", help="use running stand-ins instead of starting them")
+    parser.add_argument("--fakes-port", type=int, default=8900)
+    parser.add_argument("--setup-db", action="store_true",
+                        help="create tables and a settings row on the DB_* database (scratch databases only)")
+    parser.add_argument("--number-of-chunks", type=int, default=5)
+    parser.add_argument("--jwt-secret", default=os.environ.get("JWT_SECRET_KEY", "loadtest-secret"))
+    parser.add_argument("--search-latency-ms", type=float, default=80)
+    parser.add_argument("--ttft-ms", type=float, default=400)
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--reply-tokens", type=int, default=200)
+    parser.add_argument("--throttle-ratio", type=float, default=0.0, help="share of completions the stand-in throttles (429)")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args(argv)
+    args.spawn_app = args.app_url is None
+    args.spawn_fakes = args.fakes_url is None
+    args.app_url = (args.app_url or f"http://127.0.0.1:{args.app_port}").rstrip("/")
+    args.fakes_url = (args.fakes_url or f"http://127.0.0.1:{args.fakes_port}").rstrip("/")
+    args.distinct_queries = max(1, min(args.distinct_queries, len(QUERIES)))
+    return args
+
+
+async def main(args):
+    processes = []
+    try:
+        if args.spawn_fakes:
+            processes.append(start_fake_services(args))
+            await _wait_ready(f"{args.fakes_url}/_stats", processes[-1])
+        if args.setup_db:
+            await setup_database(args)
+        if args.spawn_app:
+            processes.append(start_app(args))
+            await _wait_ready(f"{args.app_url}/ping", processes[-1])
+
+        stats, elapsed, app_stats = await run_load(args)
+        summary = summarize(stats, elapsed)
+        print_summary(summary, elapsed, args.users)
+
+        if args.json_path:
+            with open(args.json_path, "w") as f:
+                json.dump({
+                    "users": args.users,
+                    "elapsed_seconds": elapsed,
+                    "endpoints": summary,
+                    "app_stats": app_stats,
+                }, f, indent=2, default=str)
+            print(f"Results written to {args.json_path}")
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,61 @@
+-- Base tables for a throwaway load-test database (benchmarks/loadtest.py --setup-db).
+-- Columns are the ones the backend reads and writes; migrations/*.sql are applied
+-- on top of this, in order, by the harness. Not meant for production databases.
+
+CREATE TABLE IF NOT EXISTS azaisearch_ocm_settings2 (
+    update_id                     SERIAL PRIMARY KEY,
+    azure_search_endpoint         TEXT,
+    azure_search_index_name       TEXT,
+    current_prompt                TEXT,
+    openai_model_deployment_name  TEXT,
+    openai_endpoint               TEXT,
+    openai_api_version            TEXT,
+    openai_model_temperature      NUMERIC,
+    semantic_configuration_name   TEXT,
+    openai_api_key                TEXT,
+    user_name                     TEXT,
+    login_session_id              TEXT,
+    number_of_chunks              INTEGER,
+    date_and_time                 TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS azaisearch_login_log (
+    login_session_id  UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    user_name         TEXT,
+    date_and_time     TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS azaisearch_logging (
+    id                SERIAL PRIMARY KEY,
+    chat_session_id   TEXT,
+    user_id           TEXT,
+    user_name         TEXT,
+    query             TEXT,
+    ai_response       TEXT,
+    citations         TEXT,
+    login_session_id  TEXT,
+    job_title         TEXT,
+    date_and_time     TIMESTAMP NOT NULL DEFAULT NOW()
+);
+
+CREATE TABLE IF NOT EXISTS azaisearch_feedback (
+    id                SERIAL PRIMARY KEY,
+    chat_session_id   TEXT,
+    user_name         TEXT,
+    date_and_time     TIMESTAMP NOT NULL DEFAULT NOW(),
+    query             TEXT,
+    ai_response       TEXT,
+    citations         TEXT,
+    feedback_type     TEXT,
+    feedback          TEXT,
+    login_session_id  TEXT,
+    user_id           TEXT
+);
+
+CREATE TABLE IF NOT EXISTS azaisearch_obe_reports_access (
+    id                     SERIAL PRIMARY KEY,
+    name                   TEXT,
+    email                  TEXT,
+    granted_by             TEXT,
+    permission_granted_at  TIMESTAMP NOT NULL DEFAULT NOW()
+);
@@ -0,0 +1,62 @@
+# context_packer.py
+from token_utils import count_tokens, truncate_to_tokens
+
+DEFAULT_CONTEXT_TOKEN_BUDGET = 6000
+DEFAULT_MAX_CHUNK_TOKENS = 1000
+
+# Must match how search_query renders each source into the prompt
+SOURCE_SEPARATOR = "\n\n---\n\n"
+
+
+def format_source(chunk):
+    return f"Source ID: [{chunk['id']}]\nContent: {chunk['chunk']}\nDocument: {chunk['parent_id']}"
+
+
+def pack_context(chunks, token_budget=DEFAULT_CONTEXT_TOKEN_BUDGET, max_chunk_tokens=DEFAULT_MAX_CHUNK_TOKENS):
+    """
+    Choose the chunks that go into the answer prompt.
+
+    Chunks are ranked by search score (highest first; ties and unscored chunks
+    keep retrieval order). Chunks longer than `max_chunk_tokens` are truncated,
+    then chunks are added while their rendered source still fits `token_budget`.
+
+    Returns (packed_chunks, sources, report): the chosen chunks, their rendered
+    source strings (join with SOURCE_SEPARATOR), and a report counting tokens
+    and chunks used, dropped and truncated.
+    """
+    ranked = sorted(chunks, key=lambda chunk: -(chunk.get("score") or 0.0))
+    separator_tokens = count_tokens(SOURCE_SEPARATOR)
+
+    packed = []
+    sources = []
+    used_tokens = 0
+    tokens_dropped = 0
+    tokens_truncated = 0
+    chunks_truncated = 0
+    for chunk in ranked:
+        chunk_tokens = count_tokens(chunk["chunk"])
+        if chunk_tokens > max_chunk_tokens:
+            chunk = {**chunk, "chunk": truncate_to_tokens(chunk["chunk"], max_chunk_tokens)}
+            tokens_truncated += chunk_tokens - max_chunk_tokens
+            chunks_truncated += 1
+
+        source = format_source(chunk)
+        source_tokens = count_tokens(source) + (separator_tokens if packed else 0)
+        if used_tokens + source_tokens > token_budget:
+            tokens_dropped += source_tokens
+            continue
+        packed.append(chunk)
+        sources.append(source)
+        used_tokens += source_tokens
+
+    report = {
+        "budget_tokens": token_budget,
+        "used_tokens": used_tokens,
+        "chunks_in": len(chunks),
+        "chunks_packed": len(packed),
+        "chunks_dropped": len(chunks) - len(packed),
+        "tokens_dropped": tokens_dropped,
+        "chunks_truncated": chunks_truncated,
+        "tokens_truncated": tokens_truncated,
+    }
+    return packed, sources, report
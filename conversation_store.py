@@ -0,0 +1,317 @@
+# conversation_store.py
+import os
+import time
+import uuid
+import logging
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone, timedelta
+from collections import OrderedDict, deque
+
+from token_utils import count_tokens, truncate_to_tokens
+from db_pool import acquire
+
+logger = logging.getLogger(__name__)
+
+# "memory" (single process) or "postgres" (shared across workers and instances)
+CONVERSATION_STORE_BACKEND = os.getenv('CONVERSATION_STORE_BACKEND', 'memory').lower()
+
+# Conversations untouched for this long are dropped
+CONVERSATION_TTL_SECONDS = float(os.getenv('CONVERSATION_TTL_SECONDS', '14400'))
+# LRU cap on the number of users kept in memory
+CONVERSATION_MAX_USERS = int(os.getenv('CONVERSATION_MAX_USERS', '10000'))
+# Turns kept per user (older turns can never fit the prompt budget anyway)
+CONVERSATION_MAX_TURNS = int(os.getenv('CONVERSATION_MAX_TURNS', '20'))
+# Tokens of conversation history injected into the answer prompt
+CONVERSATION_HISTORY_TOKEN_BUDGET = int(os.getenv('CONVERSATION_HISTORY_TOKEN_BUDGET', '1500'))
+# Previous user queries concatenated into the history search
+HISTORY_QUERY_COUNT = 3
+
+# Postgres backend: write-behind batching of new turns
+CONVERSATION_FLUSH_INTERVAL_SECONDS = float(os.getenv('CONVERSATION_FLUSH_INTERVAL_SECONDS', '0.5'))
+CONVERSATION_FLUSH_BATCH_SIZE = int(os.getenv('CONVERSATION_FLUSH_BATCH_SIZE', '100'))
+# Unflushed turns kept in memory while the database is unavailable
+CONVERSATION_MAX_PENDING = int(os.getenv('CONVERSATION_MAX_PENDING', '10000'))
+CONVERSATION_PRUNE_INTERVAL_SECONDS = float(os.getenv('CONVERSATION_PRUNE_INTERVAL_SECONDS', '3600'))
+
+
+def _format_turn(turn):
+    return f"\nUser: {turn['query']}\nAI: {turn['ai_response']}"
+
+
+def format_history(turns, token_budget=CONVERSATION_HISTORY_TOKEN_BUDGET):
+    """
+    Render the most recent turns that fit in `token_budget`, oldest first,
+    in the same "User: ... / AI: ..." form the prompts have always used.
+
+    The previous turn is always included, cut to the budget if it is longer.
+    History stops at the first older turn that doesn't fit, so it never has gaps.
+    """
+    selected = []
+    used = 0
+    for turn in reversed(turns):
+        text = _format_turn(turn)
+        tokens = count_tokens(text)
+        if used + tokens > token_budget:
+            if selected:
+                break
+            text = truncate_to_tokens(text, token_budget)
+            tokens = count_tokens(text)
+        selected.append(text)
+        used += tokens
+    return "".join(reversed(selected))
+
+
+def recent_queries(turns, user_query):
+    """The last HISTORY_QUERY_COUNT user queries, ending with the current one."""
+    queries = [turn['query'] for turn in turns[-(HISTORY_QUERY_COUNT - 1):]] if HISTORY_QUERY_COUNT > 1 else []
+    queries.append(user_query)
+    return queries
+
+
+class ConversationStore(ABC):
+    """
+    Interface ask_query uses for conversation state. Turns are
+    {"query", "ai_response"} dicts, returned oldest first. A backend missing
+    one of the abstract methods fails when it is constructed, not mid-request.
+    """
+
+    async def start(self):
+        """Called once before serving (background tasks, connections)."""
+
+    async def close(self):
+        """Called once after serving; must persist anything still buffered."""
+
+    @abstractmethod
+    async def get_turns(self, user_id):
+        """All live turns of `user_id`, oldest first."""
+
+    async def has_history(self, user_id):
+        return bool(await self.get_turns(user_id))
+
+    @abstractmethod
+    async def append_turn(self, user_id, query, ai_response):
+        """Record a completed /ask exchange."""
+
+    @abstractmethod
+    async def clear(self, user_id):
+        """Forget the conversation of `user_id`."""
+
+    def stats(self):
+        return {}
+
+
+class InMemoryConversationStore(ConversationStore):
+    """
+    Per-user conversation turns kept in process memory.
+
+    Bounded three ways: CONVERSATION_MAX_TURNS per user, CONVERSATION_MAX_USERS
+    users (least recently active evicted first) and CONVERSATION_TTL_SECONDS of
+    inactivity. Only correct with a single worker process.
+    """
+
+    def __init__(self, ttl_seconds=CONVERSATION_TTL_SECONDS, max_users=CONVERSATION_MAX_USERS,
+                 max_turns=CONVERSATION_MAX_TURNS):
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self.max_turns = max_turns
+        self._users = OrderedDict()  # user_id -> {"turns": deque, "touched": float}, least recent first
+        self._stats = {'evicted_lru': 0, 'evicted_ttl': 0}
+
+    def _expire(self, now):
+        # Entries are ordered by last activity, so expired users are at the front
+        while self._users:
+            user_id, entry = next(iter(self._users.items()))
+            if now - entry['touched'] < self.ttl_seconds:
+                break
+            del self._users[user_id]
+            self._stats['evicted_ttl'] += 1
+
+    async def get_turns(self, user_id):
+        """The user's turns, oldest first, as a list of {"query", "ai_response"}."""
+        self._expire(time.monotonic())
+        entry = self._users.get(user_id)
+        if entry is None:
+            return []
+        return list(entry['turns'])
+
+    async def append_turn(self, user_id, query, ai_response):
+        now = time.monotonic()
+        self._expire(now)
+        entry = self._users.get(user_id)
+        if entry is None:
+            entry = {'turns': deque(maxlen=self.max_turns), 'touched': now}
+            self._users[user_id] = entry
+        entry['turns'].append({'query': query, 'ai_response': ai_response})
+        entry['touched'] = now
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+            self._stats['evicted_lru'] += 1
+
+    async def clear(self, user_id):
+        self._users.pop(user_id, None)
+
+    def stats(self):
+        return {
+            'backend': 'memory',
+            'users': len(self._users),
+            'max_users': self.max_users,
+            'max_turns': self.max_turns,
+            'ttl_seconds': self.ttl_seconds,
+            'history_token_budget': CONVERSATION_HISTORY_TOKEN_BUDGET,
+            **self._stats,
+        }
+
+
+class PostgresConversationStore(ConversationStore):
+    """
+    Conversation turns in azaisearch_conversation_turns, shared by every worker
+    and instance (see migrations/001_conversation_turns.sql).
+
+    New turns are written behind: append_turn only buffers them, and a
+    background task inserts them in batches with executemany every
+    CONVERSATION_FLUSH_INTERVAL_SECONDS or once CONVERSATION_FLUSH_BATCH_SIZE
+    turns are waiting. Reads merge the rows in the database with this
+    process's unflushed turns, de-duplicated on turn_id, so a user's own
+    worker always sees their latest turn.
+    """
+
+    def __init__(self, ttl_seconds=CONVERSATION_TTL_SECONDS, max_turns=CONVERSATION_MAX_TURNS):
+        self.ttl_seconds = ttl_seconds
+        self.max_turns = max_turns
+        self._pending = []    # turns not yet handed to the database
+        self._in_flight = []  # turns in the batch currently being inserted
+        self._flush_needed = asyncio.Event()
+        self._flusher = None
+        self._closing = False
+        self._last_prune = 0.0
+        self._stats = {'flushes': 0, 'turns_written': 0, 'flush_errors': 0, 'dropped': 0, 'reads': 0}
+
+    async def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        if self._flusher is not None:
+            # Let the loop finish its current batch rather than cancelling it mid-insert
+            self._closing = True
+            self._flush_needed.set()
+            await self._flusher
+            self._flusher = None
+        await self.flush()
+
+    def _local_turns(self, user_id):
+        return [turn for turn in self._in_flight + self._pending if turn['user_id'] == user_id]
+
+    async def get_turns(self, user_id):
+        # Snapshot local turns before querying: anything flushed meanwhile is
+        # either in the query result or in this snapshot (and de-duplicated)
+        local = self._local_turns(user_id)
+        since = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        query = """
+            SELECT turn_id, query, ai_response
+            FROM azaisearch_conversation_turns
+            WHERE user_id = $1 AND created_at > $2
+            ORDER BY created_at DESC
+            LIMIT $3
+        """
+        async with acquire() as conn:
+            rows = await conn.fetch(query, user_id, since, self.max_turns)
+        self._stats['reads'] += 1
+
+        stored_ids = {row['turn_id'] for row in rows}
+        turns = [{'query': row['query'], 'ai_response': row['ai_response']} for row in reversed(rows)]
+        turns += [
+            {'query': turn['query'], 'ai_response': turn['ai_response']}
+            for turn in local if turn['turn_id'] not in stored_ids
+        ]
+        return turns[-self.max_turns:]
+
+    async def append_turn(self, user_id, query, ai_response):
+        self._pending.append({
+            'turn_id': uuid.uuid4(),
+            'user_id': user_id,
+            'query': query,
+            'ai_response': ai_response,
+            'created_at': datetime.now(timezone.utc),
+        })
+        if len(self._pending) > CONVERSATION_MAX_PENDING:
+            # Database has been unreachable for a while: keep the newest turns
+            overflow = len(self._pending) - CONVERSATION_MAX_PENDING
+            del self._pending[:overflow]
+            self._stats['dropped'] += overflow
+        if len(self._pending) >= CONVERSATION_FLUSH_BATCH_SIZE:
+            self._flush_needed.set()
+
+    async def clear(self, user_id):
+        self._pending = [turn for turn in self._pending if turn['user_id'] != user_id]
+        async with acquire() as conn:
+            await conn.execute("DELETE FROM azaisearch_conversation_turns WHERE user_id = $1", user_id)
+
+    async def flush(self):
+        """Insert all buffered turns in one batch."""
+        if not self._pending or self._in_flight:
+            return
+        self._in_flight, self._pending = self._pending, []
+        insert_query = """
+            INSERT INTO azaisearch_conversation_turns (turn_id, user_id, query, ai_response, created_at)
+            VALUES ($1, $2, $3, $4, $5)
+            ON CONFLICT (turn_id) DO NOTHING
+        """
+        try:
+            async with acquire() as conn:
+                await conn.executemany(insert_query, [
+                    (turn['turn_id'], turn['user_id'], turn['query'], turn['ai_response'], turn['created_at'])
+                    for turn in self._in_flight
+                ])
+            self._stats['flushes'] += 1
+            self._stats['turns_written'] += len(self._in_flight)
+        except Exception as e:
+            # Keep the batch for the next attempt, ahead of newer turns
+            self._pending = self._in_flight + self._pending
+            self._stats['flush_errors'] += 1
+            logger.error("Failed to persist %d conversation turns: %s", len(self._in_flight), e)
+        finally:
+            self._in_flight = []
+
+    async def _prune(self):
+        since = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        async with acquire() as conn:
+            await conn.execute("DELETE FROM azaisearch_conversation_turns WHERE created_at <= $1", since)
+
+    async def _flush_loop(self):
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._flush_needed.wait(), CONVERSATION_FLUSH_INTERVAL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_needed.clear()
+            await self.flush()
+            if time.monotonic() - self._last_prune >= CONVERSATION_PRUNE_INTERVAL_SECONDS:
+                self._last_prune = time.monotonic()
+                try:
+                    await self._prune()
+                except Exception as e:
+                    logger.warning("Failed to prune expired conversation turns: %s", e)
+
+    def stats(self):
+        return {
+            'backend': 'postgres',
+            'pending': len(self._pending),
+            'in_flight': len(self._in_flight),
+            'max_turns': self.max_turns,
+            'ttl_seconds': self.ttl_seconds,
+            'history_token_budget': CONVERSATION_HISTORY_TOKEN_BUDGET,
+            'flush_interval_seconds': CONVERSATION_FLUSH_INTERVAL_SECONDS,
+            **self._stats,
+        }
+
+
+def create_conversation_store():
+    """Build the store selected by CONVERSATION_STORE_BACKEND."""
+    if CONVERSATION_STORE_BACKEND == 'postgres':
+        return PostgresConversationStore()
+    if CONVERSATION_STORE_BACKEND == 'memory':
+        return InMemoryConversationStore()
+    raise ValueError(f"Unknown CONVERSATION_STORE_BACKEND: {CONVERSATION_STORE_BACKEND}")
@@ -0,0 +1,131 @@
+# db_pool.py
+import os
+import time
+import logging
+import asyncio
+import asyncpg
+from contextlib import asynccontextmanager
+from dotenv import load_dotenv
+from metrics import DB_ACQUIRE_SECONDS, DB_ACQUIRE_TIMEOUTS
+from deadlines import cap_timeout
+
+logger = logging.getLogger(__name__)
+
+# Load environment variables
+load_dotenv()
+
+# Async DB config (single copy shared by every module)
+DB_CONFIG = {
+    'user': os.getenv('DB_USER'),
+    'password': os.getenv('DB_PASSWORD'),
+    'database': os.getenv('DB_NAME'),
+    'host': os.getenv('DB_HOST'),
+    'port': os.getenv('DB_PORT')
+}
+
+# Pool sizing / behaviour
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', '2'))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv('DB_POOL_ACQUIRE_TIMEOUT', '10'))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv('DB_POOL_MAX_INACTIVE_LIFETIME', '300'))
+# asyncpg prepares every query and caches the statement per connection;
+# with pooled connections that cache is actually reused across requests.
+DB_STATEMENT_CACHE_SIZE = int(os.getenv('DB_STATEMENT_CACHE_SIZE', '100'))
+
+_pool = None
+_pool_lock = asyncio.Lock()
+_pool_stats = {
+    'acquires': 0,
+    'acquire_timeouts': 0,
+    'acquire_wait_total_seconds': 0.0,
+    'acquire_wait_max_seconds': 0.0,
+    'waiting': 0,
+}
+
+# ========================
+# Pool Lifecycle
+# ========================
+async def init_db_pool():
+    """Create the shared pool. Called once from app.py at startup."""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            _pool = await asyncpg.create_pool(
+                **DB_CONFIG,
+                min_size=DB_POOL_MIN_SIZE,
+                max_size=DB_POOL_MAX_SIZE,
+                max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+                statement_cache_size=DB_STATEMENT_CACHE_SIZE,
+            )
+            logger.info("DB pool created", extra={"min_size": DB_POOL_MIN_SIZE, "max_size": DB_POOL_MAX_SIZE})
+    return _pool
+
+async def close_db_pool():
+    """Close the shared pool. Called once from app.py at shutdown."""
+    global _pool
+    async with _pool_lock:
+        if _pool is not None:
+            await _pool.close()
+            _pool = None
+            logger.info("DB pool closed")
+
+async def get_db_pool():
+    # Created lazily if startup could not reach the database
+    if _pool is None:
+        return await init_db_pool()
+    return _pool
+
+# ========================
+# Connection Acquire
+# ========================
+@asynccontextmanager
+async def acquire():
+    """
+    Borrow a connection from the shared pool.
+
+    Usage:
+        async with acquire() as conn:
+            rows = await conn.fetch(query, *params)
+    """
+    pool = await get_db_pool()
+    start = time.perf_counter()
+    _pool_stats['waiting'] += 1
+    try:
+        # Never wait longer than the current request has left
+        conn = await pool.acquire(timeout=cap_timeout(DB_POOL_ACQUIRE_TIMEOUT))
+    except asyncio.TimeoutError:
+        _pool_stats['acquire_timeouts'] += 1
+        DB_ACQUIRE_TIMEOUTS.inc()
+        raise RuntimeError("Timed out waiting for a database connection")
+    finally:
+        _pool_stats['waiting'] -= 1
+
+    waited = time.perf_counter() - start
+    DB_ACQUIRE_SECONDS.observe(waited)
+    _pool_stats['acquires'] += 1
+    _pool_stats['acquire_wait_total_seconds'] += waited
+    _pool_stats['acquire_wait_max_seconds'] = max(_pool_stats['acquire_wait_max_seconds'], waited)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+# ========================
+# Saturation Metrics
+# ========================
+def get_pool_stats():
+    size = _pool.get_size() if _pool is not None else 0
+    idle = _pool.get_idle_size() if _pool is not None else 0
+    acquires = _pool_stats['acquires']
+    return {
+        'min_size': DB_POOL_MIN_SIZE,
+        'max_size': DB_POOL_MAX_SIZE,
+        'size': size,
+        'idle': idle,
+        'in_use': size - idle,
+        'waiting': _pool_stats['waiting'],
+        'acquires': acquires,
+        'acquire_timeouts': _pool_stats['acquire_timeouts'],
+        'acquire_wait_avg_seconds': (_pool_stats['acquire_wait_total_seconds'] / acquires) if acquires else 0.0,
+        'acquire_wait_max_seconds': _pool_stats['acquire_wait_max_seconds'],
+    }
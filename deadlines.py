@@ -0,0 +1,97 @@
+# deadlines.py
+"""
+Per-request time budget for /ask.
+
+The deadline is an absolute monotonic time held in a context variable, so
+every await in the request (and tasks it starts) sees the same budget
+without passing it around. Each stage gets a share of whatever is left when
+it starts: an early stage can't eat the whole budget, and the answer
+completion, which runs last, gets the rest. A stage that runs out raises
+DeadlineExceeded, which the routes map to 504.
+"""
+import os
+import time
+import asyncio
+from contextvars import ContextVar
+
+from metrics import DEADLINES_EXCEEDED
+
+# Default budget for /ask; the request_timeout_seconds settings column overrides it
+REQUEST_TIMEOUT_SECONDS = float(os.getenv('REQUEST_TIMEOUT_SECONDS', '60'))
+
+# Share of the remaining budget a stage may use
+STAGE_BUDGET_SHARES = {
+    'settings': 0.2,
+    'history': 0.2,
+    'answer_cache': 0.2,
+    'search': 0.5,
+    'answer_completion': 1.0,
+}
+
+_deadline = ContextVar('deadline', default=None)
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out during `stage`."""
+
+    def __init__(self, stage):
+        super().__init__(f"Request deadline exceeded during {stage}")
+        self.stage = stage
+
+
+def set_deadline(seconds):
+    """Start (or replace) the deadline `seconds` from now. Returns a token for reset_deadline."""
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def reset_deadline(token):
+    _deadline.reset(token)
+
+
+def clear_deadline():
+    """No deadline for the rest of the current task (e.g. background jobs started by a request)."""
+    _deadline.set(None)
+
+
+def remaining():
+    """Seconds left in the current request's budget, or None without a deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def cap_timeout(timeout):
+    """`timeout` shortened to the remaining budget (never below zero)."""
+    left = remaining()
+    if left is None:
+        return timeout
+    return max(0.0, min(timeout, left))
+
+
+def stage_timeout(stage):
+    """Time `stage` may take: its share of the remaining budget, or None without a deadline."""
+    left = remaining()
+    if left is None:
+        return None
+    return max(0.0, left * STAGE_BUDGET_SHARES.get(stage, 1.0))
+
+
+def _exceeded(stage):
+    DEADLINES_EXCEEDED.labels(stage).inc()
+    return DeadlineExceeded(stage)
+
+
+async def within_deadline(awaitable, stage):
+    """Await `awaitable`, giving up with DeadlineExceeded after the stage's share of the budget."""
+    timeout = stage_timeout(stage)
+    if timeout is None:
+        return await awaitable
+    if timeout <= 0:
+        if asyncio.iscoroutine(awaitable):
+            awaitable.close()
+        raise _exceeded(stage)
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise _exceeded(stage) from None
@@ -0,0 +1,37 @@
+# embeddings.py
+import os
+import numpy as np
+
+from ttl_cache import TTLCache
+from upstream_limiter import get_limiter
+
+# Azure OpenAI embedding deployment used for query-to-query similarity.
+# Features that need embeddings are disabled when this is not set.
+EMBEDDING_DEPLOYMENT_NAME = os.getenv('EMBEDDING_DEPLOYMENT_NAME')
+EMBEDDING_CACHE_SIZE = int(os.getenv('EMBEDDING_CACHE_SIZE', '5000'))
+EMBEDDING_CACHE_TTL_SECONDS = float(os.getenv('EMBEDDING_CACHE_TTL_SECONDS', '3600'))
+
+_cache = TTLCache(EMBEDDING_CACHE_SIZE, EMBEDDING_CACHE_TTL_SECONDS)
+
+
+def embeddings_enabled():
+    return bool(EMBEDDING_DEPLOYMENT_NAME)
+
+
+async def embed_text(openai_client, text):
+    """Unit-length float32 embedding of `text`, memoised per process."""
+    vector = _cache.get(text)
+    if vector is None:
+        response = await get_limiter('openai', EMBEDDING_DEPLOYMENT_NAME).call(
+            lambda: openai_client.embeddings.create(input=text, model=EMBEDDING_DEPLOYMENT_NAME)
+        )
+        vector = np.asarray(response.data[0].embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        _cache.set(text, vector)
+    return vector
+
+
+def get_embedding_cache_stats():
+    return {**_cache.stats(), 'deployment': EMBEDDING_DEPLOYMENT_NAME}
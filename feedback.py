@@ -1,23 +1,15 @@
 # feedback.py
 
-import asyncpg
 from quart import request, jsonify
-import os
-from dotenv import load_dotenv  
+from interactions import interaction_key
+from ingestion import BatchWriter, IngestQueueFull
 
-load_dotenv()
-
-# Database configuration
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
-
-async def get_db_connection():
-    return await asyncpg.connect(**DB_CONFIG)
+# Rows are inserted in batches by a background task (see ingestion.py)
+feedback_writer = BatchWriter("feedback", """
+    INSERT INTO azaisearch_feedback 
+    (chat_session_id, user_name, date_and_time, query, ai_response, citations, feedback_type, feedback, login_session_id, user_id, interaction_key)
+    VALUES ($1, $2, NOW(), $3, $4, $5, $6, $7, $8, $9, $10)
+""")
 
 async def submit_feedback():
     try:
@@ -33,22 +25,15 @@ async def submit_feedback():
         login_session_id = data.get("login_session_id")
         user_id = data.get("user_id")
 
-        conn = await get_db_connection()
-
-        insert_query = """
-            INSERT INTO azaisearch_feedback 
-            (chat_session_id, user_name, date_and_time, query, ai_response, citations, feedback_type, feedback, login_session_id, user_id)
-            VALUES ($1, $2, NOW(), $3, $4, $5, $6, $7, $8, $9)
-        """
-
-        await conn.execute(insert_query,
+        await feedback_writer.put((
             chat_session_id, user_name, query, ai_response,
-            citations, feedback_type, feedback, login_session_id, user_id
-        )
-
-        await conn.close()
+            citations, feedback_type, feedback, login_session_id, user_id,
+            interaction_key(login_session_id, query, ai_response)
+        ))
 
         return jsonify({"status": "success", "message": "Feedback submitted successfully"}), 201
 
+    except IngestQueueFull as e:
+        return jsonify({"status": "error", "message": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -0,0 +1,181 @@
+# follow_ups.py
+import os
+import hashlib
+import logging
+import time
+import asyncio
+from quart import request, jsonify
+
+from ttl_cache import TTLCache
+from load_settings_and_clients_from_db import load_settings_and_get_clients
+from metrics import FOLLOW_UP_SECONDS
+from upstream_limiter import openai_limiter, UpstreamBusy
+from deadlines import clear_deadline
+
+logger = logging.getLogger(__name__)
+
+FOLLOW_UP_CACHE_SIZE = int(os.getenv('FOLLOW_UP_CACHE_SIZE', '2000'))
+FOLLOW_UP_CACHE_TTL_SECONDS = float(os.getenv('FOLLOW_UP_CACHE_TTL_SECONDS', '86400'))
+# Characters of each chunk that go into the follow-up prompt
+FOLLOW_UP_SOURCE_CHARS = int(os.getenv('FOLLOW_UP_SOURCE_CHARS', '1200'))
+# How long GET/POST /follow_ups waits for a job that is still running
+FOLLOW_UP_WAIT_SECONDS = float(os.getenv('FOLLOW_UP_WAIT_SECONDS', '30'))
+
+_cache = TTLCache(FOLLOW_UP_CACHE_SIZE, FOLLOW_UP_CACHE_TTL_SECONDS)
+_pending = {}  # follow_ups_id -> asyncio.Task
+_stats = {'jobs_started': 0, 'jobs_failed': 0, 'jobs_joined': 0}
+
+
+def follow_ups_key(chunks):
+    """
+    Identify a chunk set independently of order and of the per-request ids.
+    Two retrievals that return the same chunks share one follow-up completion.
+    """
+    identities = sorted(
+        f"{chunk['parent_id']}\x1f{hashlib.sha1(chunk['chunk'].encode('utf-8')).hexdigest()}"
+        for chunk in chunks
+    )
+    return hashlib.sha256("\x1e".join(identities).encode("utf-8")).hexdigest()
+
+
+def build_source_digest(chunks):
+    """Compact, id-free rendering of the sources (no JSON, no indentation, no titles)."""
+    lines = []
+    for chunk in chunks:
+        document = chunk['parent_id'].rsplit("/", 1)[-1]
+        lines.append(f"- ({document}) {chunk['chunk'][:FOLLOW_UP_SOURCE_CHARS]}")
+    return "\n".join(lines)
+
+
+def build_follow_up_prompt(chunks):
+    return f"""
+Based only on the following chunks of source material, generate 3 follow-up questions the user might ask.
+Only use the content in the sources. Do not invent new facts.
+
+Format:
+Q1: <question>
+Q2: <question>
+Q3: <question>
+
+SOURCES:
+{build_source_digest(chunks)}
+    """
+
+
+async def _generate(key, config, chunks):
+    # Shared background job: not bound by the deadline of the request that started it
+    clear_deadline()
+    start = time.perf_counter()
+    try:
+        response = await openai_limiter(config).call(lambda: config['openai_client'].chat.completions.create(
+            messages=[{"role": "user", "content": build_follow_up_prompt(chunks)}],
+            model=config['deployment_name']
+        ))
+        follow_ups = response.choices[0].message.content.strip()
+        _cache.set(key, follow_ups)
+        FOLLOW_UP_SECONDS.labels('ok').observe(time.perf_counter() - start)
+        return follow_ups
+    except Exception as e:
+        FOLLOW_UP_SECONDS.labels('error').observe(time.perf_counter() - start)
+        _stats['jobs_failed'] += 1
+        logger.error("Follow-up generation failed: %s", e, extra={"follow_ups_id": key})
+        raise
+    finally:
+        _pending.pop(key, None)
+
+
+def schedule_follow_ups(config, chunks):
+    """
+    Make sure follow-ups for this chunk set exist or are being generated,
+    without waiting for them. Returns the follow_ups_id to fetch them with.
+    """
+    key = follow_ups_key(chunks)
+    if key in _cache:
+        return key
+    if key in _pending:
+        _stats['jobs_joined'] += 1
+        return key
+    task = asyncio.create_task(_generate(key, config, chunks))
+    # Failures are reported to whoever awaits the job; don't warn when nobody does
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    _pending[key] = task
+    _stats['jobs_started'] += 1
+    return key
+
+
+def get_cached_follow_ups(key):
+    """Follow-ups if they are already generated, else None."""
+    return _cache.get(key)
+
+
+async def wait_for_follow_ups(key, timeout=FOLLOW_UP_WAIT_SECONDS):
+    """
+    Return follow-ups for `key`, waiting for a running job if needed.
+    Returns None when the id is unknown to this process.
+    """
+    follow_ups = _cache.get(key)
+    if follow_ups is not None:
+        return follow_ups
+    task = _pending.get(key)
+    if task is None:
+        return None
+    return await asyncio.wait_for(asyncio.shield(task), timeout)
+
+
+def validate_chunks(chunks, max_chunks):
+    """Error message for a client-supplied fetched_chunks list, or None if it is usable."""
+    if not isinstance(chunks, list):
+        return "'fetched_chunks' must be a list"
+    if len(chunks) > max_chunks:
+        return f"'fetched_chunks' may hold at most {max_chunks} chunks"
+    for chunk in chunks:
+        if not isinstance(chunk, dict) or not isinstance(chunk.get('chunk'), str) or not isinstance(chunk.get('parent_id'), str):
+            return "Each fetched chunk must be an object with string 'chunk' and 'parent_id'"
+    return None
+
+
+def get_follow_ups_stats():
+    return {**_cache.stats(), **_stats, 'pending': len(_pending)}
+
+
+# ========================
+# /follow_ups route
+# ========================
+async def get_follow_ups():
+    """
+    Body: {"follow_ups_id": "..."} and/or {"fetched_chunks": [...]} as returned by /ask.
+    Sending fetched_chunks lets any worker answer, even one that did not serve the /ask.
+    """
+    try:
+        data = await request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request body must be a JSON object"}), 400
+        key = data.get("follow_ups_id")
+        chunks = data.get("fetched_chunks")
+        if not key and not chunks:
+            return jsonify({"error": "Provide 'follow_ups_id' or 'fetched_chunks'"}), 400
+        if key and not isinstance(key, str):
+            return jsonify({"error": "'follow_ups_id' must be a string"}), 400
+
+        if chunks:
+            config = await load_settings_and_get_clients()
+            # /ask returns at most number_of_chunks from each of its two searches
+            error = validate_chunks(chunks, 2 * config['number_of_chunks'])
+            if error:
+                return jsonify({"error": error}), 400
+            key = follow_ups_key(chunks)
+            if key not in _cache and key not in _pending:
+                schedule_follow_ups(config, chunks)
+
+        follow_ups = await wait_for_follow_ups(key)
+        if follow_ups is None:
+            return jsonify({"error": "Unknown follow_ups_id", "follow_ups_id": key}), 404
+
+        return jsonify({"follow_ups_id": key, "follow_ups": follow_ups})
+
+    except asyncio.TimeoutError:
+        return jsonify({"error": "Follow-ups are still being generated"}), 504
+    except UpstreamBusy as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": str(max(1, round(e.retry_after)))}
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -1,39 +1,18 @@
-import os
-import asyncpg
+import logging
 from quart import request, jsonify
-from dotenv import load_dotenv
+from db_pool import acquire
 
-# Load environment variables
-load_dotenv()
-
-# Async DB config
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
-
-async def connect_db():
-    try:
-        return await asyncpg.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        return None
+logger = logging.getLogger(__name__)
 
 async def get_settings():
-    conn = await connect_db()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-
     try:
         # Query to get the row with maximum update_id (latest entry)
         query = """
             SELECT * FROM azaisearch_ocm_settings2
             WHERE update_id = (SELECT MAX(update_id) FROM azaisearch_ocm_settings2)
         """
-        row = await conn.fetchrow(query)
+        async with acquire() as conn:
+            row = await conn.fetchrow(query)
 
         if row is None:
             return jsonify({'message': 'No settings found in the table'}), 404
@@ -42,8 +21,5 @@ async def get_settings():
         return jsonify(result)
 
     except Exception as e:
-        print(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         return jsonify({'error': str(e)}), 500
-
-    finally:
-        await conn.close()
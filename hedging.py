@@ -0,0 +1,87 @@
+# hedging.py
+"""
+Hedged requests: when an attempt is slower than the recent p95, start a
+duplicate and keep whichever finishes first. Costs a few percent of extra
+upstream calls for a much shorter tail.
+"""
+import os
+import asyncio
+from collections import deque
+
+import numpy as np
+
+from metrics import HEDGED_REQUESTS
+
+SEARCH_HEDGING_ENABLED = os.getenv('SEARCH_HEDGING_ENABLED', 'false').lower() == 'true'
+# Latency percentile after which the duplicate is sent, and the samples it is computed from
+HEDGE_PERCENTILE = float(os.getenv('HEDGE_PERCENTILE', '95'))
+HEDGE_WINDOW = int(os.getenv('HEDGE_WINDOW', '500'))
+# No hedging until this many samples exist, and never sooner than this
+HEDGE_MIN_SAMPLES = int(os.getenv('HEDGE_MIN_SAMPLES', '50'))
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv('HEDGE_MIN_DELAY_SECONDS', '0.05'))
+
+
+class LatencyTracker:
+    """Rolling window of successful call latencies (seconds)."""
+
+    def __init__(self, window=HEDGE_WINDOW):
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds):
+        self._samples.append(seconds)
+
+    def percentile(self, q):
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return float(np.percentile(np.fromiter(self._samples, dtype=np.float64), q))
+
+    def stats(self):
+        return {
+            'samples': len(self._samples),
+            f'p{HEDGE_PERCENTILE:g}_seconds': self.percentile(HEDGE_PERCENTILE),
+        }
+
+
+async def hedged(name, factory, tracker, enabled=True):
+    """
+    `await factory()`; if it has not finished after the tracker's p95, call
+    `factory()` again and return the first successful result. The loser is
+    cancelled. Only for idempotent calls.
+    """
+    loop = asyncio.get_running_loop()
+
+    async def attempt():
+        start = loop.time()
+        result = await factory()
+        tracker.observe(loop.time() - start)
+        return result
+
+    delay = tracker.percentile(HEDGE_PERCENTILE) if enabled else None
+    if delay is None:
+        return await attempt()
+
+    first = asyncio.ensure_future(attempt())
+    try:
+        done, _ = await asyncio.wait({first}, timeout=max(delay, HEDGE_MIN_DELAY_SECONDS))
+    except BaseException:
+        first.cancel()
+        raise
+    if done:
+        return first.result()
+
+    HEDGED_REQUESTS.labels(name, 'sent').inc()
+    second = asyncio.ensure_future(attempt())
+    pending = {first, second}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is second:
+                        HEDGED_REQUESTS.labels(name, 'won').inc()
+                    return task.result()
+        # Both failed: report the original attempt's error
+        return first.result()
+    finally:
+        for task in pending:
+            task.cancel()
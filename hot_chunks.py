@@ -0,0 +1,203 @@
+# hot_chunks.py
+"""
+In-process index of frequently retrieved chunks, to answer repeat searches
+without a round-trip to Azure AI Search.
+
+Each search that goes to Azure is remembered as a neighbourhood: the query
+embedding plus the ranked records it returned. Records are stored once and
+shared between neighbourhoods (the same policy chunks come back for many
+questions); scores belong to the query, so each neighbourhood keeps its own
+and a hit returns copies carrying them. A later search whose query embedding
+is within HOT_CHUNK_SIMILARITY_THRESHOLD (cosine) of a neighbourhood that
+fetched at least as many results is answered from it; anything else falls
+back to Azure Search.
+
+Query embeddings sit in one preallocated float32 matrix, so a lookup is a
+single matrix-vector product. The index is bounded by neighbourhood count,
+distinct chunk count and approximate bytes; when over a bound the least
+frequently used neighbourhood (oldest first on ties) is evicted, and chunks
+no longer referenced are dropped with it. Everything is cleared when the
+search index name or the settings update_id changes.
+"""
+import os
+import time
+
+import numpy as np
+
+from embeddings import embeddings_enabled
+from metrics import HOT_CHUNK_LOOKUPS, HOT_CHUNK_EVICTIONS
+from search_cache import record_size
+
+# Off by default: it trades Azure's ranking of the exact query for that of a close one
+HOT_CHUNK_INDEX_ENABLED = os.getenv('HOT_CHUNK_INDEX_ENABLED', 'false').lower() == 'true'
+HOT_CHUNK_SIMILARITY_THRESHOLD = float(os.getenv('HOT_CHUNK_SIMILARITY_THRESHOLD', '0.92'))
+# The embedding matrix is preallocated: max_neighbourhoods x embedding dimensions x 4 bytes
+HOT_CHUNK_MAX_NEIGHBOURHOODS = int(os.getenv('HOT_CHUNK_MAX_NEIGHBOURHOODS', '2000'))
+HOT_CHUNK_MAX_CHUNKS = int(os.getenv('HOT_CHUNK_MAX_CHUNKS', '5000'))
+HOT_CHUNK_MAX_BYTES = int(os.getenv('HOT_CHUNK_MAX_BYTES', str(64 * 1024 * 1024)))
+# Index content changes under us (ingestion), so neighbourhoods are not kept forever
+HOT_CHUNK_TTL_SECONDS = float(os.getenv('HOT_CHUNK_TTL_SECONDS', '1800'))
+
+# Embeddings this close are the same query text
+_SAME_QUERY_SIMILARITY = 0.9999
+
+
+class HotChunkIndex:
+    """Query-embedding neighbourhoods -> ranked chunk records, with LFU eviction."""
+
+    def __init__(self, max_neighbourhoods, max_chunks, max_bytes, similarity_threshold, ttl_seconds):
+        self.max_neighbourhoods = max_neighbourhoods
+        self.max_chunks = max_chunks
+        self.max_bytes = max_bytes
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self._version = None
+        self._stats = {'hits': 0, 'misses': 0, 'inserts': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+        self._reset()
+
+    def _reset(self):
+        self._vectors = None          # (max_neighbourhoods, dim) float32, allocated on first insert
+        self._active = np.zeros(self.max_neighbourhoods, dtype=bool)
+        self._free = list(range(self.max_neighbourhoods - 1, -1, -1))
+        self._slots = {}              # slot -> neighbourhood dict
+        self._chunks = {}             # (parent_id, chunk) -> [record, refcount]
+        self._bytes = 0
+        self._clock = 0               # insertion order, breaks LFU ties
+
+    def _check_version(self, config):
+        version = (config['azure_search_index_name'], config['update_id'])
+        if version != self._version:
+            if self._version is not None and self._slots:
+                self._stats['invalidations'] += 1
+            self._reset()
+            self._version = version
+
+    def lookup(self, config, embedding, top):
+        """Up to `top` records for a query with this embedding, or None to go to Azure Search."""
+        self._check_version(config)
+        # A different embedding size (deployment changed under a running process) is a miss
+        if self._slots and embedding.shape[0] == self._vectors.shape[1]:
+            similarities = self._vectors @ embedding
+            similarities[~self._active] = -np.inf
+            now = time.monotonic()
+            # Closest neighbourhoods first; a close one that fetched fewer results can't answer
+            for slot in np.argsort(similarities)[::-1]:
+                if similarities[slot] < self.similarity_threshold:
+                    break
+                neighbourhood = self._slots[int(slot)]
+                if neighbourhood['expires_at'] <= now:
+                    self._remove(int(slot))
+                    self._stats['expirations'] += 1
+                    continue
+                if neighbourhood['top'] < top:
+                    continue
+                neighbourhood['hits'] += 1
+                self._stats['hits'] += 1
+                HOT_CHUNK_LOOKUPS.labels('hit').inc()
+                # Shared records carry no score; each neighbourhood keeps the ones its query got
+                return [
+                    {**self._chunks[key][0], 'score': score}
+                    for key, score in zip(neighbourhood['keys'][:top], neighbourhood['scores'])
+                ]
+        self._stats['misses'] += 1
+        HOT_CHUNK_LOOKUPS.labels('miss').inc()
+        return None
+
+    def add(self, config, embedding, top, records):
+        """Remember the records Azure Search returned for a query (`top` = how many were asked for)."""
+        self._check_version(config)
+        if self._vectors is None:
+            self._vectors = np.zeros((self.max_neighbourhoods, embedding.shape[0]), dtype=np.float32)
+        elif embedding.shape[0] != self._vectors.shape[1]:
+            return  # Embedding deployment changed under a running process; ignore
+        elif self._slots and self._has_duplicate(embedding, top):
+            return  # e.g. every waiter of a coalesced search adding the same results
+
+        keys = []
+        scores = []
+        for record in records:
+            key = (record['parent_id'], record['chunk'])
+            entry = self._chunks.get(key)
+            if entry is None:
+                self._chunks[key] = [record, 1]
+                self._bytes += record_size(record)
+            else:
+                entry[1] += 1
+            keys.append(key)
+            scores.append(record.get('score'))
+
+        if not self._free:
+            self._evict_one()
+        slot = self._free.pop()
+        self._vectors[slot] = embedding
+        self._active[slot] = True
+        self._clock += 1
+        self._slots[slot] = {
+            'keys': keys,
+            'scores': scores,
+            'top': top,
+            'hits': 0,
+            'order': self._clock,
+            'expires_at': time.monotonic() + self.ttl_seconds,
+        }
+        self._stats['inserts'] += 1
+
+        # Never evict what was just added, even if it alone is over a bound
+        while len(self._slots) > 1 and (len(self._chunks) > self.max_chunks or self._bytes > self.max_bytes):
+            self._evict_one(keep=slot)
+
+    def _has_duplicate(self, embedding, top):
+        similarities = self._vectors @ embedding
+        similarities[~self._active] = -np.inf
+        slot = int(np.argmax(similarities))
+        return similarities[slot] >= _SAME_QUERY_SIMILARITY and self._slots[slot]['top'] >= top
+
+    def _evict_one(self, keep=None):
+        victim = min(
+            (slot for slot in self._slots if slot != keep),
+            key=lambda slot: (self._slots[slot]['hits'], self._slots[slot]['order'])
+        )
+        self._remove(victim)
+        self._stats['evictions'] += 1
+        HOT_CHUNK_EVICTIONS.inc()
+
+    def _remove(self, slot):
+        neighbourhood = self._slots.pop(slot)
+        self._active[slot] = False
+        self._free.append(slot)
+        for key in neighbourhood['keys']:
+            entry = self._chunks[key]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._chunks[key]
+                self._bytes -= record_size(entry[0])
+
+    def stats(self):
+        lookups = self._stats['hits'] + self._stats['misses']
+        return {
+            **self._stats,
+            'hit_rate': (self._stats['hits'] / lookups) if lookups else None,
+            'neighbourhoods': len(self._slots),
+            'chunks': len(self._chunks),
+            'approx_bytes': self._bytes + (self._vectors.nbytes if self._vectors is not None else 0),
+            'max_neighbourhoods': self.max_neighbourhoods,
+            'max_chunks': self.max_chunks,
+            'max_bytes': self.max_bytes,
+            'similarity_threshold': self.similarity_threshold,
+            'index': self._version[0] if self._version else None,
+            'update_id': self._version[1] if self._version else None,
+        }
+
+
+hot_chunk_index = HotChunkIndex(
+    HOT_CHUNK_MAX_NEIGHBOURHOODS, HOT_CHUNK_MAX_CHUNKS, HOT_CHUNK_MAX_BYTES,
+    HOT_CHUNK_SIMILARITY_THRESHOLD, HOT_CHUNK_TTL_SECONDS
+)
+
+
+def hot_chunks_enabled():
+    return HOT_CHUNK_INDEX_ENABLED and embeddings_enabled()
+
+
+def get_hot_chunk_stats():
+    return {'enabled': hot_chunks_enabled(), **hot_chunk_index.stats()}
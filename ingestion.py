@@ -0,0 +1,151 @@
+# ingestion.py
+import os
+import asyncio
+import logging
+import asyncpg
+
+from db_pool import acquire
+
+logger = logging.getLogger(__name__)
+
+# Rows buffered per writer before producers have to wait (backpressure)
+INGEST_QUEUE_MAX_ROWS = int(os.getenv('INGEST_QUEUE_MAX_ROWS', '10000'))
+INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', '200'))
+INGEST_FLUSH_INTERVAL_SECONDS = float(os.getenv('INGEST_FLUSH_INTERVAL_SECONDS', '0.5'))
+# How long a request waits for queue space before it is answered with 503
+INGEST_ENQUEUE_TIMEOUT_SECONDS = float(os.getenv('INGEST_ENQUEUE_TIMEOUT_SECONDS', '2'))
+INGEST_MAX_RETRIES = int(os.getenv('INGEST_MAX_RETRIES', '3'))
+
+_writers = []
+
+
+class IngestQueueFull(Exception):
+    """The write-behind queue stayed full for INGEST_ENQUEUE_TIMEOUT_SECONDS."""
+
+
+class BatchWriter:
+    """
+    Write-behind queue for single-row INSERTs.
+
+    Requests put parameter tuples on a bounded queue and return immediately;
+    a background task drains up to INGEST_BATCH_SIZE rows at a time (or
+    whatever arrived within INGEST_FLUSH_INTERVAL_SECONDS) and inserts them
+    with one executemany. When the queue is full, put() waits for space, which
+    slows producers down instead of growing memory. close() drains the queue.
+    """
+
+    def __init__(self, name, insert_query, batch_size=INGEST_BATCH_SIZE,
+                 flush_interval=INGEST_FLUSH_INTERVAL_SECONDS, max_rows=INGEST_QUEUE_MAX_ROWS,
+                 after_write=None):
+        self.name = name
+        self.insert_query = insert_query
+        # Optional `async after_write(conn, rows)` run on the same connection after rows are inserted
+        self.after_write = after_write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=max_rows)
+        self._task = None
+        self._closing = False
+        self._stats = {'enqueued': 0, 'rejected': 0, 'batches': 0, 'rows_written': 0, 'errors': 0, 'rows_dropped': 0}
+        _writers.append(self)
+
+    async def put(self, row):
+        try:
+            await asyncio.wait_for(self._queue.put(row), INGEST_ENQUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self._stats['rejected'] += 1
+            raise IngestQueueFull(f"{self.name} ingestion queue is full")
+        self._stats['enqueued'] += 1
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        # The loop drains the queue and exits; never cancel it mid-insert
+        self._closing = True
+        if self._task is not None:
+            await self._task
+            self._task = None
+        while not self._queue.empty():
+            await self._write(self._take_batch())
+
+    def _take_batch(self, first=None):
+        batch = [] if first is None else [first]
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self):
+        while not (self._closing and self._queue.empty()):
+            try:
+                first = await asyncio.wait_for(self._queue.get(), self.flush_interval)
+            except asyncio.TimeoutError:
+                continue
+            # Give a burst a moment to accumulate into one batch
+            if not self._closing and self._queue.qsize() + 1 < self.batch_size:
+                await asyncio.sleep(self.flush_interval)
+            await self._write(self._take_batch(first))
+
+    async def _write(self, batch):
+        if not batch:
+            return
+        for attempt in range(1, INGEST_MAX_RETRIES + 1):
+            try:
+                async with acquire() as conn:
+                    await conn.executemany(self.insert_query, batch)
+                    await self._after_write(conn, batch)
+                self._stats['batches'] += 1
+                self._stats['rows_written'] += len(batch)
+                return
+            except (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError) as e:
+                # A bad row fails the whole executemany: retry row by row so only it is lost
+                logger.warning("%s: batch of %d rejected (%s), retrying row by row", self.name, len(batch), e)
+                await self._write_rows(batch)
+                return
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error("%s: failed to write %d rows (attempt %d): %s", self.name, len(batch), attempt, e)
+                if attempt < INGEST_MAX_RETRIES:
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        self._stats['rows_dropped'] += len(batch)
+
+    async def _write_rows(self, batch):
+        written = []
+        async with acquire() as conn:
+            for row in batch:
+                try:
+                    await conn.execute(self.insert_query, *row)
+                    written.append(row)
+                    self._stats['rows_written'] += 1
+                except (asyncpg.DataError, asyncpg.IntegrityConstraintViolationError) as e:
+                    self._stats['rows_dropped'] += 1
+                    logger.error("%s: dropped invalid row: %s", self.name, e)
+            await self._after_write(conn, written)
+
+    async def _after_write(self, conn, rows):
+        if self.after_write is None or not rows:
+            return
+        try:
+            await self.after_write(conn, rows)
+        except Exception as e:
+            # The rows themselves are stored; don't retry them over a side effect
+            logger.warning("%s: after-write hook failed: %s", self.name, e)
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'max_rows': self._queue.maxsize, 'batch_size': self.batch_size, **self._stats}
+
+
+async def start_ingestion():
+    for writer in _writers:
+        await writer.start()
+
+
+async def close_ingestion():
+    """Flush every writer. Called at shutdown, before the DB pool is closed."""
+    for writer in _writers:
+        await writer.close()
+
+
+def get_ingestion_stats():
+    return {writer.name: writer.stats() for writer in _writers}
@@ -0,0 +1,19 @@
+# interactions.py
+import hashlib
+
+
+def interaction_key(login_session_id, query, ai_response):
+    """
+    Compact identifier of one question/answer in a login session, written to
+    both azaisearch_logging and azaisearch_feedback so the report can join on
+    it instead of comparing the full query and ai_response text.
+
+    Must stay identical to the SQL backfill in migrations/004_interaction_key.sql:
+    sha256 over the three values (NULL -> '') joined with the unit separator.
+    """
+    payload = "\x1f".join([
+        "" if login_session_id is None else str(login_session_id),
+        query or "",
+        ai_response or "",
+    ])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
@@ -1,105 +1,242 @@
 # db_settings.py
 import os
+import time
+import logging
+import asyncio
 import asyncpg
 from dotenv import load_dotenv
+from azure.core.credentials import AzureKeyCredential
 from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
 from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from openai import AsyncAzureOpenAI
+from db_pool import acquire
+from metrics import SETTINGS_LOADS, SETTINGS_RELOAD_SECONDS
+from context_packer import DEFAULT_CONTEXT_TOKEN_BUDGET, DEFAULT_MAX_CHUNK_TOKENS
+from deadlines import REQUEST_TIMEOUT_SECONDS, DeadlineExceeded, within_deadline
+from near_dedup import DEFAULT_NEAR_DEDUP_ENABLED, DEFAULT_NEAR_DUP_THRESHOLD, DEFAULT_MAX_CHUNKS_PER_DOCUMENT
 
 # Load environment variables
 load_dotenv()
 
-# Async DB config
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
+logger = logging.getLogger(__name__)
 
-# ========================
-# DB Connection
-# ========================
-async def connect_db():
-    try:
-        return await asyncpg.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"❌ Database connection error: {e}")
-        return None
+# How long a loaded settings row is trusted before we re-check MAX(update_id)
+SETTINGS_CACHE_TTL_SECONDS = float(os.getenv('SETTINGS_CACHE_TTL_SECONDS', '30'))
+# After a failed refresh, serve the cached settings this long before the next attempt
+SETTINGS_REFRESH_RETRY_SECONDS = float(os.getenv('SETTINGS_REFRESH_RETRY_SECONDS', '5'))
+# Replaced clients are closed after this delay so in-flight requests can finish with them
+CLIENT_CLOSE_GRACE_SECONDS = float(os.getenv('CLIENT_CLOSE_GRACE_SECONDS', '60'))
+# Optional admin/query key for Azure Search instead of DefaultAzureCredential
+# (key-based services, and the local stand-in used by benchmarks/loadtest.py)
+AZURE_SEARCH_API_KEY = os.getenv('AZURE_SEARCH_API_KEY')
 
 # ========================
-# Load Settings from DB & Return Clients
+# Settings / Client Registry
 # ========================
-async def load_settings_and_get_clients():
-    """
-    Load settings from database and return configured clients.
-    Returns a dictionary with all settings and initialized clients.
-    """
-    conn = await connect_db()
-    if not conn:
-        raise RuntimeError("❌ Could not connect to the database.")
-
-    try:
-        query = """
-            SELECT * 
-            FROM azaisearch_ocm_settings2
-            WHERE update_id = (SELECT MAX(update_id) FROM azaisearch_ocm_settings2)
-        """
-        row = await conn.fetchrow(query)
+# One entry, keyed on update_id. Swapped as a whole so readers never see a
+# half-built config.
+_registry = {
+    'update_id': None,
+    'settings': None,
+    'checked_at': 0.0,
+}
+_registry_lock = asyncio.Lock()
+_registry_stats = {
+    'hits': 0,
+    'misses': 0,
+    'staleness_checks': 0,
+    'reloads': 0,
+    'invalidations': 0,
+}
 
-        if not row:
-            raise RuntimeError("⚠ No settings found in the database.")
+async def _fetch_latest_update_id(conn):
+    return await conn.fetchval("SELECT MAX(update_id) FROM azaisearch_ocm_settings2")
 
-        # Extract settings with decimal conversion
-        settings = {
-            'openai_api_key': row["openai_api_key"],
-            'azure_search_endpoint': row["azure_search_endpoint"],
-            'azure_search_index_name': row["azure_search_index_name"],
-            'current_prompt': row["current_prompt"],
-            'openai_api_version': row["openai_api_version"],
-            'openai_endpoint': row["openai_endpoint"],
-            'openai_model_deployment_name': row["openai_model_deployment_name"],
-            'openai_model_temperature': float(row["openai_model_temperature"]),
-            'semantic_configuration_name': row["semantic_configuration_name"],
-            'number_of_chunks': int(row["number_of_chunks"])
-        }
-
-        print("✅ Settings loaded from DB:")
-        print(f"openai_api_key: {settings['openai_api_key'][:6]}...")
-        print(f"azure_search_endpoint: {settings['azure_search_endpoint']}")
-        print(f"azure_search_index_name: {settings['azure_search_index_name']}")
-        print(f"openai_model_temperature: {settings['openai_model_temperature']}")
-        print(f"number_of_chunks: {settings['number_of_chunks']}")
-
-
-    finally:
-        await conn.close()
+async def _fetch_settings_row(conn, update_id):
+    query = """
+        SELECT *
+        FROM azaisearch_ocm_settings2
+        WHERE update_id = $1
+    """
+    return await conn.fetchrow(query, update_id)
+
+def _optional_setting(row, column, cast, default):
+    """Columns added by later migrations: missing or NULL means the default."""
+    value = row.get(column)
+    return default if value is None else cast(value)
+
+def _build_settings(row):
+    # Extract settings with decimal conversion
+    settings = {
+        'update_id': row["update_id"],
+        'openai_api_key': row["openai_api_key"],
+        'azure_search_endpoint': row["azure_search_endpoint"],
+        'azure_search_index_name': row["azure_search_index_name"],
+        'current_prompt': row["current_prompt"],
+        'openai_api_version': row["openai_api_version"],
+        'openai_endpoint': row["openai_endpoint"],
+        'openai_model_deployment_name': row["openai_model_deployment_name"],
+        'openai_model_temperature': float(row["openai_model_temperature"]),
+        'semantic_configuration_name': row["semantic_configuration_name"],
+        'number_of_chunks': int(row["number_of_chunks"]),
+        'context_token_budget': _optional_setting(row, "context_token_budget", int, DEFAULT_CONTEXT_TOKEN_BUDGET),
+        'max_chunk_tokens': _optional_setting(row, "max_chunk_tokens", int, DEFAULT_MAX_CHUNK_TOKENS),
+        'request_timeout_seconds': _optional_setting(row, "request_timeout_seconds", float, REQUEST_TIMEOUT_SECONDS),
+        'near_dedup_enabled': _optional_setting(row, "near_dedup_enabled", bool, DEFAULT_NEAR_DEDUP_ENABLED),
+        'near_dup_threshold': _optional_setting(row, "near_dup_threshold", float, DEFAULT_NEAR_DUP_THRESHOLD),
+        'max_chunks_per_document': _optional_setting(row, "max_chunks_per_document", int, DEFAULT_MAX_CHUNKS_PER_DOCUMENT)
+    }
+
+    logger.info("Settings loaded from DB", extra={
+        'update_id': settings['update_id'],
+        'azure_search_endpoint': settings['azure_search_endpoint'],
+        'azure_search_index_name': settings['azure_search_index_name'],
+        'openai_model_temperature': settings['openai_model_temperature'],
+        'number_of_chunks': settings['number_of_chunks'],
+        'context_token_budget': settings['context_token_budget'],
+    })
 
     # Initialize clients
-    credential = AsyncDefaultAzureCredential()
-    
+    if AZURE_SEARCH_API_KEY:
+        credential = None
+        search_credential = AzureKeyCredential(AZURE_SEARCH_API_KEY)
+    else:
+        credential = AsyncDefaultAzureCredential()
+        search_credential = credential
+
     openai_client = AsyncAzureOpenAI(
         api_version=settings['openai_api_version'],
         azure_endpoint=settings['openai_endpoint'],
-        api_key=settings['openai_api_key']
+        api_key=settings['openai_api_key'],
+        max_retries=0  # Retries are done by upstream_limiter, honouring Retry-After
     )
-    
+
     search_client = AsyncSearchClient(
         endpoint=settings['azure_search_endpoint'],
         index_name=settings['azure_search_index_name'],
-        credential=credential
+        credential=search_credential,
+        retry_total=0  # Retries are done by upstream_limiter
     )
 
     # Add clients to settings dictionary
+    settings['credential'] = credential
     settings['openai_client'] = openai_client
     settings['search_client'] = search_client
     settings['deployment_name'] = settings['openai_model_deployment_name']
 
-    print("✅ OpenAI client initialized:", openai_client is not None)
-    print("✅ Azure Search client initialized:", search_client is not None)
+    logger.debug("OpenAI and Azure Search clients initialized", extra={'update_id': settings['update_id']})
 
     return settings
 
+async def _close_clients(settings, delay):
+    """Close the clients of a replaced settings entry once in-flight requests are done."""
+    await asyncio.sleep(delay)
+    for key in ('openai_client', 'search_client', 'credential'):
+        client = settings.get(key)
+        if client is None:
+            continue
+        try:
+            await client.close()
+        except Exception as e:
+            logger.warning("Failed to close %s for update_id=%s: %s", key, settings.get('update_id'), e)
+
+# Pending _close_clients tasks; the event loop only keeps weak references
+_close_tasks = set()
+
+def _swap_registry(settings, now):
+    old_settings = _registry['settings']
+    _registry['update_id'] = settings['update_id']
+    _registry['settings'] = settings
+    _registry['checked_at'] = now
+    if old_settings is not None:
+        task = asyncio.create_task(_close_clients(old_settings, CLIENT_CLOSE_GRACE_SECONDS))
+        _close_tasks.add(task)
+        task.add_done_callback(_close_tasks.discard)
+
+def invalidate_settings_cache():
+    """Force the next call to re-check the settings table (e.g. after /update_settings)."""
+    _registry['checked_at'] = 0.0
+    _registry_stats['invalidations'] += 1
+
+def get_settings_cache_stats():
+    lookups = _registry_stats['hits'] + _registry_stats['misses']
+    return {
+        **_registry_stats,
+        'hit_rate': (_registry_stats['hits'] / lookups) if lookups else None,
+        'update_id': _registry['update_id'],
+        'ttl_seconds': SETTINGS_CACHE_TTL_SECONDS,
+    }
+
+async def _fetch_newer_settings_row(cached):
+    """The latest settings row, or None when it is the one already cached."""
+    async with acquire() as conn:
+        _registry_stats['staleness_checks'] += 1
+        latest_update_id = await _fetch_latest_update_id(conn)
+        if latest_update_id is None:
+            raise RuntimeError("⚠ No settings found in the database.")
+
+        if cached is not None and latest_update_id == _registry['update_id']:
+            return None
+
+        row = await _fetch_settings_row(conn, latest_update_id)
+        if not row:
+            raise RuntimeError("⚠ No settings found in the database.")
+        return row
 
+# ========================
+# Load Settings from DB & Return Clients
+# ========================
+async def load_settings_and_get_clients():
+    """
+    Return the latest settings and configured clients.
 
+    Settings and clients are cached per update_id. Within SETTINGS_CACHE_TTL_SECONDS
+    the cached entry is returned without touching the database; after that only
+    MAX(update_id) is checked, and the row is re-read and clients rebuilt only
+    when a newer settings row exists.
+    """
+    cached = _registry['settings']
+    if cached is not None and time.monotonic() - _registry['checked_at'] < SETTINGS_CACHE_TTL_SECONDS:
+        _registry_stats['hits'] += 1
+        SETTINGS_LOADS.labels('hit').inc()
+        return cached
+
+    async with _registry_lock:
+        # Another request may have refreshed the entry while we waited
+        cached = _registry['settings']
+        if cached is not None and time.monotonic() - _registry['checked_at'] < SETTINGS_CACHE_TTL_SECONDS:
+            _registry_stats['hits'] += 1
+            SETTINGS_LOADS.labels('hit').inc()
+            return cached
+
+        start = time.perf_counter()
+        try:
+            # Bounded by the caller's request deadline, if it has one
+            row = await within_deadline(_fetch_newer_settings_row(cached), 'settings')
+            if row is None:
+                _registry['checked_at'] = time.monotonic()
+                _registry_stats['hits'] += 1
+                SETTINGS_LOADS.labels('unchanged').inc()
+                SETTINGS_RELOAD_SECONDS.observe(time.perf_counter() - start)
+                return cached
+        except (OSError, asyncpg.PostgresError, RuntimeError, DeadlineExceeded) as e:
+            if cached is None:
+                SETTINGS_LOADS.labels('error').inc()
+                raise
+            # Keep serving the last known settings rather than failing every request
+            logger.warning("Could not refresh settings (%s), serving cached settings", e)
+            # Back off: otherwise, while the database is down, every request queues on the
+            # lock and waits out its own timeout in turn
+            retry_in = min(SETTINGS_REFRESH_RETRY_SECONDS, SETTINGS_CACHE_TTL_SECONDS)
+            _registry['checked_at'] = time.monotonic() - SETTINGS_CACHE_TTL_SECONDS + retry_in
+            _registry_stats['hits'] += 1
+            SETTINGS_LOADS.labels('stale').inc()
+            return cached
+
+        settings = _build_settings(row)
+        _swap_registry(settings, time.monotonic())
+        _registry_stats['misses'] += 1
+        _registry_stats['reloads'] += 1
+        SETTINGS_LOADS.labels('reload').inc()
+        SETTINGS_RELOAD_SECONDS.observe(time.perf_counter() - start)
+        return settings
@@ -0,0 +1,192 @@
+# log_config.py
+"""
+Structured, non-blocking logging.
+
+Every record is put on an in-memory queue by a QueueHandler and written to
+stdout as one JSON object per line by a QueueListener thread, so logging
+from the event loop never waits on stdout (a pipe in App Service). When the
+queue is full, records are dropped and counted instead of blocking.
+
+Environment:
+    LOG_LEVEL               root level (default INFO)
+    LOG_LEVELS              per-module levels, e.g. "search_query=DEBUG,saml=WARNING"
+    LOG_QUEUE_SIZE          records buffered before dropping (default 10000)
+    LOG_CHUNK_SAMPLE_RATE   share of /ask requests that log the retrieved chunks (default 0.01)
+
+Modules log through logging.getLogger(__name__) and pass structured fields
+with extra={...}. Records carry the id of the request they were logged for
+(request_id_var, set per request in app.py).
+"""
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import datetime
+from contextvars import ContextVar
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+LOG_CHUNK_SAMPLE_RATE = float(os.getenv('LOG_CHUNK_SAMPLE_RATE', '0.01'))
+
+# SDKs that log every HTTP call at INFO; LOG_LEVELS can override these
+_DEFAULT_MODULE_LEVELS = {
+    'azure': 'WARNING',
+    'openai': 'WARNING',
+    'httpx': 'WARNING',
+    'httpcore': 'WARNING',
+}
+
+# Id of the HTTP request being handled; copied into tasks it creates
+request_id_var = ContextVar('request_id', default=None)
+
+# Attributes every LogRecord has; anything else came in through extra={...}
+_RESERVED_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'request_id'}
+
+_listener = None
+_file_listeners = []
+_stats = {
+    'dropped': 0,
+}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record: time, level, logger, message, request_id and extra fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        request_id = getattr(record, 'request_id', None)
+        if request_id:
+            entry['request_id'] = request_id
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        elif record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class _RequestIdFilter(logging.Filter):
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class _NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops instead of blocking and leaves JSON encoding to the listener thread."""
+
+    def prepare(self, record):
+        # Resolve the message and traceback now (arguments may change later),
+        # but serialise in the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _stats['dropped'] += 1
+
+
+def _parse_module_levels(spec):
+    levels = {}
+    for item in spec.split(','):
+        name, _, level = item.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging():
+    """Install the queue handler on the root logger and start the writer thread (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    queue_handler = _NonBlockingQueueHandler(log_queue)
+    queue_handler.addFilter(_RequestIdFilter())
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(LOG_LEVEL)
+    for name, level in {**_DEFAULT_MODULE_LEVELS, **_parse_module_levels(LOG_LEVELS)}.items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Flush queued records and stop the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def file_logger(name, path, max_bytes, backup_count):
+    """
+    Logger writing JSON lines to its own rotating file, off the event loop
+    like the root handler. Records do not propagate to stdout.
+    """
+    file_queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8', delay=True)
+    file_handler.setFormatter(JsonFormatter())
+
+    queue_handler = _NonBlockingQueueHandler(file_queue)
+    queue_handler.addFilter(_RequestIdFilter())
+
+    logger = logging.getLogger(name)
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+    logger.addHandler(queue_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    listener = QueueListener(file_queue, file_handler)
+    listener.start()
+    _file_listeners.append(listener)
+    if len(_file_listeners) == 1:
+        atexit.register(_stop_file_loggers)
+    return logger
+
+
+def _stop_file_loggers():
+    while _file_listeners:
+        _file_listeners.pop().stop()
+
+
+def sampled(rate):
+    """True for roughly `rate` of calls; used to thin out verbose diagnostics."""
+    return rate > 0 and (rate >= 1 or random.random() < rate)
+
+
+def get_logging_stats():
+    return {
+        **_stats,
+        'queued': _listener.queue.qsize() if _listener is not None else 0,
+        'queue_size': LOG_QUEUE_SIZE,
+        'chunk_sample_rate': LOG_CHUNK_SAMPLE_RATE,
+    }
@@ -1,23 +1,20 @@
 # logging_chat.py
 
-import asyncpg
 from quart import request, jsonify
-import os
-from dotenv import load_dotenv  
+from interactions import interaction_key
+from ingestion import BatchWriter, IngestQueueFull
+from report_users import record_report_users
 
-load_dotenv()
+async def _record_users(conn, rows):
+    # Keep the report's user list current without scanning azaisearch_logging
+    await record_report_users(conn, {row[2] for row in rows})
 
-# Async DB config
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
-
-async def get_db_connection():
-    return await asyncpg.connect(**DB_CONFIG)
+# Rows are inserted in batches by a background task (see ingestion.py)
+log_writer = BatchWriter("log", """
+    INSERT INTO azaisearch_logging 
+    (chat_session_id, user_id, user_name, query, ai_response, citations, login_session_id, job_title, interaction_key)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+""", after_write=_record_users)
 
 async def log_query():
     data = await request.get_json()
@@ -35,16 +32,7 @@ async def log_query():
 
     
     try:
-        conn = await get_db_connection()
-
-        insert_query = """
-            INSERT INTO azaisearch_logging 
-            (chat_session_id, user_id, user_name, query, ai_response, citations, login_session_id, job_title)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
-        """
-
-        await conn.execute(
-            insert_query,
+        await log_writer.put((
             data["chat_session_id"],
             data["user_id"],
             data["user_name"],
@@ -52,12 +40,13 @@ async def log_query():
             data["ai_response"],
             data["citations"],
             data["login_session_id"],
-            job_title # can be None -> inserts NULL
-        )
-
-        await conn.close()
+            job_title, # can be None -> inserts NULL
+            interaction_key(data["login_session_id"], data["query"], data["ai_response"])
+        ))
 
         return jsonify({"message": "Log inserted successfully"}), 201
 
+    except IngestQueueFull as e:
+        return jsonify({"error": str(e)}), 503, {"Retry-After": "1"}
     except Exception as e:
         return jsonify({"error": str(e)}), 500
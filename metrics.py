@@ -0,0 +1,153 @@
+# metrics.py
+"""
+Prometheus metrics, exposed on /metrics.
+
+Single worker: metrics live in the default in-process registry.
+Several workers (uvicorn --workers N, gunicorn): set PROMETHEUS_MULTIPROC_DIR
+to an empty directory, writable by every worker and wiped on each deploy,
+before the app starts. Each worker then writes its samples there and /metrics
+aggregates all of them, whichever worker answers the scrape.
+"""
+import os
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+
+# Seconds; upstream calls (search, completions) land in the upper half
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+# DB pool waits should be near zero; the tail is what matters
+ACQUIRE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# ========================
+# /ask pipeline
+# ========================
+ASK_STAGE_SECONDS = Histogram(
+    'azai_ask_stage_seconds', 'Wall time of each /ask stage (the keys of the response "timings")',
+    ['stage'], buckets=LATENCY_BUCKETS)
+ASK_REQUESTS = Counter(
+    'azai_ask_requests_total', '/ask requests by mode (json, stream) and answer-cache outcome',
+    ['mode', 'answer_cache'])
+ASK_STAGE_ERRORS = Counter(
+    'azai_ask_stage_errors_total', '/ask stages that raised', ['stage'])
+ASK_CHUNKS = Histogram(
+    'azai_ask_chunks', 'Chunks per /ask: retrieved from search, unique after dedup, packed into the prompt',
+    ['kind'], buckets=(0, 1, 2, 5, 10, 15, 20, 30, 50, 100))
+ASK_DEDUP_RATIO = Histogram(
+    'azai_ask_dedup_ratio', 'Unique chunks / retrieved chunks per /ask',
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0))
+ASK_CONTEXT_TOKENS = Histogram(
+    'azai_ask_context_tokens', 'Tokens of sources packed into the answer prompt',
+    buckets=(250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 12000, 16000, 32000))
+ASK_NEAR_DEDUP_REMOVED = Counter(
+    'azai_ask_near_dedup_removed_total', 'Chunks removed by the near-duplicate filter, by rule (near_duplicate, document_cap)',
+    ['rule'])
+ASK_NEAR_DEDUP_TOKENS_SAVED = Histogram(
+    'azai_ask_near_dedup_tokens_saved', 'Tokens of the chunks removed by the near-duplicate filter per /ask',
+    buckets=(0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000))
+ASK_PROMPT_CHARS = Histogram(
+    'azai_ask_prompt_chars', 'Length of the answer prompt in characters',
+    buckets=(1000, 2500, 5000, 10000, 20000, 30000, 50000, 75000, 100000, 200000))
+DEADLINES_EXCEEDED = Counter(
+    'azai_deadlines_exceeded_total', '/ask requests that ran out of time budget, by stage', ['stage'])
+HEDGED_REQUESTS = Counter(
+    'azai_hedged_requests_total', 'Hedged duplicate requests sent, and how many of them won',
+    ['upstream', 'outcome'])
+SINGLE_FLIGHT_CALLS = Counter(
+    'azai_single_flight_calls_total',
+    'Coalesced upstream calls (single_flight.py): leaders ran the call, coalesced waited for a leader',
+    ['flight', 'role'])
+HOT_CHUNK_LOOKUPS = Counter(
+    'azai_hot_chunk_lookups_total', 'Searches answered from the in-process hot-chunk index (hit) or sent to Azure (miss)',
+    ['outcome'])
+HOT_CHUNK_EVICTIONS = Counter(
+    'azai_hot_chunk_evictions_total', 'Neighbourhoods evicted from the hot-chunk index (least frequently used)')
+FOLLOW_UP_SECONDS = Histogram(
+    'azai_follow_up_completion_seconds', 'Background follow-up question completions',
+    ['outcome'], buckets=LATENCY_BUCKETS)
+
+# ========================
+# Upstream admission (upstream_limiter.py)
+# ========================
+UPSTREAM_IN_FLIGHT = Gauge(
+    'azai_upstream_in_flight', 'Upstream calls holding a limiter slot', ['upstream'],
+    multiprocess_mode='livesum')
+UPSTREAM_WAITING = Gauge(
+    'azai_upstream_waiting', 'Requests queued for an upstream limiter slot', ['upstream'],
+    multiprocess_mode='livesum')
+UPSTREAM_WAIT_SECONDS = Histogram(
+    'azai_upstream_wait_seconds', 'Time spent queued for an upstream limiter slot',
+    ['upstream'], buckets=ACQUIRE_BUCKETS)
+UPSTREAM_RETRIES = Counter(
+    'azai_upstream_retries_total', 'Upstream calls retried after a throttled / transient response',
+    ['upstream', 'status'])
+UPSTREAM_REJECTIONS = Counter(
+    'azai_upstream_rejections_total', 'Requests refused with 503 (queue_full, wait_timeout, throttled)',
+    ['upstream', 'reason'])
+
+# ========================
+# Settings / DB
+# ========================
+SETTINGS_LOADS = Counter(
+    'azai_settings_loads_total',
+    'load_settings_and_get_clients calls by outcome (hit, unchanged, reload, stale, error)',
+    ['outcome'])
+SETTINGS_RELOAD_SECONDS = Histogram(
+    'azai_settings_reload_seconds', 'Database round-trips of a settings staleness check or reload',
+    buckets=LATENCY_BUCKETS)
+DB_ACQUIRE_SECONDS = Histogram(
+    'azai_db_acquire_seconds', 'Time spent waiting for a pooled database connection',
+    buckets=ACQUIRE_BUCKETS)
+DB_ACQUIRE_TIMEOUTS = Counter(
+    'azai_db_acquire_timeouts_total', 'Pool acquires that timed out')
+
+# ========================
+# HTTP
+# ========================
+HTTP_REQUEST_SECONDS = Histogram(
+    'azai_http_request_seconds',
+    'Route handler time until the response is produced (streamed bodies are not included)',
+    ['route', 'method', 'status'], buckets=LATENCY_BUCKETS)
+
+
+def observe_ask_stage(stage, seconds):
+    ASK_STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def observe_retrieval(retrieved, unique, context_report, prompt_chars, near_dedup_report=None):
+    ASK_CHUNKS.labels('retrieved').observe(retrieved)
+    ASK_CHUNKS.labels('unique').observe(unique)
+    ASK_CHUNKS.labels('packed').observe(context_report['chunks_packed'])
+    if retrieved:
+        ASK_DEDUP_RATIO.observe(unique / retrieved)
+    ASK_CONTEXT_TOKENS.observe(context_report['used_tokens'])
+    ASK_PROMPT_CHARS.observe(prompt_chars)
+    if near_dedup_report is not None:
+        ASK_NEAR_DEDUP_REMOVED.labels('near_duplicate').inc(near_dedup_report['near_duplicates_removed'])
+        ASK_NEAR_DEDUP_REMOVED.labels('document_cap').inc(near_dedup_report['capped_removed'])
+        ASK_NEAR_DEDUP_TOKENS_SAVED.observe(near_dedup_report['tokens_saved'])
+
+
+def metrics_payload():
+    """(body, content_type) for the /metrics response."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def mark_worker_exited():
+    """Drop this worker's live samples in multiprocess mode (call on shutdown)."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
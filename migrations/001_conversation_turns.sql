@@ -0,0 +1,17 @@
+-- Conversation turns for CONVERSATION_STORE_BACKEND=postgres (conversation_store.PostgresConversationStore)
+
+CREATE TABLE IF NOT EXISTS azaisearch_conversation_turns (
+    turn_id      UUID PRIMARY KEY,
+    user_id      TEXT NOT NULL,
+    query        TEXT NOT NULL,
+    ai_response  TEXT NOT NULL,
+    created_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- "Last N turns of this user" reads
+CREATE INDEX IF NOT EXISTS idx_conversation_turns_user_created
+    ON azaisearch_conversation_turns (user_id, created_at DESC);
+
+-- Periodic pruning of expired turns
+CREATE INDEX IF NOT EXISTS idx_conversation_turns_created
+    ON azaisearch_conversation_turns (created_at);
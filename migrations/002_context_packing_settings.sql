@@ -0,0 +1,5 @@
+-- Token budget for the sources section of the answer prompt (context_packer.pack_context).
+-- NULL means the defaults in context_packer.py.
+
+ALTER TABLE azaisearch_ocm_settings2 ADD COLUMN IF NOT EXISTS context_token_budget INTEGER;
+ALTER TABLE azaisearch_ocm_settings2 ADD COLUMN IF NOT EXISTS max_chunk_tokens INTEGER;
@@ -0,0 +1,5 @@
+-- Supports keyset pagination of the AZAI report (report.azai_report_page):
+-- ORDER BY date_and_time DESC, id DESC with a (date_and_time, id) < (cursor) predicate.
+
+CREATE INDEX IF NOT EXISTS idx_logging_date_and_time_id
+    ON azaisearch_logging (date_and_time DESC, id DESC);
@@ -0,0 +1,28 @@
+-- Stable interaction key shared by azaisearch_logging and azaisearch_feedback
+-- (interactions.interaction_key), replacing the join on login_session_id + query + ai_response.
+--
+-- Run this before deploying the code that writes interaction_key, then run the two
+-- UPDATE statements once more afterwards to cover rows written in between
+-- (they only touch rows whose key is still NULL).
+
+ALTER TABLE azaisearch_logging  ADD COLUMN IF NOT EXISTS interaction_key CHAR(64);
+ALTER TABLE azaisearch_feedback ADD COLUMN IF NOT EXISTS interaction_key CHAR(64);
+
+UPDATE azaisearch_logging
+SET interaction_key = encode(sha256(convert_to(
+        coalesce(login_session_id::text, '') || chr(31) || coalesce(query, '') || chr(31) || coalesce(ai_response, ''),
+        'UTF8')), 'hex')
+WHERE interaction_key IS NULL;
+
+UPDATE azaisearch_feedback
+SET interaction_key = encode(sha256(convert_to(
+        coalesce(login_session_id::text, '') || chr(31) || coalesce(query, '') || chr(31) || coalesce(ai_response, ''),
+        'UTF8')), 'hex')
+WHERE interaction_key IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_logging_interaction_key  ON azaisearch_logging (interaction_key);
+CREATE INDEX IF NOT EXISTS idx_feedback_interaction_key ON azaisearch_feedback (interaction_key);
+
+-- Date-range filter of the report (the keyset index from 003 leads with date_and_time too,
+-- this one keeps plain range scans cheap for the legacy full report and exports)
+CREATE INDEX IF NOT EXISTS idx_logging_date_and_time ON azaisearch_logging (date_and_time);
@@ -0,0 +1,26 @@
+-- Maintained set of users for the report UI (report_users.py) and the exclusion
+-- list shared by /distinct_values and /azai_report (previously hard-coded in both).
+
+CREATE TABLE IF NOT EXISTS azaisearch_report_excluded_users (
+    user_name  TEXT PRIMARY KEY,
+    added_at   TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO azaisearch_report_excluded_users (user_name) VALUES
+    ('HardCodedUser'), ('{"Jain, Anshuman"}'), ('{"Chanbasava Koti"}'),
+    ('{"Sachin Bhusanurmath"}'), ('Test User'), ('Sai Charan Kumbham'),
+    ('John Doe'), ('Solomon Bhaskar'), ('Harsh Aneppanavar'), ('Sachin Ksr'),
+    ('Gaston Chan'), ('John Doe1'), ('Chanbasava Koti'), ('Jain, Anshuman'),
+    ('Sachin Bhusanurmath'), ('Anonymous'), ('Vinayak Inamadar'), ('Raqib Rasheed')
+ON CONFLICT (user_name) DO NOTHING;
+
+-- Every user_name that ever appeared in azaisearch_logging; new names are added
+-- when /log rows are flushed, so the UI never has to scan the logging table.
+CREATE TABLE IF NOT EXISTS azaisearch_report_users (
+    user_name   TEXT PRIMARY KEY,
+    first_seen  TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+INSERT INTO azaisearch_report_users (user_name)
+SELECT DISTINCT user_name FROM azaisearch_logging WHERE user_name IS NOT NULL
+ON CONFLICT (user_name) DO NOTHING;
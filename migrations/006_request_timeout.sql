@@ -0,0 +1,4 @@
+-- Time budget for one /ask request (deadlines.py), in seconds.
+-- NULL means REQUEST_TIMEOUT_SECONDS from the environment (default 60).
+
+ALTER TABLE azaisearch_ocm_settings2 ADD COLUMN IF NOT EXISTS request_timeout_seconds NUMERIC;
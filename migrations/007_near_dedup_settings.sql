@@ -0,0 +1,6 @@
+-- Near-duplicate chunk filter and per-document chunk cap (near_dedup.py).
+-- NULL means the defaults in near_dedup.py (enabled, threshold 0.8, no cap).
+
+ALTER TABLE azaisearch_ocm_settings2 ADD COLUMN IF NOT EXISTS near_dedup_enabled BOOLEAN;
+ALTER TABLE azaisearch_ocm_settings2 ADD COLUMN IF NOT EXISTS near_dup_threshold NUMERIC;
+ALTER TABLE azaisearch_ocm_settings2 ADD COLUMN IF NOT EXISTS max_chunks_per_document INTEGER;
@@ -0,0 +1,186 @@
+# near_dedup.py
+"""
+Near-duplicate chunk filter, run on the /ask chunks after exact dedup and
+before context packing.
+
+Overlapping chunker windows and documents indexed twice under slightly
+different parent_ids put almost the same passage into the prompt more than
+once. Each chunk text gets a MinHash signature over its word 3-shingles
+(memoised per text, so repeat chunks cost a dict lookup); two chunks whose
+estimated Jaccard similarity reaches the threshold are duplicates and only
+the higher-scoring one is kept. A per-document cap then limits how many
+chunks one parent_id may contribute.
+
+Settings columns (NULL means the defaults below): near_dedup_enabled,
+near_dup_threshold, max_chunks_per_document.
+"""
+import os
+
+import numpy as np
+
+from ttl_cache import TTLCache
+from token_utils import count_tokens
+
+DEFAULT_NEAR_DEDUP_ENABLED = True
+# Estimated Jaccard similarity of word 3-shingles at which two chunks are duplicates
+DEFAULT_NEAR_DUP_THRESHOLD = 0.8
+# None: no cap
+DEFAULT_MAX_CHUNKS_PER_DOCUMENT = None
+
+NEAR_DEDUP_SIGNATURE_CACHE_SIZE = int(os.getenv('NEAR_DEDUP_SIGNATURE_CACHE_SIZE', '20000'))
+
+SHINGLE_WORDS = 3
+NUM_PERMUTATIONS = 64
+
+# Hash family h_i(x) = (a_i * x + b_i) mod 2**32 over 32-bit shingle hashes (a_i odd,
+# so each h_i permutes the hash space). Fixed seed: signatures stay comparable for the
+# lifetime of the process.
+_rng = np.random.default_rng(0x5EED)
+_A = (_rng.integers(1, 2 ** 32, NUM_PERMUTATIONS, dtype=np.uint32) | np.uint32(1)).reshape(-1, 1)
+_B = _rng.integers(0, 2 ** 32, NUM_PERMUTATIONS, dtype=np.uint32).reshape(-1, 1)
+# Position-dependent odd multipliers, so "a b c" and "c b a" hash differently
+_SHINGLE_MULTIPLIERS = _rng.integers(1, 2 ** 63, SHINGLE_WORDS, dtype=np.uint64) | np.uint64(1)
+
+# Words hash as polynomials in an odd base mod 2**64 (odd, so it has an inverse)
+_WORD_HASH_BASE = 0x100000001B3
+_WORD_HASH_INVERSE = pow(_WORD_HASH_BASE, -1, 2 ** 64)
+_powers = _inverse_powers = np.ones(0, dtype=np.uint64)
+
+_signatures = TTLCache(NEAR_DEDUP_SIGNATURE_CACHE_SIZE, 3600)
+
+
+def _geometric(ratio, length):
+    """ratio ** k for k in 0 .. length - 1, wrapping mod 2**64."""
+    factors = np.full(length, ratio, dtype=np.uint64)
+    factors[0] = 1
+    return np.cumprod(factors)
+
+
+def _power_tables(size):
+    """Powers of the word hash base and of its inverse, at least `size` long (grown on demand)."""
+    global _powers, _inverse_powers
+    if len(_powers) < size:
+        length = max(size, 2 * len(_powers))
+        _powers = _geometric(_WORD_HASH_BASE, length)
+        _inverse_powers = _geometric(_WORD_HASH_INVERSE, length)
+    return _powers, _inverse_powers
+
+
+def _word_hashes(texts):
+    """
+    64-bit hashes of the lower-cased, whitespace-separated words of each text,
+    all texts in one array. Returns (hashes, lengths): text i has lengths[i] words.
+    Works on the UTF-8 bytes in numpy; str.split and hash per word were most of
+    the cost of a cold batch.
+    """
+    # A text without words hashes as one placeholder word (never produced by UTF-8)
+    encoded = [text.lower().encode() if text and not text.isspace() else b"\xff" for text in texts]
+    data = np.frombuffer(b" ".join(encoded), dtype=np.uint8)
+    powers, inverse_powers = _power_tables(len(data))
+
+    # Words are the runs of bytes above ASCII space
+    in_word = np.zeros(len(data) + 2, dtype=bool)
+    np.greater(data, 32, out=in_word[1:-1])
+    starts = np.flatnonzero(in_word[1:] != in_word[:-1])[0::2]
+
+    # Polynomial hash of each word, sum(b_j * B**j) over its bytes (separators zeroed),
+    # shifted back by B**-start so the same word hashes the same wherever it is
+    weighted = (data * in_word[1:-1]) * powers[:len(data)]
+    hashes = np.add.reduceat(weighted, starts) * inverse_powers[starts]
+
+    # Texts are joined by one space, so text i's bytes start after the previous ones and their separators
+    sizes = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)) + 1
+    first_words = np.searchsorted(starts, np.cumsum(sizes) - sizes)
+    lengths = np.diff(first_words, append=len(starts))
+    return hashes, lengths
+
+
+def _shingle_hashes(texts):
+    """
+    32-bit hashes of the word 3-shingles of each text, all texts in one array.
+    Returns (hashes, offsets): text i's shingles start at offsets[i].
+    """
+    hashes, lengths = _word_hashes(texts)
+
+    # Shingle k covers words k .. k+2 of the concatenation; pad so every k has three words
+    padded = np.concatenate([hashes, np.zeros(SHINGLE_WORDS - 1, dtype=np.uint64)])
+    shingles = padded[:len(hashes)] * _SHINGLE_MULTIPLIERS[0]
+    for offset in range(1, SHINGLE_WORDS):
+        shingles ^= padded[offset:offset + len(hashes)] * _SHINGLE_MULTIPLIERS[offset]
+
+    # Keep the shingles that start and end inside one text (a text shorter than a
+    # shingle keeps its first position, hashing the words it has)
+    starts = np.cumsum(lengths) - lengths
+    counts = np.maximum(lengths - SHINGLE_WORDS + 1, 1)
+    keep = np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+    short = np.flatnonzero(lengths < SHINGLE_WORDS)
+    for i in short:
+        text_hashes = hashes[starts[i]:starts[i] + lengths[i]]
+        shingles[starts[i]] = np.bitwise_xor.reduce(text_hashes * _SHINGLE_MULTIPLIERS[:lengths[i]])
+    shingles = shingles[keep]
+    return (shingles ^ (shingles >> np.uint64(32))).astype(np.uint32), np.cumsum(counts) - counts
+
+
+def minhash_signatures(texts):
+    """
+    MinHash signatures (one row of NUM_PERMUTATIONS uint32 values per text).
+    Memoised per text; the texts not seen before are hashed in one batch.
+    """
+    signatures = [_signatures.get(text) for text in texts]
+    missing = [i for i, signature in enumerate(signatures) if signature is None]
+    if missing:
+        shingles, offsets = _shingle_hashes([texts[i] for i in missing])
+        # (NUM_PERMUTATIONS, total shingles), wrapping uint32 arithmetic, in place
+        permuted = _A * shingles
+        permuted += _B
+        computed = np.ascontiguousarray(np.minimum.reduceat(permuted, offsets, axis=1).T)
+        for i, signature in zip(missing, computed):
+            _signatures.set(texts[i], signature)
+            signatures[i] = signature
+    return np.stack(signatures)
+
+
+def filter_near_duplicates(chunks, threshold=DEFAULT_NEAR_DUP_THRESHOLD, max_per_document=DEFAULT_MAX_CHUNKS_PER_DOCUMENT):
+    """
+    Drop near-duplicate chunks and chunks over the per-document cap.
+
+    Chunks are considered best score first (ties keep retrieval order), so of
+    two duplicates the better-ranked one stays and the cap keeps a document's
+    best chunks. Survivors are returned in their original order.
+
+    Returns (kept_chunks, report) where report counts chunks removed by each
+    rule and the tokens they would have cost.
+    """
+    report = {"near_duplicates_removed": 0, "capped_removed": 0, "tokens_saved": 0}
+    if len(chunks) < 2:
+        return chunks, report
+
+    signatures = minhash_signatures([chunk["chunk"] for chunk in chunks])
+    # Chunks i and j are duplicates when enough signature positions agree (estimated Jaccard >= threshold)
+    agreeing = np.count_nonzero(signatures[:, None, :] == signatures[None, :, :], axis=2)
+    duplicate = (agreeing >= threshold * NUM_PERMUTATIONS).tolist()
+
+    order = sorted(range(len(chunks)), key=lambda i: -(chunks[i].get("score") or 0.0))
+    kept = []
+    per_document = {}
+    removed = []
+    for i in order:
+        if any(duplicate[i][k] for k in kept):
+            report["near_duplicates_removed"] += 1
+            removed.append(i)
+            continue
+        parent_id = chunks[i]["parent_id"]
+        if max_per_document and per_document.get(parent_id, 0) >= max_per_document:
+            report["capped_removed"] += 1
+            removed.append(i)
+            continue
+        per_document[parent_id] = per_document.get(parent_id, 0) + 1
+        kept.append(i)
+
+    report["tokens_saved"] = sum(count_tokens(chunks[i]["chunk"]) for i in removed)
+    kept.sort()
+    return [chunks[i] for i in kept], report
+
+
+def get_near_dedup_stats():
+    return {'signature_cache': _signatures.stats()}
@@ -1,19 +1,111 @@
-import os
-import asyncpg
-from typing import Optional, Dict, List, Any
+import io
+import csv
+import json
+import base64
+from typing import Optional, Dict, List, Any, Tuple, AsyncIterator
 from datetime import datetime
+from db_pool import acquire
+from report_users import excluded_user_filter
 
-# Database configuration
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
+# Page size bounds for keyset pagination
+DEFAULT_PAGE_SIZE = 15
+MAX_PAGE_SIZE = 200
 
-async def get_db_connection():
-    return await asyncpg.connect(**DB_CONFIG)
+# Streaming export: rows fetched per server-side cursor round-trip,
+# and rows serialized into each chunk of the HTTP response
+EXPORT_PREFETCH_ROWS = 500
+EXPORT_ROWS_PER_CHUNK = 100
+EXPORT_FORMATS = ('csv', 'ndjson')
+EXPORT_FIELDS = ['user_name', 'job_title', 'query', 'ai_response', 'citations', 'date_and_time', 'feedback_type', 'feedback']
+
+REPORT_COLUMNS = """
+            t1.user_name,
+            t1.job_title,
+            t1.query,
+            t1.ai_response,
+            t1.citations,
+            t1.date_and_time,
+            t2.feedback_type,                     
+            t2.feedback    
+"""
+
+REPORT_FROM = """
+        FROM 
+            azaisearch_logging t1
+        LEFT JOIN 
+            azaisearch_feedback t2
+        ON 
+            t1.interaction_key = t2.interaction_key
+"""
+
+
+def _build_report_filters(
+    start_date: str,
+    end_date: str,
+    user_name: Optional[str] = None,
+    feedback_type: Optional[str] = None
+) -> Tuple[str, List[Any]]:
+    """
+    WHERE clause and parameters shared by every report query.
+    
+    Returns:
+        (where_sql, params) with params numbered from $1
+    """
+    # Convert string dates to datetime objects
+    from datetime import datetime as dt
+    start_date_obj = dt.strptime(start_date, '%Y-%m-%d').date()
+    end_date_obj = dt.strptime(end_date, '%Y-%m-%d').date()
+    
+    where_sql = f"""
+        WHERE 
+            t1.user_name IS NOT NULL
+            AND {excluded_user_filter('t1.user_name')}
+            AND t1.date_and_time >= $1 
+            AND t1.date_and_time <= $2
+    """
+    
+    # Build dynamic WHERE clauses and parameters
+    params = [start_date_obj, end_date_obj]
+    param_counter = 3
+    
+    if user_name:
+        where_sql += f" AND t1.user_name = ${param_counter}"
+        params.append(user_name)
+        param_counter += 1
+    
+    if feedback_type:
+        where_sql += f" AND t2.feedback_type = ${param_counter}"
+        params.append(feedback_type)
+        param_counter += 1
+    
+    return where_sql, params
+
+
+def _row_to_dict(row) -> Dict[str, Any]:
+    return {
+        'user_name': row['user_name'],
+        'job_title': row['job_title'],
+        'query': row['query'],
+        'ai_response': row['ai_response'],
+        'citations': row['citations'],
+        'date_and_time': row['date_and_time'].isoformat() if isinstance(row['date_and_time'], datetime) else str(row['date_and_time']),
+        'feedback_type': row['feedback_type'],
+        'feedback': row['feedback']
+    }
+
+
+def encode_cursor(date_and_time: datetime, row_id: int, feedback_id: int = 0) -> str:
+    payload = json.dumps({'t': date_and_time.isoformat(), 'id': row_id, 'fid': feedback_id})
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int, int]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        # Cursors issued before the feedback id was part of the key skip the whole log entry
+        return datetime.fromisoformat(payload['t']), int(payload['id']), int(payload.get('fid', 0))
+    except Exception:
+        raise ValueError("Invalid cursor")
 
 
 async def azai_report(
@@ -35,94 +127,170 @@ async def azai_report(
         Dictionary with paginated results (p1, p2, p3, etc.)
     """
     try:
-        # Convert string dates to datetime objects
-        from datetime import datetime as dt
-        start_date_obj = dt.strptime(start_date, '%Y-%m-%d').date()
-        end_date_obj = dt.strptime(end_date, '%Y-%m-%d').date()
+        where_sql, params = _build_report_filters(start_date, end_date, user_name, feedback_type)
         
-        # Base query
-        base_query = """
-        SELECT
-            t1.user_name,
-            t1.job_title,
-            t1.query,
-            t1.ai_response,
-            t1.citations,
-            t1.date_and_time,
-            t2.feedback_type,                     
-            t2.feedback    
-        FROM 
-            azaisearch_logging t1
-        LEFT JOIN 
-            azaisearch_feedback t2
-        ON 
-            t1.login_session_id = t2.login_session_id
-            AND t1.query = t2.query
-            AND t1.ai_response = t2.ai_response
-        WHERE 
-            t1.user_name NOT IN (
-                'HardCodedUser', '{"Jain, Anshuman"}', '{"Chanbasava Koti"}', 
-                '{"Sachin Bhusanurmath"}', 'Test User', 'Sai Charan Kumbham', 
-                'John Doe', 'Solomon Bhaskar', 'Harsh Aneppanavar', 'Sachin Ksr', 
-                'Gaston Chan', 'John Doe1', 'Chanbasava Koti', 'Jain, Anshuman',
-                'Sachin Bhusanurmath', 'Anonymous', 'Vinayak Inamadar', 'Raqib Rasheed'
-            )
-            AND t1.date_and_time >= $1 
-            AND t1.date_and_time <= $2
-        """
+        # Base query with ORDER BY clause
+        base_query = f"SELECT {REPORT_COLUMNS} {REPORT_FROM} {where_sql} ORDER BY t1.date_and_time DESC"
         
-        # Build dynamic WHERE clauses and parameters
-        params = [start_date_obj, end_date_obj]
-        param_counter = 3
+        # Borrow a pooled connection and execute query
+        async with acquire() as conn:
+            rows = await conn.fetch(base_query, *params)
         
-        if user_name:
-            base_query += f" AND t1.user_name = ${param_counter}"
-            params.append(user_name)
-            param_counter += 1
+        # Convert rows to list of dictionaries
+        results = [_row_to_dict(row) for row in rows]
+        
+        # Paginate results into groups of 15
+        paginated_results = {}
+        page_size = 15
+        
+        for i in range(0, len(results), page_size):
+            page_number = (i // page_size) + 1
+            page_key = f"p{page_number}"
+            paginated_results[page_key] = results[i:i + page_size]
+        
+        return paginated_results
+    
+    except Exception as e:
+        raise Exception(f"Database error: {str(e)}")
+
+
+async def azai_report_page(
+    start_date: str,
+    end_date: str,
+    user_name: Optional[str] = None,
+    feedback_type: Optional[str] = None,
+    page_size: int = DEFAULT_PAGE_SIZE,
+    cursor: Optional[str] = None,
+    include_count: bool = False
+) -> Dict[str, Any]:
+    """
+    Fetch one page of the AZAI report using keyset pagination on
+    (date_and_time, id, feedback id), newest first. The feedback id keeps the
+    key unique when a log entry has several feedback rows, so a page boundary
+    can fall between them. Only the rows of the requested page are read,
+    however large the date range is.
+    
+    Args:
+        start_date: Start date in 'YYYY-MM-DD' format
+        end_date: End date in 'YYYY-MM-DD' format
+        user_name: Optional user name filter
+        feedback_type: Optional feedback type filter
+        page_size: Rows per page (1..MAX_PAGE_SIZE)
+        cursor: next_cursor from the previous page, None for the first page
+        include_count: Also return the total number of matching rows
+    
+    Returns:
+        {"rows": [...], "next_cursor": str or None, "has_more": bool,
+         "page_size": int, "total_count": int (only if include_count)}
+    """
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f"page_size must be between 1 and {MAX_PAGE_SIZE}")
+    
+    try:
+        where_sql, params = _build_report_filters(start_date, end_date, user_name, feedback_type)
+        count_query = f"SELECT COUNT(*) {REPORT_FROM} {where_sql}"
+        count_params = list(params)
         
-        if feedback_type:
-            base_query += f" AND t2.feedback_type = ${param_counter}"
-            params.append(feedback_type)
-            param_counter += 1
+        if cursor:
+            cursor_time, cursor_id, cursor_feedback_id = decode_cursor(cursor)
+            where_sql += (
+                f" AND (t1.date_and_time, t1.id, COALESCE(t2.id, 0))"
+                f" < (${len(params) + 1}, ${len(params) + 2}, ${len(params) + 3})"
+            )
+            params += [cursor_time, cursor_id, cursor_feedback_id]
         
-        # Add ORDER BY clause
-        base_query += " ORDER BY t1.date_and_time DESC"
+        # One extra row tells us whether another page exists
+        page_query = (
+            f"SELECT t1.id, COALESCE(t2.id, 0) AS feedback_id, {REPORT_COLUMNS} {REPORT_FROM} {where_sql}"
+            f" ORDER BY t1.date_and_time DESC, t1.id DESC, feedback_id DESC LIMIT ${len(params) + 1}"
+        )
+        params.append(page_size + 1)
         
-        # Connect to database and execute query
-        conn = await get_db_connection()
+        async with acquire() as conn:
+            rows = await conn.fetch(page_query, *params)
+            total_count = None
+            if include_count:
+                total_count = await conn.fetchval(count_query, *count_params)
         
-        try:
-            # Execute query
-            rows = await conn.fetch(base_query, *params)
-            
-            # Convert rows to list of dictionaries
-            results = []
-            for row in rows:
-                result_dict = {
-                    'user_name': row['user_name'],
-                    'job_title': row['job_title'],
-                    'query': row['query'],
-                    'ai_response': row['ai_response'],
-                    'citations': row['citations'],
-                    'date_and_time': row['date_and_time'].isoformat() if isinstance(row['date_and_time'], datetime) else str(row['date_and_time']),
-                    'feedback_type': row['feedback_type'],
-                    'feedback': row['feedback']
-                }
-                results.append(result_dict)
-            
-            # Paginate results into groups of 15
-            paginated_results = {}
-            page_size = 15
-            
-            for i in range(0, len(results), page_size):
-                page_number = (i // page_size) + 1
-                page_key = f"p{page_number}"
-                paginated_results[page_key] = results[i:i + page_size]
-            
-            return paginated_results
+        has_more = len(rows) > page_size
+        page = rows[:page_size]
+        last = page[-1] if page else None
         
-        finally:
-            await conn.close()
+        result = {
+            'rows': [_row_to_dict(row) for row in page],
+            'next_cursor': encode_cursor(last['date_and_time'], last['id'], last['feedback_id']) if has_more and last else None,
+            'has_more': has_more,
+            'page_size': page_size
+        }
+        if include_count:
+            result['total_count'] = total_count
+        return result
     
+    except ValueError:
+        raise
     except Exception as e:
-        raise Exception(f"Database error: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Database error: {str(e)}")
+
+
+
+def export_azai_report(
+    start_date: str,
+    end_date: str,
+    user_name: Optional[str] = None,
+    feedback_type: Optional[str] = None,
+    export_format: str = 'csv'
+) -> AsyncIterator[str]:
+    """
+    Stream the full AZAI report as CSV or NDJSON.
+    
+    Filters are validated here, before anything is sent, so bad input can
+    still be answered with a 400. The returned async generator reads rows
+    through a server-side cursor and yields text chunks, so memory stays
+    constant regardless of the date range.
+    
+    Args:
+        start_date: Start date in 'YYYY-MM-DD' format
+        end_date: End date in 'YYYY-MM-DD' format
+        user_name: Optional user name filter
+        feedback_type: Optional feedback type filter
+        export_format: 'csv' or 'ndjson'
+    
+    Returns:
+        Async iterator of str chunks
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    where_sql, params = _build_report_filters(start_date, end_date, user_name, feedback_type)
+    query = f"SELECT {REPORT_COLUMNS} {REPORT_FROM} {where_sql} ORDER BY t1.date_and_time DESC"
+    return _stream_report_rows(query, params, export_format)
+
+
+async def _stream_report_rows(query: str, params: List[Any], export_format: str) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS) if export_format == 'csv' else None
+    if writer:
+        writer.writeheader()
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    
+    pending = 0
+    async with acquire() as conn:
+        # Server-side cursors only live inside a transaction
+        async with conn.transaction(readonly=True):
+            async for row in conn.cursor(query, *params, prefetch=EXPORT_PREFETCH_ROWS):
+                record = _row_to_dict(row)
+                if writer:
+                    writer.writerow(record)
+                else:
+                    buffer.write(json.dumps(record))
+                    buffer.write("\n")
+                pending += 1
+                if pending >= EXPORT_ROWS_PER_CHUNK:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+                    pending = 0
+    
+    if pending:
+        yield buffer.getvalue()
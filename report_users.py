@@ -0,0 +1,75 @@
+# report_users.py
+import os
+import time
+
+from db_pool import acquire
+
+# How long the distinct-user list is served from memory. New users seen by
+# this process invalidate it immediately; other workers' users show up after this.
+REPORT_USERS_CACHE_TTL_SECONDS = float(os.getenv('REPORT_USERS_CACHE_TTL_SECONDS', '300'))
+
+# Exclusion shared by every report query (rows with no user_name are excluded too)
+EXCLUDED_USER_FILTER = "NOT EXISTS (SELECT 1 FROM azaisearch_report_excluded_users e WHERE e.user_name = {column})"
+
+_cache = {'users': None, 'loaded_at': 0.0}
+_known_users = set()  # Names this process has already recorded
+_stats = {'hits': 0, 'misses': 0, 'invalidations': 0, 'users_added': 0}
+
+
+def excluded_user_filter(column):
+    return EXCLUDED_USER_FILTER.format(column=column)
+
+
+def invalidate_report_users():
+    _cache['users'] = None
+    _stats['invalidations'] += 1
+
+
+async def record_report_users(conn, user_names):
+    """
+    Add user names to azaisearch_report_users. Called with the connection of
+    each flushed /log batch; names already recorded by this process are skipped.
+    """
+    new_names = {name for name in user_names if name} - _known_users
+    if not new_names:
+        return
+    status = await conn.execute("""
+        INSERT INTO azaisearch_report_users (user_name)
+        SELECT unnest($1::text[])
+        ON CONFLICT (user_name) DO NOTHING
+    """, list(new_names))
+    _known_users.update(new_names)
+    inserted = int(status.split()[-1])
+    if inserted:
+        _stats['users_added'] += inserted
+        invalidate_report_users()
+
+
+async def get_report_users():
+    """Distinct, non-excluded user names, cached in memory."""
+    users = _cache['users']
+    if users is not None and time.monotonic() - _cache['loaded_at'] < REPORT_USERS_CACHE_TTL_SECONDS:
+        _stats['hits'] += 1
+        return users
+
+    _stats['misses'] += 1
+    query = f"""
+        SELECT u.user_name
+        FROM azaisearch_report_users u
+        WHERE {excluded_user_filter('u.user_name')}
+        ORDER BY u.user_name
+    """
+    async with acquire() as conn:
+        rows = await conn.fetch(query)
+    users = [row['user_name'] for row in rows]
+    _cache['users'] = users
+    _cache['loaded_at'] = time.monotonic()
+    return users
+
+
+def get_report_users_stats():
+    return {
+        **_stats,
+        'cached_users': len(_cache['users']) if _cache['users'] is not None else None,
+        'ttl_seconds': REPORT_USERS_CACHE_TTL_SECONDS,
+    }
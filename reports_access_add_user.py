@@ -1,19 +1,5 @@
-import os
-import asyncpg
 from quart import request, jsonify
-
-# Database configuration
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
-
-async def get_db_connection():
-    return await asyncpg.connect(**DB_CONFIG)
-
+from db_pool import acquire
 
 async def add_reports_access_user():
     try:
@@ -32,9 +18,8 @@ async def add_reports_access_user():
             RETURNING id, name, email, permission_granted_at, granted_by;
         """
 
-        conn = await get_db_connection()
-        row = await conn.fetchrow(query, user_name, email, granted_by)
-        await conn.close()
+        async with acquire() as conn:
+            row = await conn.fetchrow(query, user_name, email, granted_by)
 
         # Convert record to dict
         return jsonify({"message": "User added successfully", "record": dict(row)}), 201
@@ -1,19 +1,5 @@
-import os
-import asyncpg
 from quart import jsonify, request
-
-# Database configuration
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
-
-async def get_db_connection():
-    return await asyncpg.connect(**DB_CONFIG)
-
+from db_pool import acquire
 
 async def delete_reports_access():
     try:
@@ -24,8 +10,6 @@ async def delete_reports_access():
         if not record_id and not email:
             return jsonify({"error": "Provide either 'id' or 'email' to delete."}), 400
 
-        conn = await get_db_connection()
-
         # Build query dynamically
         if record_id:
             query = "DELETE FROM azaisearch_obe_reports_access WHERE id = $1 RETURNING *;"
@@ -34,8 +18,8 @@ async def delete_reports_access():
             query = "DELETE FROM azaisearch_obe_reports_access WHERE email = $1 RETURNING *;"
             params = (email,)
 
-        deleted_row = await conn.fetchrow(query, *params)
-        await conn.close()
+        async with acquire() as conn:
+            deleted_row = await conn.fetchrow(query, *params)
 
         if deleted_row:
             return jsonify({
@@ -1,25 +1,114 @@
 import os
 import json
+import time
 import datetime
 import jwt  # PyJWT
 import asyncio
+import logging
 from quart import redirect, request, jsonify
 from onelogin.saml2.auth import OneLogin_Saml2_Auth
+from onelogin.saml2.settings import OneLogin_Saml2_Settings
 from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
+from log_config import file_logger
 
 # Configuration
 admin_group_id = os.getenv('ADMIN_GROUP_ID')
 redirect_url = os.getenv('REDIRECT_URL')
 JWT_SECRET_KEY = os.getenv('JWT_SECRET_KEY')
+# Opt-in audit trail of SAML logins (JSON lines, rotated); unset disables it
+SAML_AUDIT_LOG_PATH = os.getenv('SAML_AUDIT_LOG_PATH')
+SAML_AUDIT_LOG_MAX_BYTES = int(os.getenv('SAML_AUDIT_LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+SAML_AUDIT_LOG_BACKUP_COUNT = int(os.getenv('SAML_AUDIT_LOG_BACKUP_COUNT', '5'))
+
+logger = logging.getLogger(__name__)
+
+audit_logger = (
+    file_logger('saml.audit', SAML_AUDIT_LOG_PATH, SAML_AUDIT_LOG_MAX_BYTES, SAML_AUDIT_LOG_BACKUP_COUNT)
+    if SAML_AUDIT_LOG_PATH else None
+)
+
+# ========================
+# SAML settings cache
+# ========================
+# settings.json, advanced_settings.json and certs/ are parsed once into a
+# OneLogin_Saml2_Settings and reused by every login; they are re-read when
+# one of the files changes.
+_saml_settings = {
+    'path': None,
+    'fingerprint': None,
+    'settings': None,
+    'loaded_at': None,
+}
+_saml_stats = {
+    'loads': 0,
+    'reuses': 0,
+}
+
+# Certificates the toolkit would otherwise read from certs/ on every use
+_CERT_FILES = (
+    ('sp', 'x509cert', 'sp.crt'),
+    ('sp', 'privateKey', 'sp.key'),
+    ('idp', 'x509cert', 'idp.crt'),
+)
+
+def _settings_fingerprint(saml_path):
+    """(file, mtime, size) of every file the settings are built from."""
+    cert_dir = os.path.join(saml_path, 'certs')
+    paths = [os.path.join(saml_path, 'settings.json'), os.path.join(saml_path, 'advanced_settings.json')]
+    if os.path.isdir(cert_dir):
+        paths.extend(os.path.join(cert_dir, name) for name in sorted(os.listdir(cert_dir)))
+    fingerprint = []
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        fingerprint.append((path, stat.st_mtime_ns, stat.st_size))
+    return tuple(fingerprint)
+
+def _load_saml_settings(saml_path):
+    # Same merge as the toolkit's own file loading, plus certificates inlined
+    with open(os.path.join(saml_path, 'settings.json')) as f:
+        settings = json.load(f)
+    advanced_path = os.path.join(saml_path, 'advanced_settings.json')
+    if os.path.exists(advanced_path):
+        with open(advanced_path) as f:
+            settings.update(json.load(f))
+    for section, key, file_name in _CERT_FILES:
+        cert_path = os.path.join(saml_path, 'certs', file_name)
+        if not settings.get(section, {}).get(key) and os.path.exists(cert_path):
+            with open(cert_path) as f:
+                settings.setdefault(section, {})[key] = f.read()
+    return OneLogin_Saml2_Settings(settings, custom_base_path=saml_path)
+
+def get_saml_settings(saml_path):
+    """The parsed SAML settings for `saml_path`, reloaded when a settings or certificate file changed."""
+    fingerprint = _settings_fingerprint(saml_path)
+    if _saml_settings['path'] == saml_path and _saml_settings['fingerprint'] == fingerprint:
+        _saml_stats['reuses'] += 1
+        return _saml_settings['settings']
+
+    settings = _load_saml_settings(saml_path)
+    _saml_settings.update(path=saml_path, fingerprint=fingerprint, settings=settings, loaded_at=time.time())
+    _saml_stats['loads'] += 1
+    logger.info('SAML settings loaded', extra={'saml_path': saml_path, 'files': len(fingerprint)})
+    return settings
+
+def get_saml_stats():
+    return {
+        **_saml_stats,
+        'loaded_at': _saml_settings['loaded_at'],
+        'audit_log': SAML_AUDIT_LOG_PATH,
+    }
 
 # Initialize SAML Auth
 def init_saml_auth(req, saml_path):
-    print('In init auth')
-    return OneLogin_Saml2_Auth(req, custom_base_path=saml_path)
+    logger.debug('In init auth')
+    return OneLogin_Saml2_Auth(req, old_settings=get_saml_settings(saml_path))
 
 # Prepare request for OneLogin SAML
 async def prepare_quart_request(request):
-    print('In Prepare Quart Request')
+    logger.debug('In Prepare Quart Request')
     return {
         'https': 'on',
         'http_host': request.host,
@@ -52,21 +141,21 @@ def get_data_from_token(token):
 # SAML login route
 async def saml_login(saml_path):
     try:
-        print('In SAML Login')
+        logger.debug('In SAML Login')
         req = await prepare_quart_request(request)
-        print(f'Request Prepared: {req}')
+        logger.debug('Request prepared for %s', req['script_name'])
         auth = init_saml_auth(req, saml_path)
-        print('SAML Auth Initialized')
+        logger.debug('SAML Auth Initialized')
         login_url = auth.login()
-        print(f'Redirecting to: {login_url}')
+        logger.info('Redirecting to identity provider')
         return redirect(login_url)
     except Exception as e:
-        print(f'Error during SAML login: {str(e)}')
+        logger.exception('Error during SAML login')
         return f'Internal Server Error: {str(e)}', 500
 
 # SAML callback route with email included
 async def saml_callback(saml_path):
-    print('In SAML Callback')
+    logger.debug('In SAML Callback')
     req = await prepare_quart_request(request)
     auth = init_saml_auth(req, saml_path)
 
@@ -95,13 +184,23 @@ async def saml_callback(saml_path):
             'email': json_data.get('http://schemas.xmlsoap.org/ws/2005/05/identity/claims/emailaddress')  # Added here
         }
 
-        await asyncio.to_thread(
-            lambda: (lambda f: f.write(json.dumps(json_data, indent=4)))(open("session_data_from_backend.txt", "w"))
-        )
+        if audit_logger is not None:
+            audit_logger.info('SAML login', extra={
+                'event': 'saml_login',
+                'name_id': name_id_from_saml,
+                'group': group_name,
+                'attributes': json_data,
+            })
 
         token = create_jwt_token(user_data)
         return redirect(f'{redirect_url}?token={token}')
     else:
+        if audit_logger is not None:
+            audit_logger.info('SAML login failed', extra={
+                'event': 'saml_login_failed',
+                'errors': errors,
+                'reason': auth.get_last_error_reason(),
+            })
         return f"Error in SAML Authentication: {errors}-{req}", 500
 
 # Token extractor
@@ -0,0 +1,47 @@
+# search_cache.py
+import os
+
+from ttl_cache import TTLCache
+
+SEARCH_CACHE_ENABLED = os.getenv('SEARCH_CACHE_ENABLED', 'true').lower() == 'true'
+SEARCH_CACHE_SIZE = int(os.getenv('SEARCH_CACHE_SIZE', '5000'))
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv('SEARCH_CACHE_TTL_SECONDS', '300'))
+SEARCH_CACHE_MAX_BYTES = int(os.getenv('SEARCH_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+
+# Rough per-record overhead of the dict and its keys, on top of the string payloads
+_RECORD_OVERHEAD_BYTES = 400
+
+
+def record_size(record):
+    """Approximate bytes held by one normalized search record."""
+    return (
+        _RECORD_OVERHEAD_BYTES
+        + len(record.get('title') or '') + len(record.get('chunk') or '') + len(record.get('parent_id') or '')
+    )
+
+
+def _records_size(records):
+    return sum(map(record_size, records))
+
+
+_cache = TTLCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL_SECONDS, max_bytes=SEARCH_CACHE_MAX_BYTES, sizeof=_records_size)
+
+
+def search_cache_key(index_name, semantic_configuration_name, query_text, top, select):
+    return (index_name, semantic_configuration_name, query_text, top, tuple(select))
+
+
+def get_cached_search(key):
+    """Normalized records (title, chunk, decoded parent_id) for `key`, or None."""
+    if not SEARCH_CACHE_ENABLED:
+        return None
+    return _cache.get(key)
+
+
+def cache_search(key, records):
+    if SEARCH_CACHE_ENABLED:
+        _cache.set(key, records)
+
+
+def get_search_cache_stats():
+    return {'enabled': SEARCH_CACHE_ENABLED, **_cache.stats()}
@@ -1,12 +1,12 @@
-
 import base64
-import json
+import hashlib
 import re
-import os
+import logging
+import time
+import asyncio
 import textwrap
 from dotenv import load_dotenv
 from quart import request, jsonify
-import asyncpg
 
 from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.models import VectorizableTextQuery
@@ -14,30 +14,27 @@ from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCreden
 from openai import AsyncAzureOpenAI
 
 from load_settings_and_clients_from_db import load_settings_and_get_clients
+from follow_ups import schedule_follow_ups, get_cached_follow_ups, wait_for_follow_ups
+from answer_cache import ANSWER_CACHE_ENABLED, lookup_answer, store_answer, miss_state
+from search_cache import search_cache_key, get_cached_search, cache_search
+from conversation_store import format_history, recent_queries
+from context_packer import pack_context, SOURCE_SEPARATOR
+from single_flight import SingleFlight
+from upstream_limiter import openai_limiter, search_limiter
+from deadlines import REQUEST_TIMEOUT_SECONDS, DeadlineExceeded, set_deadline, within_deadline
+from hedging import SEARCH_HEDGING_ENABLED, LatencyTracker, hedged
+from hot_chunks import hot_chunk_index, hot_chunks_enabled
+from embeddings import embed_text
+from answer_postprocess import build_chunks, dedupe_chunks, postprocess_answer
+from near_dedup import filter_near_duplicates
+from log_config import LOG_CHUNK_SAMPLE_RATE, sampled
+from metrics import ASK_REQUESTS, ASK_STAGE_ERRORS, observe_ask_stage, observe_retrieval
 
 
 # Load environment variables
 load_dotenv()
 
-# Async DB config
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
-
-# ========================
-# DB Connection
-# ========================
-async def connect_db():
-    try:
-        return await asyncpg.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"❌ Database connection error: {e}")
-        return None
-    
+logger = logging.getLogger(__name__)
 
 
 def safe_base64_decode(data):
@@ -60,70 +57,167 @@ def safe_base64_decode(data):
     except Exception as e:
         return f"[Invalid Base64] {data} - {str(e)}"
 
-async def ask_query(user_query, user_id, conversation_store):
-    # ✅ Load fresh settings and clients for each request
+SEARCH_SELECT_FIELDS = ["title", "chunk", "parent_id"]
+
+# Identical searches / deterministic completions that are already running are
+# joined instead of repeated (e.g. many users asking the same question at once)
+_search_flight = SingleFlight("search")
+_completion_flight = SingleFlight("answer_completion")
+# Recent search latencies; a search slower than their p95 is hedged (SEARCH_HEDGING_ENABLED)
+_search_latency = LatencyTracker()
+
+async def _search_records(config, query_text, top):
+    """
+    Hybrid semantic search returning normalized records (title, cleaned chunk,
+    decoded parent_id). Results are cached per index, semantic configuration,
+    query text, top and select fields. With the hot-chunk index enabled, a
+    query close enough to an earlier one is answered from its results.
+    """
+    key = search_cache_key(
+        config['azure_search_index_name'], config['semantic_configuration_name'],
+        query_text, top, SEARCH_SELECT_FIELDS
+    )
+    records = get_cached_search(key)
+    if records is not None:
+        return records
+
+    if not hot_chunks_enabled():
+        return await _search_flight.do(key, lambda: _run_search(config, key, query_text, top))
+
     try:
-        config = await load_settings_and_get_clients()
+        embedding = await embed_text(config['openai_client'], query_text)
     except Exception as e:
-        print(f"❌ Failed to load settings: {e}")
+        # The index is only a shortcut; search anyway
+        logger.warning("Hot-chunk lookup skipped, query embedding failed: %s", e)
+        return await _search_flight.do(key, lambda: _run_search(config, key, query_text, top))
+    records = hot_chunk_index.lookup(config, embedding, top)
+    if records is not None:
+        return records
+    records = await _search_flight.do(key, lambda: _run_search(config, key, query_text, top))
+    hot_chunk_index.add(config, embedding, top, records)
+    return records
+
+async def _run_search(config, key, query_text, top):
+    async def search():
+        vector_query = VectorizableTextQuery(text=query_text, k_nearest_neighbors=5, fields="text_vector")
+        search_results = await config['search_client'].search(
+            search_text=query_text,
+            vector_queries=[vector_query],
+            select=SEARCH_SELECT_FIELDS,
+            top=top,
+            semantic_configuration_name=config['semantic_configuration_name'],
+            query_type="semantic"
+        )
+        records = []
+        # Results are fetched while iterating, so a retry must redo both
+        async for doc in search_results:
+            records.append({
+                # Fields can be present but null
+                "title": doc.get("title") or "N/A",
+                "chunk": (doc.get("chunk") or "N/A").replace("\n", " ").replace("\t", " ").strip(),
+                "parent_id": safe_base64_decode(doc.get("parent_id") or "Unknown Document"),
+                # Semantic ranker score when available, else the hybrid search score
+                "score": doc.get("@search.reranker_score") or doc.get("@search.score")
+            })
+        return records
+
+    limiter = search_limiter(config)
+    records = await hedged("search", lambda: limiter.call(search), _search_latency, SEARCH_HEDGING_ENABLED)
+    cache_search(key, records)
+    return records
+
+def _record_stage(timings, stage, start):
+    """Record the time since `start` under `stage` (e.g. "total_ms") and in the stage histogram."""
+    seconds = time.perf_counter() - start
+    timings[stage] = round(seconds * 1000, 1)
+    observe_ask_stage(stage[:-3] if stage.endswith("_ms") else stage, seconds)
+
+async def _timed(timings, stage, awaitable):
+    """Await `awaitable` and record its wall time in milliseconds under `stage`."""
+    start = time.perf_counter()
+    try:
+        return await awaitable
+    except Exception:
+        ASK_STAGE_ERRORS.labels(stage[:-3] if stage.endswith("_ms") else stage).inc()
+        raise
+    finally:
+        _record_stage(timings, stage, start)
+
+async def _gather_cancel_on_error(*aws):
+    """Like asyncio.gather, but cancel the siblings as soon as one of them fails."""
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+
+async def _load_config(timings, request_start):
+    """
+    Load settings and clients (cached per update_id) under the default
+    deadline, then switch to the configured request_timeout_seconds.
+    """
+    set_deadline(REQUEST_TIMEOUT_SECONDS)
+    try:
+        config = await _timed(timings, "settings_ms", load_settings_and_get_clients())
+    except DeadlineExceeded:
+        raise
+    except Exception as e:
+        logger.error("Failed to load settings: %s", e)
         raise RuntimeError("Failed to initialize AI services")
+    # The budget covers the whole request, including the settings load
+    set_deadline(config['request_timeout_seconds'] - (time.perf_counter() - request_start))
+    return config
 
+async def _get_turns(conversation_store, user_id):
+    # Read once per request: decides whether the answer cache applies and feeds the prompt
+    return await within_deadline(conversation_store.get_turns(user_id), "history")
+
+async def _lookup_cached_answer(config, user_query, user_id, turns, conversation_store, timings):
+    """
+    Answer-cache lookup for first-turn questions. Returns (cached_result, cache_state);
+    cache_state is None when the cache does not apply to this request.
+    """
+    if not ANSWER_CACHE_ENABLED or turns:
+        return None, None
+
+    try:
+        cached, match, cache_state = await _timed(timings, "answer_cache_ms", within_deadline(lookup_answer(config, user_query), "answer_cache"))
+    except DeadlineExceeded as e:
+        # The cache is only a shortcut; out of its share of the budget, answer normally
+        logger.warning("Answer-cache lookup skipped: %s", e)
+        return None, miss_state(user_query)
+    if cached is None:
+        return None, cache_state
+
+    await conversation_store.append_turn(user_id, user_query, cached["ai_response"])
+    cached["query"] = user_query
+    cached["follow_ups"] = get_cached_follow_ups(cached["follow_ups_id"])
+    cached["answer_cache"] = match
+    return cached, cache_state
+
+async def _prepare_answer(config, user_query, turns, timings):
+    """
+    Everything /ask does before the answer completion: run both searches,
+    dedup the chunks and build the answer prompt.
+    Shared by ask_query and ask_query_stream.
+    """
     # Extract settings and clients from config
     current_prompt = config['current_prompt']
-    openai_client = config['openai_client']
-    search_client = config['search_client']
-    deployment_name = config['deployment_name']
-    openai_model_temperature = config['openai_model_temperature']
-    semantic_configuration_name = config['semantic_configuration_name']
     number_of_chunks = config['number_of_chunks']
 
 
     
-    user_data = conversation_store.get(user_id)
-    if user_data:
-        conversation_history = user_data.get("chat", "")
-        history_list = user_data.get("history", [])
-    else:
-        conversation_history = ""
-        history_list = []
-
-    history_list.append(user_query)
-    if len(history_list) > 3:
-        history_list = history_list[-3:]
+    # Only the most recent turns that fit the history token budget go into the prompt
+    conversation_history = format_history(turns)
+    history_list = recent_queries(turns, user_query)
 
     history_queries = " ".join(history_list)
 
     async def fetch_chunks(query_text, k_value, start_index):
-        vector_query = VectorizableTextQuery(text=query_text, k_nearest_neighbors=5, fields="text_vector")
-        search_results = await search_client.search(
-            search_text=query_text,
-            vector_queries=[vector_query],
-            select=["title", "chunk", "parent_id"],
-            top=k_value,
-            semantic_configuration_name=semantic_configuration_name,
-            query_type="semantic"
-        )
-        chunks = []
-        sources = []
-        i = 0
-        async for doc in search_results:
-            title = doc.get("title", "N/A")
-            chunk_content = doc.get("chunk", "N/A").replace("\n", " ").replace("\t", " ").strip()
-            parent_id_encoded = doc.get("parent_id", "Unknown Document")
-            parent_id_decoded = safe_base64_decode(parent_id_encoded)
-            chunk_id = start_index + i
-            chunk_obj = {
-                "id": chunk_id,
-                "title": title,
-                "chunk": chunk_content,
-                "parent_id": parent_id_decoded
-            }
-            chunks.append(chunk_obj)
-            sources.append(
-                f"Source ID: [{chunk_id}]\nContent: {chunk_content}\nDocument: {parent_id_decoded}"
-            )
-            i += 1
-        return chunks, sources
+        records = await within_deadline(_search_records(config, query_text, k_value), "search")
+        return build_chunks(records, start_index)
 
 
 
@@ -131,35 +225,40 @@ async def ask_query(user_query, user_id, conversation_store):
     history_chunk_count = number_of_chunks 
     standalone_chunk_count = number_of_chunks
     
-    # # Fetch chunks from both history and standalone query
-    history_chunks, history_sources = await fetch_chunks(history_queries, history_chunk_count, 1)
-    standalone_chunks, standalone_sources = await fetch_chunks(user_query, standalone_chunk_count, number_of_chunks + 1)
+    # # Fetch chunks from both history and standalone query (concurrently)
+    retrieval_start = time.perf_counter()
+    history_chunks, standalone_chunks = await _gather_cancel_on_error(
+        _timed(timings, "history_search_ms", fetch_chunks(history_queries, history_chunk_count, 1)),
+        _timed(timings, "standalone_search_ms", fetch_chunks(user_query, standalone_chunk_count, number_of_chunks + 1))
+    )
+    _record_stage(timings, "retrieval_ms", retrieval_start)
 
     # ✅ DEDUPLICATION STEP ADDED HERE
-    combined_chunks = history_chunks + standalone_chunks
-    seen_chunks = set()
-    all_chunks = []
-    for chunk in combined_chunks:
-        identifier = chunk["chunk"]
-        if identifier not in seen_chunks:
-            seen_chunks.add(identifier)
-            all_chunks.append(chunk)
-
-    # Build sources from deduplicated chunks
-    all_sources = []
-    for chunk in all_chunks:
-        all_sources.append(
-            f"Source ID: [{chunk['id']}]\nContent: {chunk['chunk']}\nDocument: {chunk['parent_id']}"
+    retrieved_count = len(history_chunks) + len(standalone_chunks)
+    all_chunks = dedupe_chunks(history_chunks + standalone_chunks)
+    # Then near-identical passages (overlapping windows, re-indexed documents) and the per-document cap
+    if config['near_dedup_enabled']:
+        all_chunks, near_dedup_report = filter_near_duplicates(
+            all_chunks, config['near_dup_threshold'], config['max_chunks_per_document']
         )
-    sources_formatted = "\n\n---\n\n".join(all_sources)
+    else:
+        near_dedup_report = None
+    unique_count = len(all_chunks)
+
+    # Keep the best-scoring chunks that fit the context token budget
+    # (each source string is rendered once, there)
+    all_chunks, all_sources, context_report = pack_context(
+        all_chunks, config['context_token_budget'], config['max_chunk_tokens']
+    )
+    sources_formatted = SOURCE_SEPARATOR.join(all_sources)
+    context_report["near_dedup"] = near_dedup_report
 
-    # ✅ Print all fetched chunks (citations) before sending to AI
-    print("\n--- ALL CHUNKS RETURNED BY AZURE SEARCH ---")
-    for chunk in all_chunks:
-        print(f"[{chunk['id']}] Title: {chunk['title']}")
-        print(f"Parent ID: {chunk['parent_id']}")
-        print(f"Content: {chunk['chunk'][:300]}...")  # Truncate preview
-        print("--------------------------------------------------")
+    # Chunks sent to the model, for a sample of requests (LOG_CHUNK_SAMPLE_RATE)
+    if sampled(LOG_CHUNK_SAMPLE_RATE) and logger.isEnabledFor(logging.INFO):
+        logger.info("Chunks sent to the model", extra={"chunks": [
+            {"id": chunk["id"], "title": chunk["title"], "parent_id": chunk["parent_id"], "preview": chunk["chunk"][:300]}
+            for chunk in all_chunks
+        ]})
 
     prompt_template = f"""{current_prompt}"""
 
@@ -168,79 +267,185 @@ async def ask_query(user_query, user_id, conversation_store):
         sources=sources_formatted,
         query=user_query
     )
+    observe_retrieval(retrieved_count, unique_count, context_report, len(prompt), near_dedup_report)
 
-    response = await openai_client.chat.completions.create(
-        messages=[{"role": "user", "content": prompt}],
-        model=deployment_name,
-        temperature=openai_model_temperature
-    )
-
-    full_reply = response.choices[0].message.content.strip()
+    return {
+        "all_chunks": all_chunks,
+        "prompt": prompt,
+        "context": context_report,
+    }
 
-    flat_ids = []
-    for match in re.findall(r"\[(.*?)\]", full_reply):
-        parts = match.split(",")
-        for p in parts:
-            if p.strip().isdigit():
-                flat_ids.append(int(p.strip()))
-
-    unique_original_ids = []
-    for i in flat_ids:
-        if i not in unique_original_ids:
-            unique_original_ids.append(i)
-
-    id_mapping = {old_id: new_id + 1 for new_id, old_id in enumerate(unique_original_ids)}
-
-    def replace_citation_ids(text, mapping):
-        def repl(match):
-            nums = match.group(1).split(",")
-            new_nums = sorted(set(mapping.get(int(n.strip()), int(n.strip())) for n in nums if n.strip().isdigit()))
-            return f"[{', '.join(map(str, new_nums))}]"
-        return re.sub(r"\[(.*?)\]", repl, text)
-
-    ai_response = replace_citation_ids(full_reply, id_mapping)
-
-    citations = []
-    seen = set()
-    for old_id in unique_original_ids:
-        new_id = id_mapping[old_id]
-        for chunk in all_chunks:
-            if chunk["id"] == old_id and old_id not in seen:
-                seen.add(old_id)
-                updated_chunk = chunk.copy()
-                updated_chunk["id"] = new_id
-                citations.append(updated_chunk)
-
-    conversation_store[user_id] = {
-        "chat": conversation_history + f"\nUser: {user_query}\nAI: {ai_response}",
-        "history": history_list
+async def _answer_completion(config, prompt):
+    """
+    Non-streaming answer completion. At temperature 0 the reply depends only on
+    the deployment and prompt, so concurrent identical prompts share one call.
+    """
+    def create():
+        return openai_limiter(config).call(lambda: config['openai_client'].chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=config['deployment_name'],
+            temperature=config['openai_model_temperature']
+        ))
+
+    if config['openai_model_temperature'] != 0:
+        return await create()
+    key = (config['openai_endpoint'], config['deployment_name'], hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+    return await _completion_flight.do(key, create)
+
+def get_single_flight_stats():
+    return {
+        "search": _search_flight.stats(),
+        "answer_completion": _completion_flight.stats(),
     }
 
-    follow_up_prompt = f"""
-Based only on the following chunks of source material, generate 3 follow-up questions the user might ask.
-Only use the content in the sources. Do not invent new facts.
+def get_search_latency_stats():
+    return {**_search_latency.stats(), "hedging_enabled": SEARCH_HEDGING_ENABLED}
 
-Format:
-Q1: <question>
-Q2: <question>
-Q3: <question>
+def _answer_cache_outcome(cached, cache_state):
+    if cached is not None:
+        return "hit"
+    return "bypass" if cache_state is None else "miss"
 
-SOURCES:
-{json.dumps(all_chunks, indent=2)}
-    """
+def _finalize_answer(ctx, full_reply):
+    """Remap citation ids in the model reply and build the citation list."""
+    return postprocess_answer(full_reply, ctx["all_chunks"])
 
-    follow_up_response = await openai_client.chat.completions.create(
-        messages=[{"role": "user", "content": follow_up_prompt}],
-        model=deployment_name
-    )
+async def ask_query(user_query, user_id, conversation_store):
+    timings = {}
+    request_start = time.perf_counter()
 
-    follow_ups_raw = follow_up_response.choices[0].message.content.strip()
+    config = await _load_config(timings, request_start)
 
-    return {
+    turns = await _get_turns(conversation_store, user_id)
+    cached, cache_state = await _lookup_cached_answer(config, user_query, user_id, turns, conversation_store, timings)
+    ASK_REQUESTS.labels("json", _answer_cache_outcome(cached, cache_state)).inc()
+    if cached is not None:
+        _record_stage(timings, "total_ms", request_start)
+        cached["timings"] = timings
+        return cached
+
+    ctx = await _prepare_answer(config, user_query, turns, timings)
+
+    # Follow-ups only depend on the chunks: generate them in the background
+    # (fetched later through /follow_ups) instead of blocking the answer
+    follow_ups_id = schedule_follow_ups(config, ctx["all_chunks"])
+
+    response = await _timed(timings, "answer_completion_ms", within_deadline(_answer_completion(config, ctx["prompt"]), "answer_completion"))
+
+    full_reply = response.choices[0].message.content.strip()
+    ai_response, citations = _finalize_answer(ctx, full_reply)
+    await conversation_store.append_turn(user_id, user_query, ai_response)
+
+    result = {
         "query": user_query,
         "ai_response": ai_response,
         "citations": citations,
-        "follow_ups": follow_ups_raw,
-        "fetched_chunks": all_chunks  # ✅ Deduplicated chunks
+        "follow_ups": get_cached_follow_ups(follow_ups_id),  # None until generated
+        "follow_ups_id": follow_ups_id,
+        "fetched_chunks": ctx["all_chunks"],  # ✅ Deduplicated, packed chunks
+        "context": ctx["context"]
     }
+    if cache_state is not None:
+        store_answer(config, cache_state, result)
+
+    _record_stage(timings, "total_ms", request_start)
+    result["timings"] = timings
+    return result
+
+async def ask_query_stream(user_query, user_id, conversation_store):
+    """
+    Streaming variant of ask_query. Yields (event, data) pairs:
+
+        retrieval  -> {"query", "fetched_chunks"} as soon as the searches finish
+        token      -> {"text"} for every piece of the answer as the model produces it
+                      (citation ids here are the raw source ids)
+        answer     -> {"ai_response", "citations"} with remapped citation ids
+        follow_ups -> {"follow_ups_id", "follow_ups"} pushed once the background job finishes
+        done       -> {"timings"}
+
+    The conversation store is updated once the answer stream has completed.
+    A cached answer is sent as retrieval, answer, follow_ups and done without tokens.
+    """
+    timings = {}
+    request_start = time.perf_counter()
+
+    config = await _load_config(timings, request_start)
+
+    turns = await _get_turns(conversation_store, user_id)
+    cached, cache_state = await _lookup_cached_answer(config, user_query, user_id, turns, conversation_store, timings)
+    ASK_REQUESTS.labels("stream", _answer_cache_outcome(cached, cache_state)).inc()
+    if cached is not None:
+        yield "retrieval", {"query": user_query, "fetched_chunks": cached["fetched_chunks"]}
+        yield "answer", {"ai_response": cached["ai_response"], "citations": cached["citations"], "answer_cache": cached["answer_cache"]}
+        yield "follow_ups", {"follow_ups_id": cached["follow_ups_id"], "follow_ups": cached["follow_ups"]}
+        _record_stage(timings, "total_ms", request_start)
+        yield "done", {"timings": timings}
+        return
+
+    ctx = await _prepare_answer(config, user_query, turns, timings)
+
+    yield "retrieval", {"query": user_query, "fetched_chunks": ctx["all_chunks"], "context": ctx["context"]}
+
+    follow_ups_id = schedule_follow_ups(config, ctx["all_chunks"])
+
+    answer_start = time.perf_counter()
+    parts = []
+    limiter = openai_limiter(config)
+    try:
+        # The slot is held until the whole answer has streamed
+        async with limiter.slot():
+            stream = await within_deadline(limiter.retrying(lambda: config['openai_client'].chat.completions.create(
+                messages=[{"role": "user", "content": ctx["prompt"]}],
+                model=config['deployment_name'],
+                temperature=config['openai_model_temperature'],
+                stream=True
+            )), "answer_completion")
+            events = stream.__aiter__()
+            while True:
+                # Every wait for the next piece is bounded by what is left of the budget
+                try:
+                    event = await within_deadline(events.__anext__(), "answer_completion")
+                except StopAsyncIteration:
+                    break
+                except DeadlineExceeded:
+                    # Drop the half-read response instead of leaving the connection busy
+                    await stream.close()
+                    raise
+                # Azure sends a leading chunk without choices (prompt filter results)
+                if not event.choices:
+                    continue
+                text = event.choices[0].delta.content
+                if text:
+                    if not parts:
+                        _record_stage(timings, "answer_first_token_ms", answer_start)
+                    parts.append(text)
+                    yield "token", {"text": text}
+    except Exception:
+        ASK_STAGE_ERRORS.labels("answer_completion").inc()
+        raise
+    _record_stage(timings, "answer_completion_ms", answer_start)
+
+    full_reply = "".join(parts).strip()
+    ai_response, citations = _finalize_answer(ctx, full_reply)
+    await conversation_store.append_turn(user_id, user_query, ai_response)
+    yield "answer", {"ai_response": ai_response, "citations": citations}
+    if cache_state is not None:
+        store_answer(config, cache_state, {
+            "query": user_query,
+            "ai_response": ai_response,
+            "citations": citations,
+            "follow_ups": None,
+            "follow_ups_id": follow_ups_id,
+            "fetched_chunks": ctx["all_chunks"]
+        })
+
+    # The answer is complete; push follow-ups on the same stream once they are ready
+    try:
+        follow_ups = await wait_for_follow_ups(follow_ups_id)
+    except Exception as e:
+        logger.warning("Follow-ups unavailable: %s", e, extra={"follow_ups_id": follow_ups_id})
+        follow_ups = None
+    yield "follow_ups", {"follow_ups_id": follow_ups_id, "follow_ups": follow_ups}
 
+    _record_stage(timings, "total_ms", request_start)
+    yield "done", {"timings": timings}
@@ -0,0 +1,54 @@
+# single_flight.py
+import asyncio
+
+from metrics import SINGLE_FLIGHT_CALLS
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical calls: while a call for `key` is running,
+    later callers with the same key wait for its result (or exception)
+    instead of starting their own.
+
+    The shared call runs as its own task, so a caller that is cancelled
+    (client disconnected) does not cancel it for the others. Results are
+    shared objects; callers must not mutate them. Only touched from the
+    event loop.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._calls = {}  # key -> running task
+        self._stats = {
+            'leaders': 0,
+            'coalesced': 0,
+        }
+
+    async def do(self, key, factory):
+        """Result of `await factory()`, run at most once at a time per key."""
+        task = self._calls.get(key)
+        if task is not None:
+            self._stats['coalesced'] += 1
+            SINGLE_FLIGHT_CALLS.labels(self.name, 'coalesced').inc()
+        else:
+            self._stats['leaders'] += 1
+            SINGLE_FLIGHT_CALLS.labels(self.name, 'leader').inc()
+            task = asyncio.ensure_future(factory())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+        return await asyncio.shield(task)
+
+    def _forget(self, key, task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark the exception as retrieved even if every waiter went away
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self):
+        calls = self._stats['leaders'] + self._stats['coalesced']
+        return {
+            **self._stats,
+            'in_flight': len(self._calls),
+            'coalesced_rate': (self._stats['coalesced'] / calls) if calls else None,
+        }
@@ -0,0 +1,88 @@
+import pytest
+
+from answer_postprocess import build_chunks, build_citations, dedupe_chunks, postprocess_answer, remap_citations
+from benchmarks.bench_postprocess import legacy_postprocess
+
+
+def make_chunk(chunk_id, text=None):
+    return {
+        "id": chunk_id,
+        "title": f"Doc {chunk_id}",
+        "chunk": text if text is not None else f"Policy text {chunk_id}",
+        "parent_id": f"https://example/doc{chunk_id}.pdf",
+        "score": 1.0,
+    }
+
+
+def test_remap_citations_numbers_ids_in_first_appearance_order():
+    text, mapping = remap_citations("Leave is 25 days [7]. Ask HR [3]. Carry-over is capped [7].")
+
+    assert text == "Leave is 25 days [1]. Ask HR [2]. Carry-over is capped [1]."
+    assert list(mapping.items()) == [(7, 1), (3, 2)]
+
+
+def test_remap_citations_sorts_and_dedupes_groups():
+    text, mapping = remap_citations("See [4, 2] and [2,4, 4].")
+
+    assert text == "See [1, 2] and [1, 2]."
+    assert mapping == {4: 1, 2: 2}
+
+
+def test_remap_citations_drops_non_numeric_parts():
+    text, mapping = remap_citations("Unsourced [x], partly sourced [5, note] and [ 5 ].")
+
+    assert text == "Unsourced [], partly sourced [1] and [1]."
+    assert mapping == {5: 1}
+
+
+def test_remap_citations_without_citations():
+    assert remap_citations("No sources needed.") == ("No sources needed.", {})
+
+
+def test_build_citations_renumbers_in_citation_order():
+    chunks = [make_chunk(1), make_chunk(2), make_chunk(3)]
+
+    citations = build_citations(chunks, {3: 1, 1: 2})
+
+    assert [(c["id"], c["chunk"]) for c in citations] == [(1, "Policy text 3"), (2, "Policy text 1")]
+    # The chunks handed in keep their retrieval ids
+    assert [c["id"] for c in chunks] == [1, 2, 3]
+
+
+def test_build_citations_skips_unknown_ids():
+    text, mapping = remap_citations("Real [2], invented [99].")
+
+    citations = build_citations([make_chunk(2)], mapping)
+
+    assert text == "Real [1], invented [2]."
+    assert [(c["id"], c["chunk"]) for c in citations] == [(1, "Policy text 2")]
+
+
+def test_build_citations_uses_first_chunk_for_a_repeated_id():
+    citations = build_citations([make_chunk(4, "first"), make_chunk(4, "second")], {4: 1})
+
+    assert [c["chunk"] for c in citations] == ["first"]
+
+
+def test_dedupe_chunks_keeps_first_occurrence_in_order():
+    chunks = [make_chunk(1, "a"), make_chunk(2, "b"), make_chunk(3, "a"), make_chunk(4, "c"), make_chunk(5, "b")]
+
+    assert [c["id"] for c in dedupe_chunks(chunks)] == [1, 2, 4]
+
+
+def test_build_chunks_numbers_from_start_index():
+    records = [{"title": "T", "chunk": f"text {i}", "parent_id": "p", "score": 0.5} for i in range(3)]
+
+    assert [c["id"] for c in build_chunks(records, 11)] == [11, 12, 13]
+
+
+@pytest.mark.parametrize("reply", [
+    "Plain answer.",
+    "One [2] then [1, 2] then [3,1] and [2].",
+    "Unknown [42], empty [], text [see below], mixed [1, x, 1].",
+    "Nested [[1]] and unclosed [2",
+])
+def test_postprocess_answer_matches_previous_implementation(reply):
+    chunks = dedupe_chunks([make_chunk(1), make_chunk(2), make_chunk(3), make_chunk(4, "Policy text 1")])
+
+    assert postprocess_answer(reply, chunks) == legacy_postprocess(reply, chunks)
@@ -0,0 +1,136 @@
+import asyncio
+import types
+from contextlib import asynccontextmanager
+
+import pytest
+
+import conversation_store
+import search_query
+from conversation_store import ConversationStore, InMemoryConversationStore, PostgresConversationStore
+
+
+class FakeSearchResults:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __aiter__(self):
+        async def iterate():
+            for doc in self._docs:
+                yield doc
+        return iterate()
+
+
+class FakeSearchClient:
+    async def search(self, search_text, top, **kwargs):
+        return FakeSearchResults([
+            {"title": f"Doc {i}", "chunk": f"Policy text {i} for {search_text}",
+             "parent_id": f"https://example/doc{i}.pdf", "@search.score": 1.0 / (i + 1)}
+            for i in range(top)
+        ])
+
+
+class FakeCompletions:
+    def __init__(self):
+        self.prompts = []
+
+    async def create(self, messages, model, temperature=None, **kwargs):
+        self.prompts.append(messages[-1]["content"])
+        message = types.SimpleNamespace(content="See the policy [2].")
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+class FakeConnection:
+    """The queries PostgresConversationStore sends, against a list of rows."""
+
+    def __init__(self):
+        self.rows = []
+        self.reads = 0
+
+    async def fetch(self, query, user_id, since, limit):
+        self.reads += 1
+        rows = [row for row in self.rows if row["user_id"] == user_id and row["created_at"] > since]
+        return sorted(rows, key=lambda row: row["created_at"], reverse=True)[:limit]
+
+    async def executemany(self, query, args):
+        for turn_id, user_id, query_text, ai_response, created_at in args:
+            self.rows.append({"turn_id": turn_id, "user_id": user_id, "query": query_text,
+                              "ai_response": ai_response, "created_at": created_at})
+
+    async def execute(self, query, *args):
+        pass
+
+
+@pytest.fixture
+def config(monkeypatch):
+    completions = FakeCompletions()
+    config = {
+        'update_id': 1,
+        'azure_search_endpoint': 'https://search.example',
+        'azure_search_index_name': 'index',
+        'semantic_configuration_name': 'semantic',
+        'openai_endpoint': 'https://openai.example',
+        'deployment_name': 'gpt',
+        'openai_model_temperature': 0.0,
+        'current_prompt': "History:{conversation_history}\nSources:{sources}\nQuestion:{query}",
+        'number_of_chunks': 3,
+        'context_token_budget': 6000,
+        'max_chunk_tokens': 1000,
+        'request_timeout_seconds': 60.0,
+        'near_dedup_enabled': True,
+        'near_dup_threshold': 0.8,
+        'max_chunks_per_document': None,
+        'search_client': FakeSearchClient(),
+        'openai_client': types.SimpleNamespace(chat=types.SimpleNamespace(completions=completions)),
+    }
+
+    async def load_settings_and_get_clients():
+        return config
+
+    monkeypatch.setattr(search_query, "load_settings_and_get_clients", load_settings_and_get_clients)
+    # Follow-ups are a background job; not under test here
+    monkeypatch.setattr(search_query, "schedule_follow_ups", lambda config, chunks: "follow-ups-id")
+    return config
+
+
+@pytest.fixture
+def connection(monkeypatch):
+    connection = FakeConnection()
+
+    @asynccontextmanager
+    async def acquire():
+        yield connection
+
+    monkeypatch.setattr(conversation_store, "acquire", acquire)
+    return connection
+
+
+@pytest.mark.parametrize("backend", ["memory", "postgres"])
+def test_ask_query_keeps_history(backend, config, connection):
+    store = InMemoryConversationStore() if backend == "memory" else PostgresConversationStore()
+
+    async def run():
+        first = await search_query.ask_query(f"How much annual leave ({backend})?", "user-1", store)
+        if backend == "postgres":
+            await store.flush()
+        second = await search_query.ask_query("And sick leave?", "user-1", store)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first["ai_response"] == "See the policy [1]."
+    assert second["ai_response"] == "See the policy [1]."
+    assert "answer_cache" not in second
+    assert f"User: How much annual leave ({backend})?" in config['openai_client'].chat.completions.prompts[-1]
+    assert asyncio.run(store.has_history("user-1"))
+    if backend == "postgres":
+        # One read per /ask (plus the has_history call above)
+        assert connection.reads == 3
+
+
+def test_incomplete_backend_fails_at_construction():
+    class ReadOnlyStore(ConversationStore):
+        async def get_turns(self, user_id):
+            return []
+
+    with pytest.raises(TypeError):
+        ReadOnlyStore()
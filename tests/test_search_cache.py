@@ -0,0 +1,51 @@
+import asyncio
+
+import search_query
+from search_cache import get_cached_search, record_size
+
+
+class FakeSearchResults:
+    def __init__(self, docs):
+        self._docs = docs
+
+    def __aiter__(self):
+        async def iterate():
+            for doc in self._docs:
+                yield doc
+        return iterate()
+
+
+class NullFieldSearchClient:
+    """Azure Search returning documents whose fields are present but null."""
+
+    async def search(self, search_text, top, **kwargs):
+        return FakeSearchResults([
+            {"title": None, "chunk": "Annual leave is 25 days.", "parent_id": "https://example/leave.pdf",
+             "@search.score": 2.0},
+            {"title": "Sick leave", "chunk": None, "parent_id": None, "@search.score": 1.0},
+        ])
+
+
+CONFIG = {
+    'azure_search_endpoint': 'https://search.example',
+    'azure_search_index_name': 'null-fields',
+    'semantic_configuration_name': 'semantic',
+    'search_client': NullFieldSearchClient(),
+}
+
+
+def test_null_title_document_is_cached():
+    key = ("null-fields", "semantic", "annual leave", 2, ())
+
+    records = asyncio.run(search_query._run_search(CONFIG, key, "annual leave", 2))
+
+    assert [record["title"] for record in records] == ["N/A", "Sick leave"]
+    assert records[1]["chunk"] == "N/A"
+    assert isinstance(records[1]["parent_id"], str)
+    assert get_cached_search(key) == records
+
+
+def test_record_size_tolerates_null_fields():
+    assert record_size({"title": None, "chunk": "abc", "parent_id": None}) == record_size(
+        {"title": "", "chunk": "abc", "parent_id": ""}
+    )
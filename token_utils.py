@@ -0,0 +1,70 @@
+# token_utils.py
+import os
+import logging
+
+# tiktoken encoding of the deployed chat model (o200k_base: gpt-4o family).
+TOKENIZER_ENCODING = os.getenv('TOKENIZER_ENCODING', 'o200k_base')
+
+# tiktoken downloads the BPE file on first use unless TIKTOKEN_CACHE_DIR already holds it.
+# Default to a directory shipped with the app; populate it at build time with
+# `python token_utils.py` (needs network once) so workers never download at startup.
+TIKTOKEN_CACHE_DIR = os.environ.setdefault(
+    'TIKTOKEN_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tiktoken_cache')
+)
+
+# Average characters per token for English prose with GPT tokenizers
+CHARS_PER_TOKEN = 4
+
+_encoding = None
+
+logger = logging.getLogger(__name__)
+
+
+def init_tokenizer():
+    """
+    Load the tiktoken encoding. Called once at startup (off the event loop);
+    until it succeeds, counts fall back to the character estimate.
+    """
+    global _encoding
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        logger.info("Tokenizer loaded", extra={"encoding": TOKENIZER_ENCODING})
+    except Exception as e:
+        # Context packing and history budgets are only approximate from here on
+        logger.error(
+            "Tokenizer %s unavailable, estimating tokens from length: %s", TOKENIZER_ENCODING, e,
+            extra={"tiktoken_cache_dir": TIKTOKEN_CACHE_DIR}
+        )
+    return _encoding is not None
+
+
+def estimate_tokens(text):
+    """Cheap token estimate used when no tokenizer is loaded."""
+    if not text:
+        return 0
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def count_tokens(text):
+    if not text:
+        return 0
+    if _encoding is None:
+        return estimate_tokens(text)
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut `text` to at most `max_tokens` tokens."""
+    if _encoding is None:
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    tokens = _encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return _encoding.decode(tokens[:max_tokens])
+
+
+if __name__ == "__main__":
+    # Build step: fetch the encoding into TIKTOKEN_CACHE_DIR
+    logging.basicConfig(level=logging.INFO)
+    raise SystemExit(0 if init_tokenizer() else 1)
@@ -0,0 +1,96 @@
+# ttl_cache.py
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Small in-process LRU cache with per-entry expiry and hit/miss counters.
+
+    Bounded by entry count and, optionally, by an approximate byte size computed
+    with `sizeof(value)`. Not thread-safe: it is only touched from the event loop.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, max_bytes=None, sizeof=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        if entry[0] <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[2]
+
+    def set(self, key, value, ttl_seconds=None):
+        if key in self._data:
+            self._remove(key)
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # Never cache something larger than the whole budget
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        self._data[key] = (time.monotonic() + ttl, size, value)
+        self._bytes += size
+        while len(self._data) > self.max_entries or (self.max_bytes is not None and self._bytes > self.max_bytes):
+            oldest = next(iter(self._data))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        self._remove(key)
+        return entry[2]
+
+    def clear(self):
+        self._data.clear()
+        self._bytes = 0
+
+    def items(self):
+        """Live (key, value) pairs, oldest first. Expired entries are skipped, not removed."""
+        now = time.monotonic()
+        return [(key, entry[2]) for key, entry in self._data.items() if entry[0] > now]
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        stats = {
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else None,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+        if self.max_bytes is not None:
+            stats['bytes'] = self._bytes
+            stats['max_bytes'] = self.max_bytes
+        return stats
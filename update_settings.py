@@ -1,28 +1,19 @@
 # update_settings.py
 
-import os
-import asyncpg
+import logging
 from quart import request, jsonify
-from dotenv import load_dotenv
+from db_pool import acquire
+from load_settings_and_clients_from_db import invalidate_settings_cache
 
-# Load env variables
-load_dotenv()
+logger = logging.getLogger(__name__)
 
-# Async DB config
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
-
-async def connect_db():
-    try:
-        return await asyncpg.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"Error connecting to the database: {e}")
-        return None
+def _parse_bool(value):
+    value = value.strip().lower()
+    if value in ('true', '1', 'yes', 'on'):
+        return True
+    if value in ('false', '0', 'no', 'off'):
+        return False
+    raise ValueError(value)
 
 async def update_settings():
     # Read form data
@@ -42,7 +33,13 @@ async def update_settings():
         'openai_api_key': str,
         'user_name': str,
         'login_session_id': str,
-        'number_of_chunks': int
+        'number_of_chunks': int,
+        'context_token_budget': int,
+        'max_chunk_tokens': int,
+        'request_timeout_seconds': float,
+        'near_dedup_enabled': bool,
+        'near_dup_threshold': float,
+        'max_chunks_per_document': int
 
     }
 
@@ -53,6 +50,8 @@ async def update_settings():
                     insert_fields[field] = float(form.get(field))
                 elif field_type == int:
                     insert_fields[field] = int(form.get(field))
+                elif field_type == bool:
+                    insert_fields[field] = _parse_bool(form.get(field))
                 else:
                     insert_fields[field] = form.get(field)
             except ValueError:
@@ -61,10 +60,6 @@ async def update_settings():
     if not insert_fields:
         return jsonify({'error': 'No valid fields provided to insert'}), 400
 
-    conn = await connect_db()
-    if conn is None:
-        return jsonify({'error': 'Database connection failed'}), 500
-
     try:
         # Build INSERT query dynamically
         columns = ', '.join(insert_fields.keys())
@@ -78,8 +73,11 @@ async def update_settings():
         """
 
         # Execute query and get the new update_id
-        new_update_id = await conn.fetchval(query, *values)
-        await conn.close()
+        async with acquire() as conn:
+            new_update_id = await conn.fetchval(query, *values)
+
+        # Make this worker pick up the new row on its next /ask
+        invalidate_settings_cache()
 
         return jsonify({
             'message': f'New settings row created successfully with update_id={new_update_id}',
@@ -87,5 +85,5 @@ async def update_settings():
         })
 
     except Exception as e:
-        print(f"Database error: {e}")
+        logger.error("Database error: %s", e)
         return jsonify({'error': str(e)}), 500
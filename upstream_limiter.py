@@ -0,0 +1,222 @@
+# upstream_limiter.py
+"""
+Admission control and throttling-aware retries for Azure OpenAI and Azure
+AI Search calls.
+
+Each upstream target (an OpenAI deployment, a search index) gets a limiter:
+at most N calls in flight, at most M requests waiting for a slot, and a
+wait timeout. Calls that are throttled (429) or hit a transient 5xx are
+retried with jittered exponential backoff, honouring Retry-After when the
+service sends one. When the queue is full, the wait times out or retries
+run out, UpstreamBusy is raised and the route answers 503 + Retry-After
+instead of a generic 500.
+
+The SDK clients are created with their own retries disabled (see
+load_settings_and_clients_from_db.py) so attempts are not multiplied.
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import email.utils
+from contextlib import asynccontextmanager
+
+import openai
+from azure.core.exceptions import HttpResponseError, ServiceRequestError, ServiceResponseError
+
+from deadlines import cap_timeout, remaining
+from metrics import UPSTREAM_IN_FLIGHT, UPSTREAM_WAITING, UPSTREAM_WAIT_SECONDS, UPSTREAM_RETRIES, UPSTREAM_REJECTIONS
+
+# Concurrent calls per OpenAI deployment / per search index
+OPENAI_MAX_IN_FLIGHT = int(os.getenv('OPENAI_MAX_IN_FLIGHT', '16'))
+SEARCH_MAX_IN_FLIGHT = int(os.getenv('SEARCH_MAX_IN_FLIGHT', '32'))
+# Requests allowed to wait for a slot, and for how long
+UPSTREAM_MAX_WAITING = int(os.getenv('UPSTREAM_MAX_WAITING', '100'))
+UPSTREAM_WAIT_TIMEOUT_SECONDS = float(os.getenv('UPSTREAM_WAIT_TIMEOUT_SECONDS', '10'))
+# Retries after a throttled / transient failure (0 disables retrying)
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '3'))
+UPSTREAM_BACKOFF_BASE_SECONDS = float(os.getenv('UPSTREAM_BACKOFF_BASE_SECONDS', '0.5'))
+UPSTREAM_BACKOFF_MAX_SECONDS = float(os.getenv('UPSTREAM_BACKOFF_MAX_SECONDS', '8'))
+# A Retry-After longer than this is not waited for; the caller gets 503 instead
+UPSTREAM_RETRY_AFTER_MAX_SECONDS = float(os.getenv('UPSTREAM_RETRY_AFTER_MAX_SECONDS', '20'))
+
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamBusy(Exception):
+    """An upstream service is saturated or throttling; retry after `retry_after` seconds."""
+
+    def __init__(self, message, retry_after=1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _status_and_headers(error):
+    """(status_code, response headers) of a retryable upstream error, else (None, None)."""
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code, error.response.headers
+    # Transport failures (connection reset, DNS, read timeout): the SDK retries
+    # that used to cover these are disabled, so they are retried here
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError, ServiceRequestError, ServiceResponseError)):
+        return 503, {}
+    if isinstance(error, HttpResponseError) and error.status_code is not None:
+        response = error.response
+        return error.status_code, (response.headers if response is not None else {})
+    return None, None
+
+
+def parse_retry_after(headers):
+    """Seconds to wait according to retry-after-ms / retry-after (seconds or HTTP date), or None."""
+    if not headers:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt):
+    """Full-jitter exponential backoff for retry number `attempt` (1-based)."""
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX_SECONDS, UPSTREAM_BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+class UpstreamLimiter:
+    """Concurrency limit + bounded wait queue + retries for one upstream target."""
+
+    def __init__(self, kind, target, max_in_flight):
+        self.kind = kind
+        self.target = target
+        self.max_in_flight = max_in_flight
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._in_flight = 0
+        self._waiting = 0
+        self._stats = {
+            'calls': 0,
+            'retries': 0,
+            'rejected_queue_full': 0,
+            'rejected_wait_timeout': 0,
+            'rejected_throttled': 0,
+        }
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one in-flight slot, waiting in the bounded queue if necessary."""
+        if not self._semaphore.locked():
+            # Free slot: take it without queueing
+            await self._semaphore.acquire()
+            UPSTREAM_WAIT_SECONDS.labels(self.kind).observe(0.0)
+        else:
+            if self._waiting >= UPSTREAM_MAX_WAITING:
+                self._reject('queue_full')
+                raise UpstreamBusy(f"{self.kind} is saturated, try again shortly")
+
+            start = time.perf_counter()
+            self._waiting += 1
+            UPSTREAM_WAITING.labels(self.kind).inc()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), cap_timeout(UPSTREAM_WAIT_TIMEOUT_SECONDS))
+            except asyncio.TimeoutError:
+                self._reject('wait_timeout')
+                raise UpstreamBusy(f"Timed out waiting for {self.kind}, try again shortly")
+            finally:
+                self._waiting -= 1
+                UPSTREAM_WAITING.labels(self.kind).dec()
+            UPSTREAM_WAIT_SECONDS.labels(self.kind).observe(time.perf_counter() - start)
+
+        self._in_flight += 1
+        UPSTREAM_IN_FLIGHT.labels(self.kind).inc()
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            UPSTREAM_IN_FLIGHT.labels(self.kind).dec()
+            self._semaphore.release()
+
+    async def retrying(self, factory):
+        """
+        `await factory()`, retrying throttled / transient failures. The caller
+        should hold a slot; it is kept during backoff so a throttled target
+        sees less concurrency, not more.
+        """
+        attempt = 0
+        while True:
+            try:
+                return await factory()
+            except Exception as e:
+                status, headers = _status_and_headers(e)
+                if status not in RETRYABLE_STATUS_CODES:
+                    raise
+                retry_after = parse_retry_after(headers)
+                attempt += 1
+                delay = retry_after if retry_after is not None else backoff_delay(attempt)
+                left = remaining()
+                if (attempt > UPSTREAM_MAX_RETRIES or (retry_after or 0) > UPSTREAM_RETRY_AFTER_MAX_SECONDS
+                        or (left is not None and delay >= left)):
+                    self._reject('throttled')
+                    raise UpstreamBusy(
+                        f"{self.kind} is throttling (HTTP {status}), try again shortly",
+                        retry_after=retry_after or UPSTREAM_BACKOFF_BASE_SECONDS * 2 ** attempt
+                    ) from e
+                self._stats['retries'] += 1
+                UPSTREAM_RETRIES.labels(self.kind, str(status)).inc()
+                logger.warning("%s %s returned HTTP %s, retry %d in %.2fs",
+                               self.kind, self.target, status, attempt, delay)
+                await asyncio.sleep(delay)
+
+    async def call(self, factory):
+        """Run `await factory()` within a slot, with retries."""
+        self._stats['calls'] += 1
+        async with self.slot():
+            return await self.retrying(factory)
+
+    def _reject(self, reason):
+        self._stats[f'rejected_{reason}'] += 1
+        UPSTREAM_REJECTIONS.labels(self.kind, reason).inc()
+
+    def stats(self):
+        return {
+            **self._stats,
+            'in_flight': self._in_flight,
+            'waiting': self._waiting,
+            'max_in_flight': self.max_in_flight,
+        }
+
+
+_limiters = {}
+
+
+def get_limiter(kind, target):
+    """The shared limiter for an upstream target: kind "openai" (per deployment) or "search" (per index)."""
+    limiter = _limiters.get((kind, target))
+    if limiter is None:
+        max_in_flight = OPENAI_MAX_IN_FLIGHT if kind == 'openai' else SEARCH_MAX_IN_FLIGHT
+        limiter = _limiters[(kind, target)] = UpstreamLimiter(kind, target, max_in_flight)
+    return limiter
+
+
+def openai_limiter(config):
+    return get_limiter('openai', f"{config['openai_endpoint']}|{config['deployment_name']}")
+
+
+def search_limiter(config):
+    return get_limiter('search', f"{config['azure_search_endpoint']}|{config['azure_search_index_name']}")
+
+
+def get_upstream_stats():
+    return {f"{kind}:{target}": limiter.stats() for (kind, target), limiter in _limiters.items()}
@@ -1,23 +1,8 @@
 # user_login_log.py
 
-import asyncpg
 from quart import request, jsonify
-import os
 from datetime import datetime
-from dotenv import load_dotenv  
-
-load_dotenv()
-
-DB_CONFIG = {
-    'user': os.getenv('DB_USER'),
-    'password': os.getenv('DB_PASSWORD'),
-    'database': os.getenv('DB_NAME'),
-    'host': os.getenv('DB_HOST'),
-    'port': os.getenv('DB_PORT')
-}
-
-async def get_db_connection():
-    return await asyncpg.connect(**DB_CONFIG)
+from db_pool import acquire
 
 async def log_user():
     data = await request.get_json()
@@ -27,17 +12,16 @@ async def log_user():
     user_name = data['user_name']
 
     try:
-        conn = await get_db_connection()
-
+        # Fast path: not batched, because the caller needs the generated
+        # login_session_id back. One pooled round-trip with a cached statement.
         insert_query = """
             INSERT INTO azaisearch_login_log (user_name)
             VALUES ($1)
             RETURNING login_session_id, user_name, date_and_time;
         """
 
-        row = await conn.fetchrow(insert_query, user_name)
-
-        await conn.close()
+        async with acquire() as conn:
+            row = await conn.fetchrow(insert_query, user_name)
 
         return jsonify({
             'message': 'User logged successfully',